@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: document_cache.py
+@time: 2025-11-22
+@desc: 基于文件内容的 RAG 缓存键计算，以及记录 路径 -> 内容键 映射的 manifest
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from ..config import deep_reader_config
+from .embedding_provider import get_embedding_provider
+
+# 与向量数据库放在同一目录下: backend/memory/manifest.json
+DEFAULT_MANIFEST_PATH = Path(__file__).resolve().parent.parent / "memory" / "manifest.json"
+
+# 流式哈希时每次读取的字节数
+_HASH_READ_SIZE = 1024 * 1024
+
+
+def compute_file_digest(file_path: str) -> str:
+    """
+    以流式方式计算文件内容的 sha256，不会把整个文件读入内存。
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_content_key(content_digest: str) -> str:
+    """
+    将文档内容摘要与分块、Embedding 参数组合成 RAG 缓存键（即 db_name）。
+    任一参数变化都会得到新的键，避免复用以不同方式构建的向量。
+    """
+    params = {
+        "content": content_digest,
+        "chunk_size": deep_reader_config.RAG_CHUNK_SIZE,
+        "chunk_overlap": deep_reader_config.RAG_CHUNK_OVERLAP,
+        "embedding_model": deep_reader_config.EMBEDDING_MODEL,
+    }
+    if deep_reader_config.RAG_CHUNKING != "flat":
+        # 父子分块写入分块方式和两级块大小；平铺分块时已有文档的缓存键保持不变
+        params["chunking"] = deep_reader_config.RAG_CHUNKING
+        params["parent_chunk_size"] = deep_reader_config.RAG_PARENT_CHUNK_SIZE
+        params["child_chunk_size"] = deep_reader_config.RAG_CHILD_CHUNK_SIZE
+    if deep_reader_config.EMBEDDING_DIMENSIONS:
+        # 缩短维度或改变存储精度时写入对应参数；默认（原生维度、float32）时已有文档的缓存键保持不变
+        params["dimensions"] = deep_reader_config.EMBEDDING_DIMENSIONS
+    if deep_reader_config.VECTOR_STORAGE != "float32":
+        params["storage"] = deep_reader_config.VECTOR_STORAGE
+    if deep_reader_config.EMBEDDING_PROVIDER != "openai":
+        # 非默认的 Embedding 后端才写入后端信息，使用 OpenAI 时已有文档的缓存键保持不变
+        params["embedding_model"] = get_embedding_provider().model_id
+    payload = json.dumps(params, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:32]
+
+
+class DocumentManifest:
+    """
+    记录 文档路径 -> 内容键 的小型 JSON manifest，线程安全。
+
+    同时保存文件的 size 和 mtime：文件未变化时直接复用已记录的内容键，
+    无需重新对大文件做哈希。
+    """
+
+    def __init__(self, manifest_path: str = str(DEFAULT_MANIFEST_PATH)):
+        self.manifest_path = manifest_path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logging.warning(f"[DocumentManifest] 无法读取 manifest，将重新创建: {e}")
+            return {}
+
+    def _save_locked(self):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def get(self, document_path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(document_path)
+            return dict(entry) if entry else None
+
+    def record(self, document_path: str, content_key: str, **extra: Any):
+        with self._lock:
+            self._entries[document_path] = {
+                "content_key": content_key,
+                "updated_at": time.time(),
+                **extra,
+            }
+            self._save_locked()
+
+    def remove_content_key(self, content_key: str):
+        """删除所有指向某个内容键的路径记录（该键对应的数据库被删除时调用）"""
+        with self._lock:
+            stale = [p for p, e in self._entries.items() if e.get("content_key") == content_key]
+            for path in stale:
+                del self._entries[path]
+            if stale:
+                self._save_locked()
+
+    def resolve_content_key(self, document_path: str, raw_markdown_content: Optional[str] = None) -> str:
+        """
+        计算文档的 RAG 缓存键。
+
+        - 本地文件：按文件字节的流式 sha256 计算；size/mtime 未变化时复用 manifest 中的记录
+        - 非本地文件（如 URL）：按已解析的 Markdown 内容计算，没有内容时退化为按路径计算
+        """
+        if os.path.isfile(document_path):
+            stat = os.stat(document_path)
+            entry = self.get(document_path) or {}
+            unchanged = entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime
+            if unchanged and entry.get("content_digest"):
+                digest = entry["content_digest"]
+            else:
+                digest = compute_file_digest(document_path)
+            # 分块/Embedding 参数变化时，即使文件未变也会得到新的键
+            content_key = build_content_key(digest)
+            if not unchanged or entry.get("content_key") != content_key:
+                self.record(document_path, content_key, content_digest=digest, size=stat.st_size, mtime=stat.st_mtime)
+            return content_key
+
+        if raw_markdown_content:
+            digest = hashlib.sha256(raw_markdown_content.encode("utf-8")).hexdigest()
+        else:
+            digest = hashlib.sha256(document_path.encode("utf-8")).hexdigest()
+        content_key = build_content_key(digest)
+        if (self.get(document_path) or {}).get("content_key") != content_key:
+            self.record(document_path, content_key, content_digest=digest)
+        return content_key
+
+
+_global_manifest: Optional[DocumentManifest] = None
+_global_manifest_lock = threading.Lock()
+
+
+def get_document_manifest() -> DocumentManifest:
+    """获取全局文档 manifest 实例"""
+    global _global_manifest
+    with _global_manifest_lock:
+        if _global_manifest is None:
+            _global_manifest = DocumentManifest()
+        return _global_manifest
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: embedding_cache.py
+@time: 2025-11-21
+@desc: 基于 SQLite 的持久化 Embedding 缓存，按 (模型名, 文本 sha256) 去重，避免重复向量化相同文本
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from ..config import deep_reader_config
+
+# 与向量数据库放在同一目录下: backend/memory/embedding_cache.sqlite
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent.parent / "memory" / "embedding_cache.sqlite"
+
+# SQLite 单条语句允许的最大参数个数（旧版本默认 999），留出 model 参数的位置
+_SQLITE_MAX_VARIABLES = 900
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    持久化 Embedding 缓存，线程安全。
+
+    - 以 (model, sha256(text)) 为键，向量以 float32 二进制存储
+    - 支持批量查询和批量写入
+    - 条目数超过 max_entries 时按最近访问时间（LRU）淘汰
+    """
+
+    def __init__(self, db_path: str = str(DEFAULT_CACHE_PATH), max_entries: int = 100_000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        批量查询缓存。返回与 texts 一一对应的列表，未命中的位置为 None。
+        """
+        hashes = [_text_hash(t) for t in texts]
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+
+        with self._lock:
+            cursor = self._conn.cursor()
+            for start in range(0, len(unique_hashes), _SQLITE_MAX_VARIABLES):
+                batch = unique_hashes[start:start + _SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                )
+                for text_hash, blob in cursor.fetchall():
+                    found[text_hash] = np.frombuffer(blob, dtype="float32").tolist()
+
+            if found:
+                # 刷新命中条目的访问时间，供 LRU 淘汰使用
+                now = time.time()
+                cursor.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+
+        return [found.get(h) for h in hashes]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """
+        批量写入缓存，写入后如超出容量则按 LRU 淘汰。
+        """
+        if not texts:
+            return
+        now = time.time()
+        rows = [
+            (model, _text_hash(t), np.asarray(v, dtype="float32").tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._count += len(rows)
+            if self._count > self.max_entries:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        """在持有 _lock 时调用：删除最久未访问的条目，保留 90% 容量作为余量"""
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._count - int(self.max_entries * 0.9)
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,),
+        )
+        self._conn.commit()
+        self._count -= excess
+        logging.info(f"[EmbeddingCache] LRU 淘汰 {excess} 条缓存向量")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    包装任意 LangChain Embeddings：先查持久化缓存，只对未命中的文本调用底层模型。
+    """
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache, namespace: str):
+        self.underlying = underlying
+        self.cache = cache
+        # 缓存键中的模型名部分，不同模型/维度的向量互不混用
+        self.namespace = namespace
+
+    def __getattr__(self, name):
+        # 透传底层模型的其他属性（如 model、dimensions）
+        if name == "underlying":
+            raise AttributeError(name)
+        return getattr(self.underlying, name)
+
+    def _split_misses(self, texts: List[str]):
+        cached = self.cache.get_many(self.namespace, texts)
+        # 同一批次中重复的文本只向量化一次
+        misses = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        return cached, misses
+
+    def _merge(self, texts: List[str], cached: List[Optional[List[float]]], misses: List[str], new_vectors):
+        computed = dict(zip(misses, new_vectors))
+        if misses:
+            logging.debug(f"[EmbeddingCache] 命中 {len(texts) - len(misses)}/{len(texts)}，新向量化 {len(misses)} 条")
+        return [v if v is not None else computed[t] for t, v in zip(texts, cached)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        cached, misses = self._split_misses(texts)
+        new_vectors = self.underlying.embed_documents(misses) if misses else []
+        self.cache.put_many(self.namespace, misses, new_vectors)
+        return self._merge(texts, cached, misses, new_vectors)
+
+    def embed_query(self, text: str) -> List[float]:
+        cached = self.cache.get_many(self.namespace, [text])[0]
+        if cached is not None:
+            return cached
+        vector = self.underlying.embed_query(text)
+        self.cache.put_many(self.namespace, [text], [vector])
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        cached, misses = await asyncio.to_thread(self._split_misses, texts)
+        new_vectors = await self.underlying.aembed_documents(misses) if misses else []
+        await asyncio.to_thread(self.cache.put_many, self.namespace, misses, new_vectors)
+        return self._merge(texts, cached, misses, new_vectors)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        cached = (await asyncio.to_thread(self.cache.get_many, self.namespace, [text]))[0]
+        if cached is not None:
+            return cached
+        vector = await self.underlying.aembed_query(text)
+        await asyncio.to_thread(self.cache.put_many, self.namespace, [text], [vector])
+        return vector
+
+
+_global_embedding_cache: Optional[EmbeddingCache] = None
+_global_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """获取全局 Embedding 缓存实例（首次调用时创建缓存文件）"""
+    global _global_embedding_cache
+    with _global_embedding_cache_lock:
+        if _global_embedding_cache is None:
+            _global_embedding_cache = EmbeddingCache(max_entries=deep_reader_config.EMBEDDING_CACHE_MAX_ENTRIES)
+        return _global_embedding_cache
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: embedding_provider.py
+@time: 2025-12-02
+@desc: 可插拔的 Embedding 后端：OpenAI API、本地 CPU 模型（sentence-transformers，可选 ONNX 推理）
+       以及用于测试和离线运行的确定性哈希向量。每个向量库在 store_meta 中记录构建它的模型 id
+"""
+import abc
+import hashlib
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from ..config import deep_reader_config
+
+# OpenAI 各 Embedding 模型的原生向量维度
+_OPENAI_NATIVE_DIMENSIONS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+
+# 哈希向量使用的特征：英文/数字词，以及中日韩字符的单字和相邻双字
+_HASH_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9.,%_\-]*|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingProvider(abc.ABC):
+    """
+    Embedding 后端的统一接口。
+
+    - model_id 形如 "openai:text-embedding-3-large"，记录在向量库的 store_meta 中，
+      打开已有的库时按记录的 model_id 还原后端，保证查询与入库使用同一个模型
+    - native_dimension() 为模型的原生维度，新建的库默认使用该维度
+    - create(dimensions) 返回 LangChain Embeddings 实例，输出已归一化的向量
+    """
+    name: str = ""
+    # 是否通过持久化 Embedding 缓存包装（哈希向量的计算比查缓存还快，不需要缓存）
+    cacheable: bool = True
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @property
+    def model_id(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    @abc.abstractmethod
+    def native_dimension(self) -> int:
+        ...
+
+    @abc.abstractmethod
+    def create(self, dimensions: Optional[int] = None) -> Embeddings:
+        ...
+
+    def cache_namespace(self, dimensions: Optional[int] = None) -> str:
+        """持久化 Embedding 缓存中的命名空间，不同模型/维度的向量互不混用"""
+        if dimensions is None or dimensions == self.native_dimension():
+            return self.model_id
+        return f"{self.model_id}@{dimensions}"
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI Embedding API，text-embedding-3 系列通过 dimensions 参数请求缩短后的向量"""
+    name = "openai"
+
+    def native_dimension(self) -> int:
+        return _OPENAI_NATIVE_DIMENSIONS.get(self.model, 3072)
+
+    def create(self, dimensions: Optional[int] = None) -> Embeddings:
+        if dimensions == self.native_dimension():
+            dimensions = None
+        return OpenAIEmbeddings(
+            model=self.model,
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            dimensions=dimensions,
+        )
+
+    def cache_namespace(self, dimensions: Optional[int] = None) -> str:
+        # 沿用引入本模块之前的命名空间（不带 "openai:" 前缀），已缓存的向量继续有效
+        if dimensions is None or dimensions == self.native_dimension():
+            return self.model
+        return f"{self.model}@{dimensions}"
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    本地 sentence-transformers 模型：按批次在 CPU 上推理，输出归一化向量。
+    dimensions 小于模型原生维度时截取前 dimensions 维并重新归一化（仅适用于 Matryoshka 训练的模型）。
+    模型在第一次向量化时才加载，只做全文检索或只读取块内容的实例不加载权重。
+    """
+
+    def __init__(self, model_name: str, backend: str, dimensions: Optional[int] = None, batch_size: int = 64):
+        self.model_name = model_name
+        self.backend = backend
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+
+    @property
+    def model(self):
+        return _load_local_model(self.model_name, self.backend)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype("float32")
+        if self.dimensions and self.dimensions < vectors.shape[1]:
+            vectors = _normalize_rows(vectors[:, :self.dimensions])
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._encode(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+# 已加载的本地模型，按 (模型名, 推理后端) 在进程内共享，避免每个向量库实例重复加载权重
+_local_models: Dict[Tuple[str, str], Any] = {}
+_local_models_lock = threading.Lock()
+
+
+def _load_local_model(model: str, backend: str):
+    with _local_models_lock:
+        key = (model, backend)
+        if key not in _local_models:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise ImportError(
+                    "本地 Embedding 后端需要安装 sentence-transformers: pip install sentence-transformers"
+                    "（ONNX 推理另需 pip install 'sentence-transformers[onnx]'）"
+                ) from e
+            threads = deep_reader_config.LOCAL_EMBEDDING_THREADS
+            if threads:
+                import torch
+                torch.set_num_threads(threads)
+            logging.info(f"[EmbeddingProvider] 加载本地 Embedding 模型: {model}（{backend}）")
+            kwargs = {"backend": backend} if backend != "torch" else {}
+            _local_models[key] = SentenceTransformer(model, device="cpu", **kwargs)
+        return _local_models[key]
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """本地 CPU 模型（sentence-transformers），查询无需网络往返"""
+    name = "local"
+
+    def __init__(self, model: str, backend: Optional[str] = None):
+        super().__init__(model)
+        self.backend = backend or deep_reader_config.LOCAL_EMBEDDING_BACKEND
+
+    def native_dimension(self) -> int:
+        return _load_local_model(self.model, self.backend).get_sentence_embedding_dimension()
+
+    def create(self, dimensions: Optional[int] = None) -> Embeddings:
+        return LocalEmbeddings(
+            self.model,
+            self.backend,
+            dimensions=dimensions,
+            batch_size=deep_reader_config.LOCAL_EMBEDDING_BATCH_SIZE,
+        )
+
+    def cache_namespace(self, dimensions: Optional[int] = None) -> str:
+        # 不与原生维度比较，打开已有的库时不必为了确定缓存命名空间而加载模型
+        if dimensions is None:
+            return self.model_id
+        return f"{self.model_id}@{dimensions}"
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    确定性的哈希向量（feature hashing）：将词和中文单字/双字哈希到固定维度并归一化。
+    不理解语义，只反映字面重合度；不依赖网络和模型文件，用于测试和离线运行。
+    """
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for token in _HASH_TOKEN_PATTERN.findall(text.lower()):
+            if token.isascii():
+                features.append(token.strip(".,-"))
+            else:
+                features.extend(token)
+                features.extend(token[i:i + 2] for i in range(len(token) - 1))
+        return features
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype="float32")
+        for feature in self._features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            # 低位决定下标，最高位决定符号，减少哈希碰撞带来的偏差
+            vector[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text).tolist()
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """确定性哈希向量，model 为维度（如 "hashing:256"）"""
+    name = "hashing"
+    cacheable = False
+
+    def __init__(self, model: Optional[str] = None):
+        super().__init__(model or str(deep_reader_config.HASH_EMBEDDING_DIMENSIONS))
+
+    def native_dimension(self) -> int:
+        return int(self.model)
+
+    def create(self, dimensions: Optional[int] = None) -> Embeddings:
+        return HashingEmbeddings(dimensions or self.native_dimension())
+
+
+_PROVIDERS = {
+    "openai": OpenAIEmbeddingProvider,
+    "local": LocalEmbeddingProvider,
+    "hashing": HashingEmbeddingProvider,
+}
+
+
+def get_embedding_provider(name: Optional[str] = None, model: Optional[str] = None) -> EmbeddingProvider:
+    """
+    按名称创建 Embedding 后端，未指定时使用 DeepReaderConfig.EMBEDDING_PROVIDER；
+    model 未指定时 openai 使用 EMBEDDING_MODEL，local 使用 LOCAL_EMBEDDING_MODEL。
+    """
+    name = name or deep_reader_config.EMBEDDING_PROVIDER
+    if name not in _PROVIDERS:
+        raise ValueError(f"不支持的 Embedding 后端: {name}，可选 {' / '.join(_PROVIDERS)}")
+    if name == "openai":
+        return OpenAIEmbeddingProvider(model or deep_reader_config.EMBEDDING_MODEL)
+    if name == "local":
+        return LocalEmbeddingProvider(model or deep_reader_config.LOCAL_EMBEDDING_MODEL)
+    return HashingEmbeddingProvider(model)
+
+
+def provider_from_model_id(model_id: str) -> EmbeddingProvider:
+    """按 store_meta 中记录的 model_id（"后端:模型"）还原 Embedding 后端"""
+    name, _, model = model_id.partition(":")
+    return get_embedding_provider(name, model or None)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: embedding_scheduler.py
+@time: 2025-11-24
+@desc: 入库向量化调度器：按 token 数切分批次，多个批次并发请求，遇到 429 时自适应降低并发并退避重试
+"""
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+# 一个批次在原始文本列表中的 [start, end) 区间
+BatchRange = Tuple[int, int]
+
+
+def plan_token_batches(
+    token_counts: Sequence[int],
+    max_tokens: int,
+    max_items: int,
+    offset: int = 0,
+) -> List[BatchRange]:
+    """
+    按 token 数将连续的文本切分为批次：每批总 token 数不超过 max_tokens，条数不超过 max_items。
+    单条文本超过 max_tokens 时独占一个批次。
+
+    Args:
+        token_counts: 每条文本的 token 数。
+        max_tokens: 每批允许的最大 token 总数。
+        max_items: 每批允许的最大条数。
+        offset: 返回区间相对于原始列表的起始偏移（用于断点续传）。
+    """
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, count in enumerate(token_counts):
+        if i > start and (batch_tokens + count > max_tokens or i - start >= max_items):
+            batches.append((offset + start, offset + i))
+            start = i
+            batch_tokens = 0
+        batch_tokens += count
+    if start < len(token_counts):
+        batches.append((offset + start, offset + len(token_counts)))
+    return batches
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    """判断异常是否为 429 限流错误（兼容 openai SDK 与其他 HTTP 客户端）"""
+    if type(error).__name__ == "RateLimitError":
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """从 429 响应的 Retry-After 头中读取建议的等待秒数"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingBatchScheduler:
+    """
+    有界并发的向量化调度器。
+
+    - 同时最多保持 concurrency 个请求在途，concurrency 在 [1, max_concurrency] 之间自适应调整：
+      遇到 429 时减半并按指数退避（带抖动）重试，连续成功后逐步恢复
+    - 批次结果按原始顺序交给 on_batch 提交，保证断点续传的高水位始终连续
+    - 已发出但尚未提交的批次最多为 2 * max_concurrency 个，内存占用有界
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.concurrency = self.max_concurrency
+        self._successes = 0
+
+    def _on_success(self):
+        self._successes += 1
+        if self.concurrency < self.max_concurrency and self._successes >= self.concurrency:
+            self.concurrency += 1
+            self._successes = 0
+            logging.info(f"[EmbeddingScheduler] 并发数恢复到 {self.concurrency}")
+
+    def _on_rate_limited(self):
+        self._successes = 0
+        if self.concurrency > 1:
+            self.concurrency = max(1, self.concurrency // 2)
+            logging.warning(f"[EmbeddingScheduler] 触发限流，并发数降低到 {self.concurrency}")
+
+    async def _embed_with_backoff(
+        self,
+        batch_index: int,
+        batch: BatchRange,
+        embed_batch: Callable[[int, int], Awaitable[List[List[float]]]],
+    ) -> Tuple[int, List[List[float]]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                vectors = await embed_batch(*batch)
+                self._on_success()
+                return batch_index, vectors
+            except Exception as e:
+                if not _is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                self._on_rate_limited()
+                delay = _retry_after_seconds(e)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * (2 ** attempt)) * random.uniform(0.5, 1.5)
+                logging.warning(
+                    f"[EmbeddingScheduler] 第 {batch_index + 1} 批被限流 (429)，{delay:.1f}s 后重试 "
+                    f"({attempt + 1}/{self.max_retries})"
+                )
+                await asyncio.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def run(
+        self,
+        batches: List[BatchRange],
+        embed_batch: Callable[[int, int], Awaitable[List[List[float]]]],
+        on_batch: Callable[[int, BatchRange, List[List[float]]], Awaitable[None]],
+    ):
+        """
+        并发向量化所有批次，并按顺序调用 on_batch 提交结果。任一批次失败时取消其余请求并抛出异常，
+        此前已按顺序提交的批次保持有效。
+
+        Args:
+            batches: plan_token_batches 返回的批次区间。
+            embed_batch: 对 [start, end) 区间的文本进行向量化的协程函数。
+            on_batch: 提交一个批次结果的协程函数，参数为 (批次序号, 区间, 向量)。
+        """
+        completed: Dict[int, List[List[float]]] = {}
+        in_flight = set()
+        next_launch = 0
+        next_commit = 0
+
+        try:
+            while next_commit < len(batches):
+                while (
+                    next_launch < len(batches)
+                    and len(in_flight) < self.concurrency
+                    and next_launch - next_commit < self.max_concurrency * 2
+                ):
+                    in_flight.add(asyncio.create_task(
+                        self._embed_with_backoff(next_launch, batches[next_launch], embed_batch)
+                    ))
+                    next_launch += 1
+
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                error = None
+                for task in done:
+                    # 逐个取回结果，保证同时失败的多个批次的异常都被读取
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    batch_index, vectors = task.result()
+                    completed[batch_index] = vectors
+                if error is not None:
+                    raise error
+
+                while next_commit in completed:
+                    await on_batch(next_commit, batches[next_commit], completed.pop(next_commit))
+                    next_commit += 1
+        finally:
+            for task in in_flight:
+                task.cancel()
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
@@ -3,10 +3,104 @@
 dynamic-gptr/gpt_researcher/utils/google_llm.py
 
 封装了调用 Google GenAI 原生 SDK 的特定逻辑。
+客户端在进程内复用（按事件循环各一个），通过 SDK 的原生异步接口 client.aio 发出请求，
+底层 httpx 连接池保持长连接，不再每次调用重新建立 TLS 连接、也不占用线程池。
 """
 import asyncio
+import logging
+import threading
+import weakref
+
+import httpx
 from google import genai
-from google.genai.types import Tool, GoogleSearch, GenerateContentConfig
+from google.genai.types import Tool, GoogleSearch, GenerateContentConfig, HttpOptions
+
+from ..config import deep_reader_config
+
+# 每个事件循环复用一个客户端（httpx 的异步连接绑定在创建它的事件循环上）。以弱引用作为键，
+# 事件循环被回收后对应的客户端随之释放，不同线程中的事件循环各自持有自己的客户端
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, genai.Client]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+# 启用 Google 搜索工具的生成配置，所有调用共用
+_search_config = GenerateContentConfig(tools=[Tool(google_search=GoogleSearch())])
+
+
+def _create_client() -> genai.Client:
+    config = deep_reader_config
+    limits = httpx.Limits(
+        max_connections=config.GOOGLE_GENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=config.GOOGLE_GENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.GOOGLE_GENAI_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    timeout = config.GOOGLE_GENAI_TIMEOUT_SECONDS
+    # SDK 会自动从环境变量 GOOGLE_API_KEY 读取密钥；HttpOptions.timeout 以毫秒计
+    return genai.Client(http_options=HttpOptions(
+        timeout=int(timeout * 1000) if timeout else None,
+        async_client_args={"limits": limits},
+    ))
+
+
+def _close_sync_pool(client: genai.Client):
+    """关闭客户端的同步连接池：优先使用 SDK 公开的 close()，旧版本 SDK 没有时关闭底层的 httpx 客户端"""
+    close = getattr(client, "close", None)
+    if callable(close):
+        close()
+        return
+    httpx_client = getattr(getattr(client, "_api_client", None), "_httpx_client", None)
+    if httpx_client is not None:
+        httpx_client.close()
+
+
+async def _close_async_pool(client: genai.Client):
+    """关闭客户端的异步连接池：优先使用 SDK 公开的 aio.aclose()，旧版本 SDK（如 1.20）没有时关闭底层的 httpx 客户端"""
+    aclose = getattr(getattr(client, "aio", None), "aclose", None)
+    if callable(aclose):
+        await aclose()
+        return
+    httpx_client = getattr(getattr(client, "_api_client", None), "_async_httpx_client", None)
+    if httpx_client is not None:
+        await httpx_client.aclose()
+
+
+def _discard_client(client: genai.Client):
+    """
+    释放事件循环已结束的客户端：关闭同步连接池；异步连接池所属的事件循环已关闭，无法再 await 关闭，
+    丢弃引用后由垃圾回收关闭其中的套接字
+    """
+    try:
+        _close_sync_pool(client)
+    except Exception as e:
+        logging.debug(f"关闭 Google GenAI 客户端的同步连接池失败: {e}")
+
+
+def get_google_client() -> genai.Client:
+    """获取当前事件循环复用的 Google GenAI 客户端（须在事件循环内调用）"""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        # 顺带清理事件循环已结束（如上一次 asyncio.run 退出时未调用 close_google_client）的客户端
+        for stale_loop in [other for other in _clients if other.is_closed()]:
+            _discard_client(_clients.pop(stale_loop))
+        client = _clients.get(loop)
+        if client is None:
+            client = _clients[loop] = _create_client()
+        return client
+
+
+async def close_google_client():
+    """
+    关闭当前事件循环复用的客户端及其连接池，应在事件循环结束前调用
+    （如 asyncio.run 的主协程退出时、FastAPI 应用关闭时）。关闭失败只记录警告，不影响退出流程
+    """
+    with _clients_lock:
+        client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is None:
+        return
+    try:
+        await _close_async_pool(client)
+        _close_sync_pool(client)
+    except Exception as e:
+        logging.warning(f"关闭 Google GenAI 客户端失败: {e}")
 
 
 async def call_google_llm(prompt: str, model_name: str) -> str:
@@ -19,31 +113,21 @@ async def call_google_llm(prompt: str, model_name: str) -> str:
 
     Returns:
         str: 模型返回的文本响应。
-        
+
     Raises:
         ImportError: 如果必要的 google-genai 库没有安装。
         Exception: 捕获并重新抛出任何在API调用期间发生的未知错误。
     """
     print(f"--- 正在通过原生封装调用 Google GenAI SDK: {model_name} ---")
     try:
-        # 1. 初始化原生客户端
-        # SDK 会自动从环境变量 GOOGLE_API_KEY 读取密钥
-        client = genai.Client()
-
-        # 2. 创建搜索工具和生成配置
-        google_search_tool = Tool(google_search=GoogleSearch())
-        generation_config = GenerateContentConfig(tools=[google_search_tool])
-
-        # 3. 异步生成内容
-        # 在一个线程中运行同步的SDK调用，以避免阻塞异步事件循环
-        response_object = await asyncio.to_thread(
-            client.models.generate_content,
+        # 复用客户端的连接池，通过原生异步接口生成内容，不阻塞事件循环、不占用线程
+        response_object = await get_google_client().aio.models.generate_content(
             model=model_name,
             contents=prompt,
-            config=generation_config
+            config=_search_config
         )
-        
-        # 4. 从返回对象中提取文本内容
+
+        # 从返回对象中提取文本内容
         print("--- Google GenAI 原生SDK调用成功 ---")
         return response_object.text
 
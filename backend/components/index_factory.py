@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: index_factory.py
+@time: 2025-11-25
+@desc: FAISS 索引工厂：按向量数选择 flat / HNSW / IVF-PQ 索引，负责训练、重建、查询参数设置和召回-延迟基准测试
+"""
+import logging
+import math
+import time
+from typing import Dict, Iterable, Tuple
+
+import faiss
+import numpy as np
+
+from ..config import deep_reader_config
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+
+# flat / hnsw 索引中向量的存储精度，ivfpq 自带乘积量化，不受此设置影响
+STORAGE_TYPES = ("float32", "float16", "int8")
+
+_SQ_TYPES = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# PQ 每个子量化器有 256 个码字，faiss 建议每个码字至少 39 个训练样本；
+# 向量数不足时 ivfpq 退化为 hnsw
+_IVFPQ_MIN_VECTORS = 39 * 256
+
+# 训练 IVF-PQ 时最多使用的样本数，更多样本对聚类质量提升有限但训练时间线性增长
+_MAX_TRAIN_VECTORS = 100_000
+
+# 一次性加入索引的向量数，避免大文库重建时产生过大的临时数组
+_ADD_BATCH_SIZE = 50_000
+
+# 过滤检索时候选 id 不超过该数量则对子集做精确搜索（HNSW）或探查全部聚类（IVF）：
+# 近似索引在过滤条件很严格时容易找不到足够的结果
+_EXACT_SUBSET_MAX = 50_000
+
+
+def select_index_type(n_vectors: int) -> str:
+    """按向量数自动选择索引类型（'auto' 模式）"""
+    if n_vectors >= deep_reader_config.VECTOR_INDEX_IVFPQ_THRESHOLD:
+        return "ivfpq"
+    if n_vectors >= deep_reader_config.VECTOR_INDEX_HNSW_THRESHOLD:
+        return "hnsw"
+    return "flat"
+
+
+def resolve_index_type(requested: str, n_vectors: int) -> str:
+    """
+    将配置的索引类型解析为实际要使用的类型：'auto' 按向量数选择；
+    ivfpq 在训练样本不足时退化为 hnsw。
+    """
+    if requested == "auto":
+        index_type = select_index_type(n_vectors)
+    elif requested in INDEX_TYPES:
+        index_type = requested
+    else:
+        raise ValueError(f"未知的索引类型: {requested}，可选值为 auto / {' / '.join(INDEX_TYPES)}")
+    if index_type == "ivfpq" and n_vectors < _IVFPQ_MIN_VECTORS:
+        index_type = "hnsw"
+    return index_type
+
+
+def _unwrap(index: faiss.Index) -> faiss.Index:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def read_index_mmap(faiss_path: str) -> faiss.Index:
+    """
+    以只读内存映射方式加载索引：向量数据不复制到堆内存，而是直接映射文件页，
+    同一文件被多个实例或进程打开时共享操作系统的页缓存。
+
+    - flat / 标量量化 / HNSW 的向量存储使用 IO_FLAG_MMAP_IFC（faiss >= 1.10）
+    - IVF 系列的倒排表使用 IO_FLAG_MMAP
+    - 写入方使用"临时文件 + os.replace"原子替换索引文件，已映射的旧文件在解除映射前保持有效
+
+    faiss 版本不支持对应的标志时退化为普通加载。
+    """
+    with open(faiss_path, "rb") as f:
+        fourcc = f.read(4)
+    # IVF 系列索引的类型标记以 "Iw" 开头（IwFl / IwPQ / IwSq ...）
+    if fourcc.startswith(b"Iw"):
+        flags = getattr(faiss, "IO_FLAG_MMAP", 0)
+    else:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    if not flags:
+        logging.info("[IndexFactory] 当前 faiss 版本不支持内存映射加载，使用普通加载")
+        return faiss.read_index(faiss_path)
+    return faiss.read_index(faiss_path, flags | faiss.IO_FLAG_READ_ONLY)
+
+
+def index_type_of(index: faiss.Index) -> str:
+    """识别一个已有索引的类型"""
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivfpq"
+    return "flat"
+
+
+def storage_of(index: faiss.Index) -> str:
+    """识别一个已有 flat / hnsw 索引的向量存储精度（ivfpq 返回 'float32'）"""
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        for storage, qtype in _SQ_TYPES.items():
+            if index.sq.qtype == qtype:
+                return storage
+    return "float32"
+
+
+def _ivf_nlist(n_vectors: int) -> int:
+    """IVF 聚类数取 4 * sqrt(N)，并保证每个聚类至少有 39 个训练样本"""
+    nlist = int(4 * math.sqrt(max(n_vectors, 1)))
+    return max(1, min(nlist, n_vectors // 39, 65536))
+
+
+def _pq_subquantizers(dimension: int) -> int:
+    """不超过 VECTOR_INDEX_PQ_M 且能整除维度的最大子量化器个数"""
+    m = min(deep_reader_config.VECTOR_INDEX_PQ_M, dimension)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def create_index(index_type: str, dimension: int, n_vectors: int = 0, storage: str = "float32") -> faiss.Index:
+    """
+    创建一个空的、支持 add_with_ids 的索引。ivfpq 和 int8 存储需要先用 train_index 训练，
+    n_vectors 用于确定 ivfpq 的聚类数。
+    """
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"未知的向量存储精度: {storage}，可选值为 {' / '.join(STORAGE_TYPES)}")
+    if index_type == "flat":
+        if storage == "float32":
+            return faiss.IndexIDMap(faiss.IndexFlatL2(dimension))
+        return faiss.IndexIDMap(faiss.IndexScalarQuantizer(dimension, _SQ_TYPES[storage], faiss.METRIC_L2))
+    if index_type == "hnsw":
+        m = deep_reader_config.VECTOR_INDEX_HNSW_M
+        if storage == "float32":
+            hnsw = faiss.IndexHNSWFlat(dimension, m)
+        else:
+            hnsw = faiss.IndexHNSWSQ(dimension, _SQ_TYPES[storage], m)
+        hnsw.hnsw.efConstruction = deep_reader_config.VECTOR_INDEX_EF_CONSTRUCTION
+        return faiss.IndexIDMap(hnsw)
+    if index_type == "ivfpq":
+        description = f"IVF{_ivf_nlist(n_vectors)},PQ{_pq_subquantizers(dimension)}x8"
+        return faiss.index_factory(dimension, description)
+    raise ValueError(f"未知的索引类型: {index_type}")
+
+
+def train_index(index: faiss.Index, vectors: np.ndarray):
+    """训练需要训练的索引（IVF-PQ、int8 标量量化），训练样本过多时随机抽样"""
+    if index.is_trained:
+        return
+    if len(vectors) > _MAX_TRAIN_VECTORS:
+        rng = np.random.default_rng(0)
+        vectors = vectors[rng.choice(len(vectors), _MAX_TRAIN_VECTORS, replace=False)]
+    start = time.time()
+    index.train(np.ascontiguousarray(vectors, dtype="float32"))
+    logging.info(f"[IndexFactory] 索引训练完成，样本数 {len(vectors)}，耗时 {time.time() - start:.1f}s")
+
+
+def configure_search(index: faiss.Index):
+    """按配置设置查询参数（HNSW 的 efSearch、IVF 的 nprobe），对 flat 索引无影响"""
+    index_type = index_type_of(index)
+    params = faiss.ParameterSpace()
+    if index_type == "hnsw":
+        params.set_index_parameter(index, "efSearch", deep_reader_config.VECTOR_INDEX_EF_SEARCH)
+    elif index_type == "ivfpq":
+        params.set_index_parameter(index, "nprobe", deep_reader_config.VECTOR_INDEX_NPROBE)
+
+
+def build_index(
+    index_type: str,
+    dimension: int,
+    ids: np.ndarray,
+    vectors: np.ndarray,
+    storage: str = "float32",
+) -> faiss.Index:
+    """用给定的 (id, 向量) 构建一个完整的索引：创建、训练、分批加入并设置查询参数"""
+    index = create_index(index_type, dimension, len(ids), storage=storage)
+    train_index(index, vectors)
+    for start in range(0, len(ids), _ADD_BATCH_SIZE):
+        index.add_with_ids(
+            np.ascontiguousarray(vectors[start:start + _ADD_BATCH_SIZE], dtype="float32"),
+            np.ascontiguousarray(ids[start:start + _ADD_BATCH_SIZE], dtype="int64"),
+        )
+    configure_search(index)
+    return index
+
+
+def search_subset(index: faiss.Index, queries: np.ndarray, k: int, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    只在给定 id 子集中检索，返回值与 index.search 相同（L2 距离的平方, id），结果不足 k 个时以 -1 填充。
+
+    - flat / IVF：通过 SearchParameters 的 IDSelector 在搜索时跳过子集以外的向量；
+      子集较小时 IVF 探查全部聚类，避免子集中的向量落在未探查的聚类里
+    - HNSW：图搜索在过滤条件严格时会提前陷入子集以外的区域，子集较小时取出子集向量做精确搜索，
+      否则使用 IDSelector 并放大 efSearch
+    """
+    ids = np.ascontiguousarray(ids, dtype="int64")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    if len(ids) == 0:
+        return (np.full((len(queries), k), np.inf, dtype="float32"),
+                np.full((len(queries), k), -1, dtype="int64"))
+
+    index_type = index_type_of(index)
+    small = len(ids) <= _EXACT_SUBSET_MAX
+    if index_type == "hnsw" and small:
+        index = faiss.downcast_index(index)
+        all_ids = faiss.vector_to_array(index.id_map)
+        positions = np.flatnonzero(np.isin(all_ids, ids))
+        inner = faiss.downcast_index(index.index)
+        vectors = np.vstack([inner.reconstruct(int(p)) for p in positions]) if len(positions) else None
+        result_ids = np.full((len(queries), k), -1, dtype="int64")
+        distances = np.full((len(queries), k), np.inf, dtype="float32")
+        if vectors is not None:
+            found_distances, found = faiss.knn(queries, vectors, min(k, len(positions)))
+            distances[:, :found.shape[1]] = found_distances
+            result_ids[:, :found.shape[1]] = np.where(found >= 0, all_ids[positions][found], -1)
+        return distances, result_ids
+
+    selector = faiss.IDSelectorBatch(ids)
+    if index_type == "hnsw":
+        params = faiss.SearchParametersHNSW(
+            sel=selector, efSearch=max(deep_reader_config.VECTOR_INDEX_EF_SEARCH, 4 * k)
+        )
+    elif index_type == "ivfpq":
+        ivf = faiss.extract_index_ivf(index)
+        nprobe = ivf.nlist if small else deep_reader_config.VECTOR_INDEX_NPROBE
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+
+def stored_ids(index: faiss.Index) -> np.ndarray:
+    """返回索引中全部向量的 id"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map).astype("int64")
+    ivf = faiss.extract_index_ivf(index)
+    lists = ivf.invlists
+    parts = [
+        faiss.rev_swig_ptr(lists.get_ids(list_no), lists.list_size(list_no)).copy()
+        for list_no in range(ivf.nlist)
+        if lists.list_size(list_no)
+    ]
+    return np.concatenate(parts).astype("int64") if parts else np.empty(0, dtype="int64")
+
+
+def extract_vectors(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    取出索引中的全部 (id, 向量)，用于重建为其他类型。
+    注意 IVF-PQ 和标量量化索引存储的是量化后的编码，取出的是有损的近似向量。
+    """
+    ids = stored_ids(index)
+    if len(ids) == 0:
+        return ids, np.empty((0, index.d), dtype="float32")
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return ids, faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+    ivf = faiss.extract_index_ivf(index)
+    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return ids, ivf.reconstruct_batch(ids)
+
+
+def remove_ids(index: faiss.Index, ids: np.ndarray) -> Tuple[faiss.Index, int]:
+    """
+    从索引中删除指定 id。HNSW 不支持删除，此时取出其余向量重建索引。
+
+    Returns:
+        (删除后的索引（可能是新对象）, 删除的向量数)
+    """
+    ids = np.asarray(ids, dtype="int64")
+    if len(ids) == 0:
+        return index, 0
+    if index_type_of(index) != "hnsw":
+        return index, index.remove_ids(faiss.IDSelectorBatch(ids))
+    all_ids, vectors = extract_vectors(index)
+    keep = ~np.isin(all_ids, ids)
+    rebuilt = build_index("hnsw", index.d, all_ids[keep], vectors[keep], storage=storage_of(index))
+    return rebuilt, int((~keep).sum())
+
+
+def truncate_vectors(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    """
+    将向量截断到前 dimensions 维并重新做 L2 归一化。text-embedding-3 系列采用 Matryoshka 训练，
+    截断后的结果与请求时指定 dimensions 参数得到的向量一致。
+    """
+    if dimensions >= vectors.shape[1]:
+        return vectors
+    truncated = np.ascontiguousarray(vectors[:, :dimensions], dtype="float32")
+    faiss.normalize_L2(truncated)
+    return truncated
+
+
+def sample_queries(vectors: np.ndarray, n_queries: int, seed: int = 0) -> np.ndarray:
+    """从库内随机抽样向量并加入少量噪声作为查询，模拟与文档相近但不完全相同的问题"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    noise = rng.normal(scale=float(np.std(vectors)) * 0.5, size=sample.shape).astype("float32")
+    return np.ascontiguousarray(sample + noise, dtype="float32")
+
+
+def exact_neighbors(ids: np.ndarray, vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """全精度暴力搜索，返回每个查询的前 k 个 id，作为召回率的基准"""
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(np.ascontiguousarray(vectors, dtype="float32"))
+    _, positions = exact.search(queries, k)
+    return ids[positions]
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """found 与 truth 逐行求交集，返回平均 recall@k"""
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / float(truth.size)
+
+
+def benchmark_index_types(
+    index: faiss.Index,
+    index_types: Iterable[str] = INDEX_TYPES,
+    n_queries: int = 100,
+    k: int = 10,
+    seed: int = 0,
+    storage: str = "float32",
+) -> Dict[str, Dict[str, float]]:
+    """
+    召回-延迟基准测试：用已有索引中的向量分别构建各类型索引，以精确搜索结果为基准计算 recall@k。
+
+    Returns:
+        {索引类型: {"recall": recall@k, "latency_ms": 平均单次查询毫秒数, "build_s": 构建耗时, "bytes_per_vector": 每向量字节数}}
+    """
+    ids, vectors = extract_vectors(index)
+    if len(ids) == 0:
+        raise ValueError("索引为空，无法进行基准测试")
+    queries = sample_queries(vectors, n_queries, seed)
+    truth = exact_neighbors(ids, vectors, queries, k)
+
+    results = {}
+    for index_type in index_types:
+        actual_type = resolve_index_type(index_type, len(ids))
+        if actual_type != index_type:
+            logging.warning(f"[IndexFactory] 向量数 {len(ids)} 不足以训练 {index_type}，跳过")
+            continue
+        start = time.time()
+        candidate = build_index(index_type, index.d, ids, vectors, storage=storage)
+        build_seconds = time.time() - start
+
+        start = time.time()
+        for query in queries:
+            _, found = candidate.search(query[None, :], k)
+        latency_ms = (time.time() - start) * 1000 / len(queries)
+        _, found = candidate.search(queries, k)
+
+        results[index_type] = {
+            "recall": recall_at_k(found, truth),
+            "latency_ms": latency_ms,
+            "build_s": build_seconds,
+            "bytes_per_vector": len(faiss.serialize_index(candidate)) / len(ids),
+        }
+    return results
+
+
+def main():
+    """命令行入口：对一个已有的 .faiss 索引文件运行召回-延迟基准测试"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='对 FAISS 索引文件进行 flat / hnsw / ivfpq 召回-延迟基准测试')
+    parser.add_argument('faiss_path', help='.faiss 索引文件路径')
+    parser.add_argument('-k', type=int, default=10, help='每次查询返回的结果数')
+    parser.add_argument('-n', '--queries', type=int, default=100, help='查询次数')
+    parser.add_argument('--storage', choices=STORAGE_TYPES, default='float32', help='flat / hnsw 索引的向量存储精度')
+    args = parser.parse_args()
+
+    index = faiss.read_index(args.faiss_path)
+    print(f"索引类型: {index_type_of(index)}，向量数: {index.ntotal}，维度: {index.d}")
+    for index_type, stats in benchmark_index_types(
+        index, n_queries=args.queries, k=args.k, storage=args.storage
+    ).items():
+        print(
+            f"{index_type:>6}: recall@{args.k}={stats['recall']:.3f}  "
+            f"latency={stats['latency_ms']:.2f}ms  build={stats['build_s']:.1f}s  "
+            f"size={stats['bytes_per_vector']:.0f}B/vector"
+        )
+
+
+if __name__ == '__main__':
+    main()
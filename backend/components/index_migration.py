@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: index_migration.py
+@time: 2025-11-26
+@desc: 将已有的 .faiss 向量库转换为缩短维度和/或 float16、int8 量化存储，并在写入前与全精度索引对比召回率；
+       为旧库的 chunks 表补充带索引的元数据列
+"""
+import logging
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import faiss
+
+from . import index_factory
+from .vector_store import ensure_metadata_columns, read_store_meta, write_store_meta
+
+# 默认的向量库目录: backend/memory
+DEFAULT_MEMORY_DIR = Path(__file__).resolve().parent.parent / "memory"
+
+
+def migrate_store(
+    db_base: str,
+    dimensions: Optional[int] = None,
+    storage: Optional[str] = None,
+    min_recall: float = 0.9,
+    k: int = 10,
+    n_queries: int = 200,
+    dry_run: bool = False,
+    keep_backup: bool = True,
+) -> Dict[str, Any]:
+    """
+    转换一个向量库（{db_base}.faiss + {db_base}.sqlite）。
+
+    - 维度缩短：截取前 dimensions 维并重新归一化（text-embedding-3 系列的 Matryoshka 特性），
+      之后该库的查询会以相同的 dimensions 参数请求 Embedding
+    - 存储精度：flat / hnsw 索引转为 float16 或 int8 标量量化，索引类型保持不变
+    - 召回检查：以原索引中的全精度向量做精确搜索作为基准，新索引的 recall@k 低于 min_recall 时不写入
+
+    请在没有进程打开该库时运行。
+
+    Returns:
+        迁移报告，包含前后的维度、存储精度、每向量字节数、recall@k 以及是否已写入。
+    """
+    faiss_path = f"{db_base}.faiss"
+    sqlite_path = f"{db_base}.sqlite"
+    if not os.path.exists(faiss_path) or not os.path.exists(sqlite_path):
+        raise FileNotFoundError(f"找不到向量库: {db_base}(.faiss/.sqlite)")
+
+    index = faiss.read_index(faiss_path)
+    index_type = index_factory.index_type_of(index)
+    source_storage = index_factory.storage_of(index)
+    target_dimension = dimensions or index.d
+    target_storage = storage or source_storage
+    if target_dimension > index.d:
+        raise ValueError(f"目标维度 {target_dimension} 大于当前维度 {index.d}，无法扩展已有向量")
+
+    report = {
+        "db": db_base,
+        "vectors": index.ntotal,
+        "index_type": index_type,
+        "from": {"dimension": index.d, "storage": source_storage},
+        "to": {"dimension": target_dimension, "storage": target_storage},
+        "bytes_before": os.path.getsize(faiss_path),
+        "migrated": False,
+    }
+    if (target_dimension, target_storage) == (index.d, source_storage) or index.ntotal == 0:
+        report["recall"] = 1.0
+        return report
+    if index_type == "ivfpq" or source_storage != "float32":
+        logging.warning(f"[IndexMigration] {db_base} 已是有损索引，召回率以解码后的近似向量为基准")
+
+    ids, vectors = index_factory.extract_vectors(index)
+    del index
+    new_vectors = index_factory.truncate_vectors(vectors, target_dimension)
+    new_index = index_factory.build_index(index_type, target_dimension, ids, new_vectors, storage=target_storage)
+
+    # 召回检查：基准为原维度、全精度的精确搜索
+    queries = index_factory.sample_queries(vectors, n_queries)
+    truth = index_factory.exact_neighbors(ids, vectors, queries, k)
+    _, found = new_index.search(index_factory.truncate_vectors(queries, target_dimension), k)
+    report["recall"] = index_factory.recall_at_k(found, truth)
+    report["bytes_after"] = len(faiss.serialize_index(new_index))
+
+    if report["recall"] < min_recall:
+        logging.warning(
+            f"[IndexMigration] {db_base} recall@{k}={report['recall']:.3f} 低于阈值 {min_recall}，未写入"
+        )
+        return report
+    if dry_run:
+        return report
+
+    if keep_backup:
+        shutil.copy2(faiss_path, f"{faiss_path}.bak")
+    tmp_path = f"{faiss_path}.tmp"
+    faiss.write_index(new_index, tmp_path)
+    os.replace(tmp_path, faiss_path)
+
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        meta = read_store_meta(conn)
+        write_store_meta(conn, {**meta, "dimension": target_dimension, "storage": target_storage})
+    finally:
+        conn.close()
+
+    report["migrated"] = True
+    logging.info(
+        f"[IndexMigration] {db_base}: {report['from']['dimension']}维/{source_storage} -> "
+        f"{target_dimension}维/{target_storage}，recall@{k}={report['recall']:.3f}"
+    )
+    return report
+
+
+def migrate_metadata_columns(db_base: str) -> int:
+    """
+    为旧库的 chunks 表补充 source_id / chunk_index / section / start_index 列和索引，并从 metadata JSON 回填
+    （以可写方式打开向量库时也会自动执行）。返回回填的行数。
+    """
+    conn = sqlite3.connect(f"{db_base}.sqlite")
+    try:
+        return ensure_metadata_columns(conn)
+    finally:
+        conn.close()
+
+
+def find_stores(memory_dir: str = str(DEFAULT_MEMORY_DIR)) -> List[str]:
+    """列出目录下所有同时存在 .faiss 和 .sqlite 的向量库（返回不带扩展名的路径）"""
+    stores = []
+    for faiss_file in sorted(Path(memory_dir).glob("*.faiss")):
+        base = str(faiss_file.with_suffix(""))
+        if os.path.exists(f"{base}.sqlite"):
+            stores.append(base)
+    return stores
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='将已有向量库转换为缩短维度和/或量化存储')
+    parser.add_argument('stores', nargs='*', help='向量库路径（不带扩展名）或 backend/memory 下的 db_name')
+    parser.add_argument('--all', action='store_true', help='转换 backend/memory 下的全部向量库')
+    parser.add_argument('--dimensions', type=int, help='目标维度（如 1024、512）')
+    parser.add_argument('--storage', choices=index_factory.STORAGE_TYPES, help='目标存储精度')
+    parser.add_argument('--min-recall', type=float, default=0.9, help='recall@k 低于该值时不写入')
+    parser.add_argument('-k', type=int, default=10, help='召回检查的 k')
+    parser.add_argument('--dry-run', action='store_true', help='只做召回检查，不写入')
+    parser.add_argument('--no-backup', action='store_true', help='不保留原 .faiss 文件的 .bak 备份')
+    parser.add_argument('--columns', action='store_true', help='为旧库的 chunks 表补充带索引的元数据列')
+    args = parser.parse_args()
+
+    if not args.dimensions and not args.storage and not args.columns:
+        parser.error('至少需要指定 --dimensions、--storage 或 --columns')
+
+    targets = find_stores() if args.all else []
+    for store in args.stores:
+        targets.append(store if os.path.exists(f"{store}.faiss") else str(DEFAULT_MEMORY_DIR / store))
+    if not targets:
+        parser.error('没有需要转换的向量库')
+
+    if args.columns:
+        for db_base in targets:
+            print(f"[元数据列] {os.path.basename(db_base)}: 回填 {migrate_metadata_columns(db_base)} 行")
+        if not args.dimensions and not args.storage:
+            return
+
+    total_before = total_after = 0
+    for db_base in targets:
+        report = migrate_store(
+            db_base,
+            dimensions=args.dimensions,
+            storage=args.storage,
+            min_recall=args.min_recall,
+            k=args.k,
+            dry_run=args.dry_run,
+            keep_backup=not args.no_backup,
+        )
+        bytes_after = report.get("bytes_after", report["bytes_before"])
+        total_before += report["bytes_before"]
+        total_after += bytes_after if report["migrated"] or args.dry_run else report["bytes_before"]
+        status = "已转换" if report["migrated"] else ("试运行" if args.dry_run else "未转换")
+        print(
+            f"[{status}] {os.path.basename(db_base)}: {report['vectors']} 个向量，"
+            f"{report['from']['dimension']}/{report['from']['storage']} -> {report['to']['dimension']}/{report['to']['storage']}，"
+            f"recall@{args.k}={report['recall']:.3f}，{report['bytes_before'] / 1e6:.1f}MB -> {bytes_after / 1e6:.1f}MB"
+        )
+    print(f"合计: {total_before / 1e6:.1f}MB -> {total_after / 1e6:.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: library.py
+@time: 2025-12-01
+@desc: 多文档文库：将多个文档各自的向量库注册为分片，查询只向量化一次后并行检索所有分片并合并 top-k；
+       总向量数超过阈值时可合并为一个近似索引。跨文档检索不需要重新向量化任何文本
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from ..config import deep_reader_config
+from . import index_factory
+from .document_cache import get_document_manifest
+from .store_registry import get_store_registry
+from .vector_store import SEARCH_TYPES, DeepReaderVectorStore, reciprocal_rank_fusion
+
+# 文库定义和合并索引的存放目录: backend/memory/libraries
+DEFAULT_LIBRARY_DIR = Path(__file__).resolve().parent.parent / "memory" / "libraries"
+
+# 合并索引中的向量 id 编码为 (分片号 << 40) | 块 id，块 id 不超过 2^40
+_SHARD_SHIFT = 40
+_CHUNK_ID_MASK = (1 << _SHARD_SHIFT) - 1
+
+# 训练合并索引（ivfpq / int8）时从各分片抽取的样本总数
+_TRAIN_SAMPLE_SIZE = 100_000
+
+# 跨分片检索使用独立的线程池（检索方法本身可能运行在 vector_store 的检索线程池中，共用会互相等待）
+_SHARD_EXECUTOR = ThreadPoolExecutor(
+    max_workers=deep_reader_config.LIBRARY_SEARCH_MAX_WORKERS,
+    thread_name_prefix="library-search",
+)
+
+
+def decode_id(library_id: int) -> Tuple[int, int]:
+    return library_id >> _SHARD_SHIFT, library_id & _CHUNK_ID_MASK
+
+
+class DocumentLibrary:
+    """
+    由多个文档向量库（分片）组成的文库，线程安全。
+
+    - 文库定义保存在 {library_dir}/{name}.json：分片列表（标签、db_name / db_path、分片号）和合并索引的信息
+    - 分片通过 VectorStoreRegistry 以只读方式打开，与单文档检索共享同一份内存映射索引
+    - 检索：查询只向量化一次，各分片并行检索后合并——纯向量检索按 L2 距离合并（同一 Embedding 空间，距离可比），
+      hybrid / lexical 的 BM25 得分跨库不可比，按各分片的排名做倒数排名融合
+    - 合并索引：将全部分片的向量（从各分片索引中直接取出，不重新向量化）写入一个近似索引，
+      任一分片的索引版本变化后自动退回逐分片检索，直到再次合并
+    """
+
+    def __init__(self, name: str, library_dir: str = str(DEFAULT_LIBRARY_DIR)):
+        self.name = name
+        self.library_dir = library_dir
+        self.path = os.path.join(library_dir, f"{name}.json")
+        self.index_path = os.path.join(library_dir, f"{name}.faiss")
+        self._lock = threading.RLock()
+        self._meta = self._load()
+        # 已加载的合并索引及其构建时间，构建时间变化时重新加载
+        self._index: Optional[faiss.Index] = None
+        self._index_built_at: Optional[float] = None
+
+    def _load(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return {"shards": [], "next_shard_no": 0, "consolidated": None}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_locked(self):
+        os.makedirs(self.library_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def shards(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(shard) for shard in self._meta["shards"]]
+
+    # =================================================================
+    # 分片管理
+    # =================================================================
+
+    def add_shard(self, db_name: Optional[str] = None, db_path: Optional[str] = None, label: Optional[str] = None) -> str:
+        """
+        注册一个已入库的文档向量库为分片，返回分片标签（默认为 db_name 或 db_path 的文件名）。
+        """
+        if not db_name and not db_path:
+            raise ValueError("必须提供 db_name 或 db_path")
+        label = label or db_name or os.path.basename(db_path)
+        # 以只读方式打开一次，确认库存在，并与已有分片使用相同的 Embedding 模型和向量维度
+        with get_store_registry().lease(db_name=db_name, db_path=db_path, read_only=True) as store:
+            dimension = store.dimension
+            embedding_model = store.embedding_model_id
+        with self._lock:
+            if any(shard["label"] == label for shard in self._meta["shards"]):
+                raise ValueError(f"文库 {self.name} 中已存在分片: {label}")
+            dimensions = {shard["dimension"] for shard in self._meta["shards"]}
+            if dimensions and dimension not in dimensions:
+                raise ValueError(f"分片 {label} 的向量维度 {dimension} 与文库的 {dimensions.pop()} 不一致，无法在同一空间中检索")
+            models = {shard.get("embedding_model", embedding_model) for shard in self._meta["shards"]}
+            if models and embedding_model not in models:
+                raise ValueError(f"分片 {label} 由 {embedding_model} 构建，与文库的 {models.pop()} 不一致，无法在同一空间中检索")
+            self._meta["shards"].append({
+                "label": label,
+                "db_name": db_name,
+                "db_path": db_path,
+                "shard_no": self._meta["next_shard_no"],
+                "dimension": dimension,
+                "embedding_model": embedding_model,
+                "added_at": time.time(),
+            })
+            # 分片号不复用，合并索引中的旧 id 不会指向新加入的分片
+            self._meta["next_shard_no"] += 1
+            self._save_locked()
+        logging.info(f"[Library] {self.name} 加入分片: {label}")
+        self.maybe_consolidate()
+        return label
+
+    def add_document(self, document_path: str, label: Optional[str] = None) -> str:
+        """按文档路径注册分片：从 manifest 中查找该文档的 RAG 缓存键（即 db_name），文档需已处理过"""
+        entry = get_document_manifest().get(document_path)
+        if not entry:
+            raise ValueError(f"文档尚未入库（manifest 中没有记录）: {document_path}")
+        return self.add_shard(db_name=entry["content_key"], label=label or os.path.basename(document_path))
+
+    def remove_shard(self, label: str):
+        with self._lock:
+            shards = [shard for shard in self._meta["shards"] if shard["label"] != label]
+            if len(shards) == len(self._meta["shards"]):
+                raise ValueError(f"文库 {self.name} 中没有分片: {label}")
+            self._meta["shards"] = shards
+            self._save_locked()
+
+    def _lease_all(self, stack: ExitStack) -> List[Tuple[Dict[str, Any], DeepReaderVectorStore]]:
+        registry = get_store_registry()
+        leased = []
+        for shard in self.shards:
+            try:
+                store = stack.enter_context(registry.lease(db_name=shard["db_name"], db_path=shard["db_path"], read_only=True))
+            except FileNotFoundError as e:
+                # 分片的向量库已被删除（如磁盘回收），检索和合并时跳过
+                logging.warning(f"[Library] {self.name} 的分片 {shard['label']} 不存在，已跳过: {e}")
+                continue
+            leased.append((shard, store))
+        return leased
+
+    # =================================================================
+    # 检索
+    # =================================================================
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        search_type: Optional[str] = None,
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
+        """
+        在文库的全部分片中检索。返回文档的 metadata 中附带 shard（分片标签）和 chunk_id，
+        search_type / max_distance / filter 的含义与 DeepReaderVectorStore.similarity_search 相同。
+        """
+        return self.search_batch([query], k, search_type, max_distance, filter)[0]
+
+    def search_batch(
+        self,
+        queries: List[str],
+        k: int = 10,
+        search_type: Optional[str] = None,
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Document]]:
+        """批量检索：全部查询一次向量化，各分片并行检索"""
+        search_type = search_type or deep_reader_config.RAG_SEARCH_TYPE
+        with ExitStack() as stack:
+            leased = self._lease_all(stack)
+            if not leased or not queries:
+                return [[] for _ in queries]
+            vectors = None
+            if search_type != "lexical":
+                vectors = np.array(leased[0][1].embedding_model.embed_documents(list(queries)), dtype="float32")
+            return self._search_with_vectors(leased, list(queries), vectors, k, search_type, max_distance, filter)
+
+    async def asearch(
+        self,
+        query: str,
+        k: int = 10,
+        search_type: Optional[str] = None,
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
+        """search 的异步版本"""
+        return (await self.asearch_batch([query], k, search_type, max_distance, filter))[0]
+
+    async def asearch_batch(
+        self,
+        queries: List[str],
+        k: int = 10,
+        search_type: Optional[str] = None,
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Document]]:
+        """search_batch 的异步版本：Embedding 请求异步发起，分片检索在线程中执行"""
+        search_type = search_type or deep_reader_config.RAG_SEARCH_TYPE
+        with ExitStack() as stack:
+            leased = await asyncio.to_thread(self._lease_all, stack)
+            if not leased or not queries:
+                return [[] for _ in queries]
+            vectors = None
+            if search_type != "lexical":
+                vectors = np.array(await leased[0][1].embedding_model.aembed_documents(list(queries)), dtype="float32")
+            return await asyncio.to_thread(
+                self._search_with_vectors, leased, list(queries), vectors, k, search_type, max_distance, filter
+            )
+
+    def _search_with_vectors(
+        self,
+        leased: List[Tuple[Dict[str, Any], DeepReaderVectorStore]],
+        queries: List[str],
+        vectors: Optional[np.ndarray],
+        k: int,
+        search_type: str,
+        max_distance: Optional[float],
+        filter: Optional[Dict[str, Any]],
+    ) -> List[List[Document]]:
+        if search_type not in SEARCH_TYPES:
+            raise ValueError(f"未知的检索方式: {search_type}，可选值为 {' / '.join(SEARCH_TYPES)}")
+        index = self._consolidated_index(leased) if search_type != "lexical" and not filter else None
+        if index is not None:
+            results = self._search_consolidated(index, leased, queries, vectors, k, search_type, max_distance)
+            return self._expand_parents(leased, results)
+
+        # 逐分片并行检索，每个分片返回 k 个候选
+        per_shard = list(_SHARD_EXECUTOR.map(
+            lambda item: item[1].search_with_vectors(queries, vectors, k, search_type, max_distance, filter),
+            leased,
+        ))
+        results = []
+        for qi in range(len(queries)):
+            candidates: Dict[Tuple[int, int], Document] = {}
+            rankings = []
+            for (shard, _), shard_results in zip(leased, per_shard):
+                ranking = []
+                for doc in shard_results[qi]:
+                    key = (shard["shard_no"], doc.metadata["chunk_id"])
+                    candidates[key] = Document(page_content=doc.page_content, metadata={**doc.metadata, "shard": shard["label"]})
+                    ranking.append(key)
+                rankings.append(ranking)
+            if search_type == "vector":
+                ranked = sorted(candidates, key=lambda key: candidates[key].metadata["distance"])[:k]
+            else:
+                ranked = reciprocal_rank_fusion(rankings, k)
+            results.append([candidates[key] for key in ranked])
+        return self._expand_parents(leased, results)
+
+    @staticmethod
+    def _expand_parents(
+        leased: List[Tuple[Dict[str, Any], DeepReaderVectorStore]],
+        results: List[List[Document]],
+    ) -> List[List[Document]]:
+        """
+        父子分块的分片：将合并后的子块命中替换为父窗口（每个分片一次 SQLite 查询），
+        同一分片的同一父窗口在一个查询的结果中只保留排名最靠前的一份。
+        """
+        stores = {shard["label"]: store for shard, store in leased if store.has_parents}
+        if not stores:
+            return results
+        replaced: Dict[int, Document] = {}
+        for label, store in stores.items():
+            docs = [doc for hits in results for doc in hits if doc.metadata["shard"] == label]
+            for doc, expanded in zip(docs, store.expand_parents_batch([[doc] for doc in docs])):
+                replaced[id(doc)] = Document(page_content=expanded[0].page_content, metadata={**expanded[0].metadata, "shard": label})
+
+        expanded_results = []
+        for hits in results:
+            kept: Dict[Tuple[str, Any], Document] = {}
+            ordered = []
+            for doc in hits:
+                doc = replaced.get(id(doc), doc)
+                if not doc.metadata.get("parent"):
+                    ordered.append(doc)
+                    continue
+                key = (doc.metadata["shard"], doc.metadata["parent_index"])
+                if key in kept:
+                    kept[key].metadata["chunk_ids"].extend(doc.metadata["chunk_ids"])
+                    continue
+                kept[key] = doc
+                ordered.append(doc)
+            expanded_results.append(ordered)
+        return expanded_results
+
+    def _search_consolidated(
+        self,
+        index: faiss.Index,
+        leased: List[Tuple[Dict[str, Any], DeepReaderVectorStore]],
+        queries: List[str],
+        vectors: np.ndarray,
+        k: int,
+        search_type: str,
+        max_distance: Optional[float],
+    ) -> List[List[Document]]:
+        """使用合并索引做一次向量检索；hybrid 时全文检索一路仍在各分片中并行执行后按排名融合"""
+        fetch_k = k if search_type == "vector" else max(k, deep_reader_config.RAG_HYBRID_FETCH_K)
+        distances, ids = index.search(vectors, fetch_k)
+        distances = np.sqrt(np.maximum(distances, 0))
+
+        lexical = None
+        if search_type == "hybrid":
+            lexical = list(_SHARD_EXECUTOR.map(
+                lambda item: [item[1].lexical_search(query, fetch_k) for query in queries], leased
+            ))
+
+        stores = {shard["shard_no"]: (shard, store) for shard, store in leased}
+        ranked_keys: List[List[Tuple[int, int]]] = []
+        known_distances: Dict[Tuple[int, int], float] = {}
+        for qi in range(len(queries)):
+            dense = []
+            for library_id, distance in zip(ids[qi], distances[qi]):
+                if library_id == -1 or (max_distance is not None and distance > max_distance):
+                    continue
+                key = decode_id(int(library_id))
+                known_distances[key] = float(distance)
+                dense.append(key)
+            if lexical is None:
+                ranked_keys.append(dense[:k])
+                continue
+            lexical_rankings = [
+                [(shard["shard_no"], doc.metadata["chunk_id"]) for doc in shard_results[qi]]
+                for (shard, _), shard_results in zip(leased, lexical)
+            ]
+            ranked_keys.append(reciprocal_rank_fusion([dense, reciprocal_rank_fusion(lexical_rankings, fetch_k)], k))
+
+        # 按分片批量取回块内容
+        wanted: Dict[int, set] = {}
+        for keys in ranked_keys:
+            for shard_no, chunk_id in keys:
+                wanted.setdefault(shard_no, set()).add(chunk_id)
+        docs: Dict[Tuple[int, int], Document] = {}
+        for shard_no, chunk_ids in wanted.items():
+            if shard_no not in stores:
+                continue
+            shard, store = stores[shard_no]
+            for doc in store.get_by_ids(sorted(chunk_ids)):
+                key = (shard_no, doc.metadata["chunk_id"])
+                metadata = {**doc.metadata, "shard": shard["label"]}
+                if key in known_distances:
+                    metadata["distance"] = known_distances[key]
+                docs[key] = Document(page_content=doc.page_content, metadata=metadata)
+        return [[docs[key] for key in keys if key in docs] for keys in ranked_keys]
+
+    # =================================================================
+    # 合并索引
+    # =================================================================
+
+    def _consolidated_index(self, leased: List[Tuple[Dict[str, Any], DeepReaderVectorStore]]) -> Optional[faiss.Index]:
+        """返回与当前各分片一致的合并索引；没有合并索引或已过期时返回 None"""
+        with self._lock:
+            info = self._meta.get("consolidated")
+            if not info or not os.path.exists(self.index_path):
+                return None
+            versions = {shard["label"]: store.index_version for shard, store in leased}
+            if info["versions"] != versions:
+                logging.info(f"[Library] {self.name} 的合并索引已过期，使用逐分片检索")
+                return None
+            if self._index is None or self._index_built_at != info["built_at"]:
+                self._index = index_factory.read_index_mmap(self.index_path)
+                index_factory.configure_search(self._index)
+                self._index_built_at = info["built_at"]
+            return self._index
+
+    def total_vectors(self) -> int:
+        with ExitStack() as stack:
+            return sum(store.index.ntotal for _, store in self._lease_all(stack))
+
+    def maybe_consolidate(self) -> bool:
+        """总向量数达到 LIBRARY_CONSOLIDATE_THRESHOLD 时合并索引，返回是否执行了合并"""
+        threshold = deep_reader_config.LIBRARY_CONSOLIDATE_THRESHOLD
+        if not threshold or self.total_vectors() < threshold:
+            return False
+        self.consolidate()
+        return True
+
+    def consolidate(self, index_type: Optional[str] = None) -> str:
+        """
+        将全部分片的向量合并为一个近似索引并原子落盘。向量直接从各分片的索引中取出
+        （ivfpq / 量化存储的分片取出的是近似向量），不调用 Embedding API。
+
+        Returns:
+            合并索引的类型。
+        """
+        start = time.time()
+        with ExitStack() as stack:
+            leased = self._lease_all(stack)
+            total = sum(store.index.ntotal for _, store in leased)
+            if total == 0:
+                raise ValueError(f"文库 {self.name} 中没有可合并的向量")
+            dimension = leased[0][1].dimension
+            target = index_factory.resolve_index_type(index_type or deep_reader_config.VECTOR_INDEX_TYPE, total)
+            index = index_factory.create_index(target, dimension, total, storage=deep_reader_config.VECTOR_STORAGE)
+
+            if not index.is_trained:
+                # 按各分片的向量数比例抽取训练样本
+                rng = np.random.default_rng(0)
+                samples = []
+                for _, store in leased:
+                    _, vectors = index_factory.extract_vectors(store.index)
+                    n = min(len(vectors), int(np.ceil(_TRAIN_SAMPLE_SIZE * len(vectors) / total)))
+                    if n:
+                        samples.append(vectors[rng.choice(len(vectors), n, replace=False)])
+                    del vectors
+                index_factory.train_index(index, np.vstack(samples))
+
+            versions = {}
+            for shard, store in leased:
+                ids, vectors = index_factory.extract_vectors(store.index)
+                if len(ids):
+                    index.add_with_ids(vectors, (np.int64(shard["shard_no"]) << _SHARD_SHIFT) | ids)
+                versions[shard["label"]] = store.index_version
+                del vectors
+
+        os.makedirs(self.library_dir, exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+        with self._lock:
+            self._meta["consolidated"] = {
+                "index_type": target,
+                "vectors": total,
+                "versions": versions,
+                "built_at": time.time(),
+            }
+            self._save_locked()
+        logging.info(
+            f"[Library] {self.name} 已合并 {len(versions)} 个分片为 {target} 索引"
+            f"（{total} 个向量，耗时 {time.time() - start:.1f}s）"
+        )
+        return target
+
+
+_libraries: Dict[str, DocumentLibrary] = {}
+_libraries_lock = threading.Lock()
+
+
+def get_document_library(name: str) -> DocumentLibrary:
+    """获取（或创建）指定名称的文库实例，同名文库在进程内共享同一个实例"""
+    with _libraries_lock:
+        if name not in _libraries:
+            _libraries[name] = DocumentLibrary(name)
+        return _libraries[name]
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='管理多文档文库并跨文档检索')
+    parser.add_argument('name', help='文库名称')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add', help='加入分片（已处理过的文档路径，或 backend/memory 下的 db_name）')
+    add_parser.add_argument('targets', nargs='+')
+    add_parser.add_argument('--label', help='分片标签（只加入一个分片时有效）')
+
+    remove_parser = subparsers.add_parser('remove', help='移除分片')
+    remove_parser.add_argument('label')
+
+    subparsers.add_parser('list', help='列出分片')
+
+    search_parser = subparsers.add_parser('search', help='跨全部分片检索')
+    search_parser.add_argument('query')
+    search_parser.add_argument('-k', type=int, default=10)
+    search_parser.add_argument('--search-type', choices=SEARCH_TYPES)
+
+    consolidate_parser = subparsers.add_parser('consolidate', help='将全部分片合并为一个近似索引')
+    consolidate_parser.add_argument('--index-type', choices=index_factory.INDEX_TYPES)
+    args = parser.parse_args()
+
+    library = get_document_library(args.name)
+    if args.command == 'add':
+        label = args.label if len(args.targets) == 1 else None
+        for target in args.targets:
+            if os.path.exists(target):
+                print(f"已加入: {library.add_document(target, label=label)}")
+            else:
+                print(f"已加入: {library.add_shard(db_name=target, label=label)}")
+    elif args.command == 'remove':
+        library.remove_shard(args.label)
+    elif args.command == 'list':
+        for shard in library.shards:
+            print(f"{shard['shard_no']:>3}  {shard['label']}  {shard['db_name'] or shard['db_path']}")
+    elif args.command == 'search':
+        for doc in library.search(args.query, k=args.k, search_type=args.search_type):
+            distance = doc.metadata.get("distance")
+            score = f"{distance:.3f}" if distance is not None else "-"
+            print(f"[{doc.metadata['shard']} #{doc.metadata.get('chunk_index')} {score}] {doc.page_content[:120]!r}")
+    elif args.command == 'consolidate':
+        print(f"合并索引类型: {library.consolidate(args.index_type)}")
+
+
+if __name__ == '__main__':
+    main()
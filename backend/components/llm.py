@@ -4,11 +4,42 @@
 @file: llm.py
 @time: 2025-06-29 11:00
 @desc: 封装了 DeepReader 项目中所有与 LLM 调用相关的功能
+       调用失败时抛出 llm_errors.LLMError：可重试的错误（限流、超时、5xx、网络错误、空响应）已按指数退避重试
 """
+import asyncio
+import json
 import logging
+import random
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
 from ..config import deep_reader_config
+from ..prompts import STRUCTURED_OUTPUT_REPAIR_PROMPT
 from .google_llm import call_google_llm
 from gpt_researcher.utils.llm import create_chat_completion
+from .llm_cache import get_llm_cache, llm_cache_key
+from .llm_errors import (
+    LLMEmptyResponseError,
+    LLMError,
+    LLMRequestError,
+    LLMStructuredOutputError,
+    classify_llm_error,
+)
+from .llm_scheduler import get_llm_scheduler
+from .structured_output import (
+    coerce_shape,
+    dump_for_repair,
+    extract_json,
+    format_validation_errors,
+    inline_json_schema,
+    list_item_type,
+    provider_response_kwargs,
+    rejects_structured_output,
+    validate_items,
+)
 from .token_counter import get_token_counter
 
 
@@ -18,8 +49,182 @@ config = deep_reader_config
 # 获取全局 token 计数器
 token_counter = get_token_counter()
 
+# 全局 LLM 调用调度器：按层级限制并发数和每分钟请求数 / token 数
+llm_scheduler = get_llm_scheduler()
+
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+# 拒绝了原生结构化输出参数的 (提供商, 模型) -> 恢复尝试的时间（time.monotonic()），在此之前不再传入这些参数
+_structured_output_rejected: Dict[Tuple[str, str], float] = {}
+
+# 提供商拒绝原生结构化输出参数后暂停传入的秒数，到期后重新尝试（模型或网关升级后可能已经支持）
+_STRUCTURED_OUTPUT_RETRY_SECONDS = 600.0
+
+
+def _response_cache_key(tier: str, llm_provider: str, llm_model: str, prompt: str,
+                        use_cache: Optional[bool], llm_kwargs: Dict[str, Any]) -> Optional[str]:
+    """启用响应缓存时返回本次调用的缓存键，否则返回 None。use_cache 为 None 时按 LLM_CACHE_ENABLED"""
+    enabled = config.LLM_CACHE_ENABLED if use_cache is None else use_cache
+    if not enabled:
+        return None
+    return llm_cache_key(tier, llm_provider, llm_model, config.temperature, llm_kwargs, prompt)
+
+
+async def _cached_response(cache_key: Optional[str], tier: str) -> Optional[str]:
+    """查询响应缓存；缓存文件不可用时按未命中处理，不影响模型调用"""
+    if cache_key is None:
+        return None
+    try:
+        response = await asyncio.to_thread(get_llm_cache().get, cache_key)
+    except (sqlite3.Error, OSError) as e:
+        logging.warning(f"[LLMCache] 响应缓存不可用: {e}")
+        return None
+    if response is not None:
+        logging.info(f"--- {tier} 命中响应缓存，跳过模型调用 ---")
+    return response
+
+
+async def _store_response(cache_key: Optional[str], tier: str, llm_model: str, response: str):
+    """写入响应缓存；空响应不缓存"""
+    if cache_key is None or not response:
+        return
+    try:
+        await asyncio.to_thread(get_llm_cache().put, cache_key, tier, llm_model, response)
+    except (sqlite3.Error, OSError) as e:
+        logging.warning(f"[LLMCache] 响应缓存写入失败: {e}")
+
+
+# 一次模型请求：无参数的协程工厂，重试和对冲时重复调用
+LLMRequest = Callable[[], Awaitable[str]]
+
+
+def _chat_completion(llm_provider: str, llm_model: str, prompt: str, llm_kwargs: Dict[str, Any]) -> LLMRequest:
+    messages = [{"role": "user", "content": prompt}]
+    return lambda: create_chat_completion(
+        messages=messages,
+        model=llm_model,
+        llm_provider=llm_provider,
+        temperature=config.temperature,
+        llm_kwargs=llm_kwargs,
+    )
+
+
+async def _attempt(tier: str, llm_model: str, prompt: str, request: LLMRequest) -> str:
+    """经调度器放行后发出一次请求，底层异常转换为 LLMError"""
+    async with llm_scheduler.acquire(tier, token_counter.count_tokens(prompt)) as lease:
+        try:
+            if config.LLM_TIMEOUT_SECONDS:
+                response = await asyncio.wait_for(request(), config.LLM_TIMEOUT_SECONDS)
+            else:
+                response = await request()
+        except Exception as e:
+            raise classify_llm_error(e, tier, llm_model) from e
+        if not response or not response.strip():
+            raise LLMEmptyResponseError("模型返回了空响应", tier, llm_model)
+        lease.add_tokens(token_counter.count_tokens(response))
+        return response
+
+
+def _hedge_delay(tier: str, hedge: Optional[bool]) -> Optional[float]:
+    """本次调用发出对冲请求前等待的秒数，不对冲时返回 None"""
+    enabled = (config.LLM_HEDGING_ENABLED and tier in config.LLM_HEDGE_TIERS) if hedge is None else hedge
+    if not enabled:
+        return None
+    p95 = llm_scheduler.limiter(tier).latency_percentile(0.95, config.LLM_HEDGE_MIN_SAMPLES)
+    if p95 is None:
+        return None
+    return max(config.LLM_HEDGE_MIN_DELAY, p95)
+
+
+async def _hedged_attempt(tier: str, llm_model: str, prompt: str, request: LLMRequest, delay: float) -> str:
+    """
+    原请求 delay 秒内未返回时再发出一个相同的请求，取先成功返回的结果并取消另一个；
+    两个请求都失败时抛出先失败的异常。
+    """
+    limiter = llm_scheduler.limiter(tier)
+    primary = asyncio.create_task(_attempt(tier, llm_model, prompt, request))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            logging.info(f"--- {tier} 调用超过 {delay:.1f}s 未返回，发出对冲请求 ---")
+            limiter.hedged += 1
+            tasks.append(asyncio.create_task(_attempt(tier, llm_model, prompt, request)))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        limiter.hedge_wins += 1
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _call_with_retry(tier: str, llm_model: str, prompt: str, request: LLMRequest,
+                           hedge: Optional[bool]) -> str:
+    """可重试的错误按指数退避（全抖动）重试，不可重试的错误和最后一次失败直接抛出"""
+    max_retries = config.LLM_MAX_RETRIES
+    for attempt in range(max_retries + 1):
+        delay = _hedge_delay(tier, hedge)
+        try:
+            if delay is None:
+                return await _attempt(tier, llm_model, prompt, request)
+            return await _hedged_attempt(tier, llm_model, prompt, request, delay)
+        except LLMError as e:
+            if not e.retryable or attempt == max_retries:
+                raise
+            backoff = random.uniform(0, min(config.LLM_RETRY_MAX_DELAY, config.LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+            if e.retry_after:
+                backoff = max(backoff, min(e.retry_after, config.LLM_RETRY_MAX_DELAY))
+            logging.warning(f"{e}，{backoff:.1f}s 后重试 ({attempt + 1}/{max_retries})")
+            await asyncio.sleep(backoff)
+    raise RuntimeError("unreachable")
+
 
-async def call_writer_llm(prompt: str) -> str:
+async def _call_llm(
+    tier: str,
+    label: str,
+    llm_provider: str,
+    llm_model: str,
+    prompt: str,
+    request: Optional[LLMRequest] = None,
+    llm_kwargs: Optional[Dict[str, Any]] = None,
+    use_cache: Optional[bool] = None,
+    hedge: Optional[bool] = None,
+) -> str:
+    """
+    查询响应缓存，未命中时经调度、重试（和对冲）调用模型，记录 token 使用并写入缓存。
+    request 未指定时以 llm_kwargs（默认为 LLM_KWARGS）调用 create_chat_completion。
+    """
+    llm_kwargs = config.llm_kwargs if llm_kwargs is None else llm_kwargs
+    request = request or _chat_completion(llm_provider, llm_model, prompt, llm_kwargs)
+    cache_key = _response_cache_key(tier, llm_provider, llm_model, prompt, use_cache, llm_kwargs)
+    cached = await _cached_response(cache_key, label)
+    if cached is not None:
+        return cached
+
+    logging.info(f"--- 正在使用 {label} ({llm_provider}) 调用模型: {llm_model} ---")
+    try:
+        response = await _call_with_retry(tier, llm_model, prompt, request, hedge)
+    except LLMError as e:
+        logging.error(f"调用 {label} 失败: {e}")
+        raise
+
+    # 记录 token 使用
+    token_counter.add_call(tier, prompt, response)
+    await _store_response(cache_key, tier, llm_model, response)
+    return response
+
+
+async def call_writer_llm(prompt: str, use_cache: Optional[bool] = None, hedge: Optional[bool] = None) -> str:
     """
     封装对 'strategic_llm' 的调用，用于需要联网搜索的文本生成任务，如总结、提问等。
     """
@@ -28,30 +233,10 @@ async def call_writer_llm(prompt: str) -> str:
     
     llm_provider = config.strategic_llm_provider
     llm_model = config.strategic_llm_model
-    
-    logging.info(f"--- 正在使用 Strategic LLM ({llm_provider}) 调用模型: {llm_model} ---")
-    
-    messages = [{"role": "user", "content": prompt}]
-    
-    try:
-        response = await create_chat_completion(
-            messages=messages,
-            model=llm_model,
-            llm_provider=llm_provider,
-            temperature=config.temperature,
-            llm_kwargs=config.llm_kwargs,
-        )
-        
-        # 记录 token 使用
-        token_counter.add_call("writer_llm", prompt, response)
-        
-        return response
-    except Exception as e:
-        logging.error(f"调用 Strategic LLM 时发生错误: {e}")
-        return f"Error calling Strategic LLM: {e}"
+    return await _call_llm("writer_llm", "Strategic LLM", llm_provider, llm_model, prompt, use_cache=use_cache, hedge=hedge)
 
 
-async def call_smart_llm(prompt: str) -> str:
+async def call_smart_llm(prompt: str, use_cache: Optional[bool] = None, hedge: Optional[bool] = None) -> str:
     """
     封装对 'smart_llm' 的调用，用于需要联网搜索的文本生成任务，如总结、提问等。
     """
@@ -60,38 +245,23 @@ async def call_smart_llm(prompt: str) -> str:
     
     llm_provider = config.smart_llm_provider
     llm_model = config.smart_llm_model
-    
-    logging.info(f"--- 正在使用 Smart LLM ({llm_provider}) 调用模型: {llm_model} ---")
-    
-    messages = [{"role": "user", "content": prompt}]
-    
-    try:
-        response = await create_chat_completion(
-            messages=messages,
-            model=llm_model,
-            llm_provider=llm_provider,
-            temperature=config.temperature,
-            llm_kwargs=config.llm_kwargs,
-        )
-        
-        # 记录 token 使用
-        token_counter.add_call("smart_llm", prompt, response)
-        
-        return response
-    except Exception as e:
-        logging.error(f"调用 Smart LLM 时发生错误: {e}")
-        return f"Error calling Smart LLM: {e}"
+    return await _call_llm("smart_llm", "Smart LLM", llm_provider, llm_model, prompt, use_cache=use_cache, hedge=hedge)
 
 
-async def call_fast_llm(prompt: str) -> str:
+async def call_fast_llm(prompt: str, use_cache: Optional[bool] = None, hedge: Optional[bool] = None) -> str:
     """
     封装对 'fast_llm' 的调用，用于快速、成本较低的文本生成任务，如总结、提问等。
 
     Args:
         prompt (str): 发送给模型的提示。
+        use_cache (Optional[bool]): 是否使用响应缓存，None 表示按 LLM_CACHE_ENABLED。
+        hedge (Optional[bool]): 是否发出对冲请求，None 表示按 LLM_HEDGING_ENABLED / LLM_HEDGE_TIERS。
 
     Returns:
         str: 模型返回的文本响应。
+
+    Raises:
+        LLMError: 重试后仍失败，或遇到不可重试的错误。
     """
     # 安全检查: 直接检查导入的 config 对象是否有效
     if not config:
@@ -101,40 +271,21 @@ async def call_fast_llm(prompt: str) -> str:
 
     llm_provider = config.fast_llm_provider
     llm_model = config.fast_llm_model
-
-    logging.info(f"--- 正在使用 Fast LLM ({llm_provider}) 调用模型: {llm_model} ---")
-    messages = [{"role": "user", "content": prompt}]
-    
-    try:
-        response = await create_chat_completion(
-            messages=messages,
-            model=llm_model,
-            llm_provider=llm_provider,
-            temperature=config.temperature,
-            llm_kwargs=config.llm_kwargs,
-        )
-        
-        # 记录 token 使用
-        token_counter.add_call("fast_llm", prompt, response)
-        
-        return response
-    except Exception as e:
-        import traceback
-        logging.error(f"调用 Fast LLM 时发生严重错误: {e}")
-        logging.error(f"错误类型: {type(e).__name__}")
-        logging.error(f"完整追溯信息:\\n{traceback.format_exc()}")
-        return ""
+    return await _call_llm("fast_llm", "Fast LLM", llm_provider, llm_model, prompt, use_cache=use_cache, hedge=hedge)
 
 
 async def call_search_llm(prompt: str) -> str:
     """
-    封装需要联网搜索的LLM调用，优先使用Google原生SDK。
+    封装需要联网搜索的LLM调用，优先使用Google原生SDK。搜索结果有时效性，不使用响应缓存。
     
     Args:
         prompt (str): 发送给模型的提示。
 
     Returns:
         str: 模型返回的文本响应，可能包含实时搜索结果。
+
+    Raises:
+        LLMError: 重试后仍失败，或遇到不可重试的错误。
     """
     if not config:
         raise RuntimeError("Config 未被正确初始化，无法调用 LLM。")
@@ -142,36 +293,134 @@ async def call_search_llm(prompt: str) -> str:
     llm_provider = config.search_llm_provider
     llm_model = config.search_llm_model
 
-    logging.info(f"--- 正在使用 Search LLM ({llm_provider}) 调用模型: {llm_model} ---")
-
     if llm_provider == "google_genai":
-        try:
-            response = await call_google_llm(prompt, llm_model)
-            
-            # 记录 token 使用
-            token_counter.add_call("search_llm", prompt, response)
-            
-            return response
-        except Exception as e:
-            logging.error(f"调用 Google Search LLM 时发生错误: {e}")
-            return f"Error calling Google Search LLM: {e}"
+        request = lambda: call_google_llm(prompt, llm_model)
     else:
         # 如果配置了其他搜索模型，则使用标准 chat completion 流程
         logging.warning(f"Search LLM 提供商 '{llm_provider}' 不是 'google_genai'，将作为标准 LLM 调用。")
-        messages = [{"role": "user", "content": prompt}]
+        request = None
+    return await _call_llm("search_llm", "Search LLM", llm_provider, llm_model, prompt, request, use_cache=False)
+
+
+def _tier_model(tier: str) -> Tuple[str, str, str]:
+    """层级对应的 (日志名称, 提供商, 模型)"""
+    if tier == "fast_llm":
+        return "Fast LLM", config.fast_llm_provider, config.fast_llm_model
+    if tier == "smart_llm":
+        return "Smart LLM", config.smart_llm_provider, config.smart_llm_model
+    if tier == "writer_llm":
+        return "Strategic LLM", config.strategic_llm_provider, config.strategic_llm_model
+    raise ValueError(f"不支持结构化输出的 LLM 层级: {tier}，可选 fast_llm / smart_llm / writer_llm")
+
+
+async def _call_with_schema(tier: str, label: str, llm_provider: str, llm_model: str, prompt: str,
+                            schema: Type[BaseModel], use_cache: Optional[bool], hedge: Optional[bool]) -> str:
+    """
+    附带原生结构化输出参数调用模型。提供商因这些参数拒绝请求时（错误信息中提到了 response_format 等参数），
+    去掉参数重新调用，并在 _STRUCTURED_OUTPUT_RETRY_SECONDS 内不再传入；其他请求错误直接抛出。
+    """
+    key = (llm_provider, llm_model)
+    extra_kwargs = {}
+    if _structured_output_rejected.get(key, 0.0) <= time.monotonic():
+        extra_kwargs = provider_response_kwargs(llm_provider, schema, config.LLM_STRUCTURED_OUTPUT)
+    try:
+        return await _call_llm(tier, label, llm_provider, llm_model, prompt,
+                               llm_kwargs={**config.llm_kwargs, **extra_kwargs}, use_cache=use_cache, hedge=hedge)
+    except LLMRequestError as e:
+        if not extra_kwargs or not rejects_structured_output(e):
+            raise
+        logging.warning(
+            f"{label} 不接受原生结构化输出参数，{_STRUCTURED_OUTPUT_RETRY_SECONDS:.0f}s 内改为仅依靠提示词约束: {e}"
+        )
+        _structured_output_rejected[key] = time.monotonic() + _STRUCTURED_OUTPUT_RETRY_SECONDS
+        return await _call_llm(tier, label, llm_provider, llm_model, prompt, use_cache=use_cache, hedge=hedge)
+
+
+async def _request_repair(tier: str, label: str, llm_provider: str, llm_model: str, schema: Type[BaseModel],
+                          content: Any, errors: str, use_cache: Optional[bool]) -> str:
+    """只把不合格的内容和校验错误发给模型修正，不重发原始提示词"""
+    prompt = STRUCTURED_OUTPUT_REPAIR_PROMPT.format(
+        schema=json.dumps(inline_json_schema(schema), ensure_ascii=False, indent=2),
+        errors=errors,
+        content=dump_for_repair(content),
+    )
+    return await _call_with_schema(tier, label, llm_provider, llm_model, prompt, schema, use_cache, hedge=False)
+
+
+async def _repair_whole(tier: str, label: str, llm_provider: str, llm_model: str, schema: Type[ModelT],
+                        content: Any, use_cache: Optional[bool]) -> ModelT:
+    attempts = config.LLM_STRUCTURED_REPAIR_ATTEMPTS
+    for attempt in range(attempts + 1):
         try:
-            response = await create_chat_completion(
-                messages=messages,
-                model=llm_model,
-                llm_provider=llm_provider,
-                temperature=config.temperature,
-                llm_kwargs=config.llm_kwargs,
-            )
-            
-            # 记录 token 使用
-            token_counter.add_call("search_llm", prompt, response)
-            
-            return response
-        except Exception as e:
-            logging.error(f"调用 Search LLM ({llm_provider}) 时发生错误: {e}")
-            return f"Error calling Search LLM: {e}"
+            return schema.model_validate(content)
+        except ValidationError as e:
+            errors = format_validation_errors(e)
+        if attempt == attempts:
+            raise LLMStructuredOutputError(f"输出不符合 {schema.__name__}:\n{errors}", tier, llm_model)
+        logging.warning(f"--- {label} 输出不符合 {schema.__name__}，请求模型修正 ({attempt + 1}/{attempts}) ---")
+        repaired = await _request_repair(tier, label, llm_provider, llm_model, schema, content, errors, use_cache)
+        data = coerce_shape(extract_json(repaired), schema)
+        content = data if data is not None else repaired
+    raise RuntimeError("unreachable")
+
+
+async def _repair_items(tier: str, label: str, llm_provider: str, llm_model: str, schema: Type[ModelT],
+                        item_type: Any, data: List[Any], use_cache: Optional[bool]) -> ModelT:
+    """数组输出逐条校验，只把不合格的元素发回模型修正，合格的元素原样保留"""
+    attempts = config.LLM_STRUCTURED_REPAIR_ATTEMPTS
+    valid, invalid = validate_items(item_type, dict(enumerate(data)))
+    for attempt in range(attempts):
+        if not invalid:
+            break
+        logging.warning(
+            f"--- {label} 输出中 {len(invalid)}/{len(data)} 个元素不符合 {schema.__name__}，"
+            f"请求模型修正 ({attempt + 1}/{attempts}) ---"
+        )
+        errors = "\n".join(f"[{position}]\n{error}" for position, (_, _, error) in enumerate(invalid))
+        repaired = await _request_repair(
+            tier, label, llm_provider, llm_model, schema, [item for _, item, _ in invalid], errors, use_cache
+        )
+        fixed = coerce_shape(extract_json(repaired), schema)
+        if not isinstance(fixed, list) or len(fixed) != len(invalid):
+            # 修正结果无法与原元素一一对应，下一轮重新请求
+            continue
+        fixed_valid, invalid = validate_items(
+            item_type, {index: item for (index, _, _), item in zip(invalid, fixed)}
+        )
+        valid.update(fixed_valid)
+
+    if invalid:
+        errors = "\n".join(error for _, _, error in invalid)
+        if not valid:
+            raise LLMStructuredOutputError(f"输出不符合 {schema.__name__}:\n{errors}", tier, llm_model)
+        logging.warning(f"--- {label} 丢弃 {len(invalid)} 个修正后仍不符合 {schema.__name__} 的元素 ---")
+    return schema.model_validate([valid[index] for index in sorted(valid)])
+
+
+async def call_structured_llm(
+    prompt: str,
+    schema: Type[ModelT],
+    tier: str = "fast_llm",
+    use_cache: Optional[bool] = None,
+    hedge: Optional[bool] = None,
+) -> ModelT:
+    """
+    调用 fast / smart / writer 层级的模型，返回符合 schema 的 Pydantic 对象。
+
+    1. 按提供商传入原生结构化输出参数（LLM_STRUCTURED_OUTPUT），约束模型直接输出合法 JSON
+    2. 本地解析（json_repair）、纠正顶层形状并按 schema 校验
+    3. 仍不合格时只把不合格的部分（数组中的个别元素，或整个对象）连同校验错误发回模型修正，
+       最多 LLM_STRUCTURED_REPAIR_ATTEMPTS 次，不重发原始提示词
+
+    Raises:
+        LLMError: 调用失败；修正后仍不符合 schema 时为 LLMStructuredOutputError。
+    """
+    label, llm_provider, llm_model = _tier_model(tier)
+    response = await _call_with_schema(tier, label, llm_provider, llm_model, prompt, schema, use_cache, hedge)
+    data = coerce_shape(extract_json(response), schema)
+    item_type = list_item_type(schema)
+    if item_type is not None and isinstance(data, list):
+        return await _repair_items(tier, label, llm_provider, llm_model, schema, item_type, data, use_cache)
+    return await _repair_whole(
+        tier, label, llm_provider, llm_model, schema, data if data is not None else response, use_cache
+    )
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: llm_cache.py
+@time: 2025-12-06
+@desc: 基于 SQLite 的持久化 LLM 响应缓存，按 (模型层级, 模型, 温度, 调用参数, 提示词) 的哈希缓存响应文本，
+       断点续跑或重跑报告时相同的提示词不再重复调用模型
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from ..config import deep_reader_config
+
+# 与其他缓存放在同一目录下: backend/memory/llm_cache.sqlite
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent.parent / "memory" / "llm_cache.sqlite"
+
+
+def llm_cache_key(tier: str, provider: str, model: str, temperature: float,
+                  llm_kwargs: Optional[Dict[str, Any]], prompt: str) -> str:
+    """缓存键：调用参数与提示词全文的 sha256，任一参数变化都视为不同的请求"""
+    params = json.dumps(
+        [tier, provider, model, temperature, llm_kwargs or {}], ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(f"{params}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    持久化 LLM 响应缓存，线程安全。
+
+    - 以 llm_cache_key() 为键，值为响应文本，同时记录层级和模型便于按模型清理
+    - 条目写入超过 ttl_hours 小时后失效（None 表示不过期），读取时遇到过期条目直接删除
+    - 响应文本总大小超过 max_mb 时先清除过期条目，再按最近访问时间（LRU）淘汰
+    """
+
+    def __init__(self, db_path: str = str(DEFAULT_CACHE_PATH), ttl_hours: Optional[float] = 168.0,
+                 max_mb: float = 512):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_hours * 3600 if ttl_hours else None
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                tier TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_last_access ON llm_responses (last_access)")
+        self._conn.commit()
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，未命中或条目已过期时返回 None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, size, created FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, size, created = row
+            if self._expired(created, now):
+                self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._bytes -= size
+                return None
+            self._conn.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return response
+
+    def put(self, key: str, tier: str, model: str, response: str):
+        """写入缓存；写入后如超出容量则淘汰"""
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, tier, model, response, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, tier, model, response, size, now, now),
+            )
+            self._conn.commit()
+            self._bytes += size - (old[0] if old else 0)
+            if self._bytes > self.max_bytes:
+                self._evict_locked(now)
+
+    def clear(self, model: Optional[str] = None) -> int:
+        """删除全部条目，或只删除某个模型的条目，返回删除的条目数"""
+        with self._lock:
+            if model is None:
+                deleted = self._conn.execute("DELETE FROM llm_responses").rowcount
+            else:
+                deleted = self._conn.execute("DELETE FROM llm_responses WHERE model = ?", (model,)).rowcount
+            self._conn.commit()
+            self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+        return deleted
+
+    def _evict_locked(self, now: float):
+        """在持有 _lock 时调用：清除过期条目，仍超出容量时删除最久未访问的条目，保留 90% 容量作为余量"""
+        expired = 0
+        if self.ttl_seconds is not None:
+            expired = self._conn.execute(
+                "DELETE FROM llm_responses WHERE created < ?", (now - self.ttl_seconds,)
+            ).rowcount
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        freed = 0
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+        if total > target:
+            cursor = self._conn.execute("SELECT key, size FROM llm_responses ORDER BY last_access")
+            victims = []
+            for key, size in cursor:
+                if total - freed <= target:
+                    break
+                victims.append((key,))
+                freed += size
+            self._conn.executemany("DELETE FROM llm_responses WHERE key = ?", victims)
+            evicted = len(victims)
+        self._conn.commit()
+        self._bytes = total - freed
+        logging.info(f"[LLMCache] 清除 {expired} 条过期响应，LRU 淘汰 {evicted} 条响应")
+
+
+_global_llm_cache: Optional[LLMResponseCache] = None
+_global_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """获取全局 LLM 响应缓存实例（首次调用时创建缓存文件）"""
+    global _global_llm_cache
+    with _global_llm_cache_lock:
+        if _global_llm_cache is None:
+            _global_llm_cache = LLMResponseCache(
+                ttl_hours=deep_reader_config.LLM_CACHE_TTL_HOURS,
+                max_mb=deep_reader_config.LLM_CACHE_MAX_MB,
+            )
+        return _global_llm_cache
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: llm_errors.py
+@time: 2025-12-08
+@desc: LLM 调用的类型化异常：区分可重试（限流、超时、服务端错误、网络错误）与不可重试（请求参数、鉴权）的失败，
+       供 llm.py 决定退避重试还是直接抛出
+"""
+import asyncio
+import socket
+from typing import Optional
+
+
+class LLMError(Exception):
+    """LLM 调用失败（已用尽重试或不可重试）"""
+    retryable: bool = False
+
+    def __init__(self, message: str, tier: str = "", model: str = "", status: Optional[int] = None):
+        super().__init__(message)
+        self.tier = tier
+        self.model = model
+        self.status = status
+
+    def __str__(self) -> str:
+        prefix = f"[{self.tier}/{self.model}] " if self.tier else ""
+        return f"{prefix}{type(self).__name__}: {self.args[0]}"
+
+
+class LLMRequestError(LLMError):
+    """不可重试：请求参数错误、鉴权失败、模型不存在、内容被拒绝等，重试也会得到同样的结果"""
+
+
+class LLMStructuredOutputError(LLMError):
+    """结构化输出经本地修复和模型修正后仍不符合 Schema"""
+
+
+class LLMRetryableError(LLMError):
+    """可重试的失败，retry_after 为服务端建议的等待秒数"""
+    retryable = True
+
+    def __init__(self, message: str, tier: str = "", model: str = "", status: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message, tier, model, status)
+        self.retry_after = retry_after
+
+
+class LLMRateLimitError(LLMRetryableError):
+    """429 限流 / 配额耗尽"""
+
+
+class LLMTimeoutError(LLMRetryableError):
+    """调用超时"""
+
+
+class LLMServerError(LLMRetryableError):
+    """5xx 服务端错误或网络连接错误"""
+
+
+class LLMEmptyResponseError(LLMRetryableError):
+    """模型返回了空响应"""
+
+
+# 异常类名中出现这些片段时按对应类别处理（兼容 openai / google-genai / httpx / langchain 的异常类型）
+_RATE_LIMIT_NAMES = ("RateLimit", "ResourceExhausted", "TooManyRequests")
+_TIMEOUT_NAMES = ("Timeout", "DeadlineExceeded")
+_SERVER_NAMES = (
+    "ServerError", "InternalServer", "ServiceUnavailable", "Connect", "RemoteProtocol", "ReadError", "WriteError", "Network",
+)
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    for source in (error, getattr(error, "response", None)):
+        for attr in ("status_code", "code", "status"):
+            value = getattr(source, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+    return None
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_llm_error(error: BaseException, tier: str = "", model: str = "") -> LLMError:
+    """
+    将底层 SDK 抛出的异常转换为 LLMError 子类。
+    无法识别的异常按不可重试处理（快速失败），连接错误和 DNS 解析失败按可重试处理；
+    文件不存在、权限不足等本地 OSError 不重试。
+    """
+    if isinstance(error, LLMError):
+        return error
+    name = type(error).__name__
+    status = _status_code(error)
+    message = str(error) or name
+    retry_after = _retry_after_seconds(error)
+
+    if status == 429 or any(part in name for part in _RATE_LIMIT_NAMES):
+        return LLMRateLimitError(message, tier, model, status, retry_after)
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)) or status == 408 \
+            or any(part in name for part in _TIMEOUT_NAMES):
+        return LLMTimeoutError(message, tier, model, status, retry_after)
+    if (status is not None and status >= 500) or status == 409 \
+            or isinstance(error, (ConnectionError, socket.gaierror)) or any(part in name for part in _SERVER_NAMES):
+        return LLMServerError(message, tier, model, status, retry_after)
+    return LLMRequestError(message, tier, model, status)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: llm_scheduler.py
+@time: 2025-12-07
+@desc: LLM 调用调度器：按模型层级（fast / smart / writer / search）限制并发数和每分钟请求数 / token 数，
+       超出预算的调用按到达顺序排队，并统计排队等待时间
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from ..config import deep_reader_config
+
+# 排队等待超过该秒数时记录日志
+_SLOW_WAIT_SECONDS = 1.0
+
+# 计算等待时间 / 调用耗时分位数时保留的最近样本数
+_WAIT_SAMPLES = 512
+
+
+def _percentile(samples, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class TokenBucket:
+    """
+    令牌桶：以每分钟 rate_per_minute 的速率持续补充，容量为 burst_seconds 秒的补充量。
+    单次消耗超过容量时等到桶满即可放行，余额允许为负，后续调用相应等待更久。
+    """
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """取走 amount 之前还需等待的秒数"""
+        self._refill(now)
+        need = min(amount, self.capacity)
+        if self.level >= need:
+            return 0.0
+        return (need - self.level) / self.rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= amount
+
+
+class LLMLease:
+    """一次已放行的调用，调用结束后通过 add_tokens 补记输出消耗的 token"""
+
+    def __init__(self, limiter: "TierLimiter", wait_seconds: float):
+        self._limiter = limiter
+        self.wait_seconds = wait_seconds
+
+    def add_tokens(self, tokens: int):
+        if self._limiter.tokens is not None and tokens > 0:
+            self._limiter.tokens.take(tokens, time.monotonic())
+
+
+class TierLimiter:
+    """
+    单个模型层级的限流器。
+
+    - 调用先进入 FIFO 队列：队首依次等待并发名额、请求数预算和 token 预算，放行后下一个调用才开始等待，
+      先到的调用不会被后到的小请求插队
+    - token 预算在放行时按提示词扣除，输出的 token 在调用结束后补扣
+    - 成功调用的耗时（不含排队）计入最近样本，供对冲请求取 p95 延迟
+    - asyncio 原语绑定在首次使用的事件循环上，事件循环变化时（如多次 asyncio.run）重新创建
+    """
+
+    def __init__(
+        self,
+        tier: str,
+        max_concurrency: Optional[int] = None,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        burst_seconds: float = 10.0,
+    ):
+        self.tier = tier
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(rpm, burst_seconds) if rpm else None
+        self.tokens = TokenBucket(tpm, burst_seconds) if tpm else None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._gate: Optional[asyncio.Lock] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self.calls = 0
+        self.waiting = 0
+        self.in_flight = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent_waits = deque(maxlen=_WAIT_SAMPLES)
+        self._recent_latencies = deque(maxlen=_WAIT_SAMPLES)
+        # 发出的对冲请求数，以及对冲请求先于原请求返回的次数
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._gate = asyncio.Lock()
+            self._slots = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+
+    def _budget_wait(self, prompt_tokens: int, now: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(prompt_tokens, now))
+        return wait
+
+    @asynccontextmanager
+    async def acquire(self, prompt_tokens: int = 0) -> AsyncIterator[LLMLease]:
+        """排队直到并发名额和预算都满足，在 async with 块内执行模型调用"""
+        self._bind_loop()
+        slots = self._slots
+        enqueued = time.monotonic()
+        self.waiting += 1
+        slot_taken = False
+        try:
+            async with self._gate:
+                if slots is not None:
+                    await slots.acquire()
+                    slot_taken = True
+                while True:
+                    now = time.monotonic()
+                    delay = self._budget_wait(prompt_tokens, now)
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+                if self.requests is not None:
+                    self.requests.take(1, now)
+                if self.tokens is not None:
+                    self.tokens.take(prompt_tokens, now)
+        except BaseException:
+            if slot_taken:
+                slots.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+        wait = time.monotonic() - enqueued
+        self.calls += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._recent_waits.append(wait)
+        if wait >= _SLOW_WAIT_SECONDS:
+            logging.info(f"[LLMScheduler] {self.tier} 排队 {wait:.1f}s 后放行（仍有 {self.waiting} 个调用在排队）")
+
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield LLMLease(self, wait)
+            self._recent_latencies.append(time.monotonic() - started)
+        finally:
+            self.in_flight -= 1
+            if slots is not None:
+                slots.release()
+
+    def latency_percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        """最近成功调用耗时的分位数，样本不足 min_samples 时返回 None"""
+        if len(self._recent_latencies) < max(1, min_samples):
+            return None
+        return _percentile(self._recent_latencies, p)
+
+    def stats(self) -> Dict[str, Any]:
+        def percentile(samples, p: float) -> float:
+            return round(_percentile(samples, p), 3) if samples else 0.0
+
+        return {
+            "max_concurrency": self.max_concurrency,
+            "calls": self.calls,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "avg_wait_seconds": round(self.total_wait / self.calls, 3) if self.calls else 0.0,
+            "p50_wait_seconds": percentile(self._recent_waits, 0.5),
+            "p95_wait_seconds": percentile(self._recent_waits, 0.95),
+            "max_wait_seconds": round(self.max_wait, 3),
+            "p50_latency_seconds": percentile(self._recent_latencies, 0.5),
+            "p95_latency_seconds": percentile(self._recent_latencies, 0.95),
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+class LLMScheduler:
+    """各层级限流器的集合，预算取自 DeepReaderConfig 的 LLM_MAX_CONCURRENCY / LLM_RPM / LLM_TPM"""
+
+    def __init__(self):
+        self._limiters: Dict[str, TierLimiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, tier: str) -> TierLimiter:
+        with self._lock:
+            if tier not in self._limiters:
+                config = deep_reader_config
+                self._limiters[tier] = TierLimiter(
+                    tier,
+                    max_concurrency=config.LLM_MAX_CONCURRENCY.get(tier),
+                    rpm=config.LLM_RPM.get(tier),
+                    tpm=config.LLM_TPM.get(tier),
+                    burst_seconds=config.LLM_RATE_BURST_SECONDS,
+                )
+            return self._limiters[tier]
+
+    def acquire(self, tier: str, prompt_tokens: int = 0):
+        """async with get_llm_scheduler().acquire(tier, prompt_tokens) as lease: ..."""
+        return self.limiter(tier).acquire(prompt_tokens)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {tier: limiter.stats() for tier, limiter in limiters.items()}
+
+
+_global_llm_scheduler: Optional[LLMScheduler] = None
+_global_llm_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    """获取全局 LLM 调用调度器"""
+    global _global_llm_scheduler
+    with _global_llm_scheduler_lock:
+        if _global_llm_scheduler is None:
+            _global_llm_scheduler = LLMScheduler()
+        return _global_llm_scheduler
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: memory_manager.py
+@time: 2025-12-04
+@desc: backend/memory 目录的生命周期管理：统计各向量库的磁盘占用、向量数和最近访问时间，
+       超出配额时按 LRU 删除最久未使用的库，并压缩（VACUUM SQLite、清理并重建 FAISS 索引）
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+import faiss
+import numpy as np
+
+from ..config import deep_reader_config
+from . import index_factory
+from .document_cache import get_document_manifest
+from .library import DEFAULT_LIBRARY_DIR
+from .query_cache import get_query_cache
+from .store_access import get_store_access_log, store_key
+from .store_registry import get_store_registry
+from .vector_store import DeepReaderVectorStore, read_store_meta, write_store_meta
+
+DEFAULT_MEMORY_DIR = Path(__file__).resolve().parent.parent / "memory"
+
+# 一个向量库包含的全部文件（.faiss.tmp 为中断写入的残留，.faiss.bak 为 index_migration 的备份）
+_STORE_SUFFIXES = (".sqlite", ".sqlite-wal", ".sqlite-shm", ".faiss", ".faiss.tmp", ".faiss.bak")
+
+_MB = 1024 * 1024
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _is_vector_store(sqlite_path: str) -> bool:
+    """目录下的 SQLite 文件还包括各类缓存，带有 chunks 表的才是向量库"""
+    try:
+        conn = sqlite3.connect(f"{Path(sqlite_path).resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            return conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks'"
+            ).fetchone() is not None
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+
+
+class MemoryManager:
+    """
+    管理一个 memory 目录中的向量库（{base}.faiss + {base}.sqlite），线程安全。
+
+    - stats(): 每个库的文件大小、块数、向量数、残留向量、SQLite 空闲空间和最近访问时间
+      （访问时间由 store_access 在打开库和从池中取出时记录，没有记录的旧库以文件修改时间代替）
+    - gc(): 总占用超出配额时按最近访问时间从旧到新删除，跳过正在使用、入库未完成、
+      被文库引用以及最近 MEMORY_GC_MIN_IDLE_HOURS 小时内访问过的库
+    - compact(): 移除 FAISS 中没有对应块的残留向量，按当前配置重建落后的索引类型，清理临时文件，
+      并对 SQLite 执行 FTS 优化、VACUUM 和 WAL 截断
+
+    正在使用的判断只覆盖当前进程的 VectorStoreRegistry；其他进程仍在使用的库依靠最近访问时间保护。
+    """
+
+    def __init__(self, memory_dir: str = str(DEFAULT_MEMORY_DIR), library_dir: str = str(DEFAULT_LIBRARY_DIR)):
+        self.memory_dir = memory_dir
+        self.library_dir = library_dir
+        self._lock = threading.Lock()
+
+    # =================================================================
+    # 统计
+    # =================================================================
+
+    def find_stores(self) -> List[str]:
+        """列出目录下的全部向量库（不带扩展名的路径），包括只剩 .sqlite 或 .faiss 的残缺库"""
+        bases = set()
+        for path in Path(self.memory_dir).glob("*.sqlite"):
+            if _is_vector_store(str(path)):
+                bases.add(str(path.with_suffix("")))
+        for path in Path(self.memory_dir).glob("*.faiss"):
+            bases.add(str(path.with_suffix("")))
+        return sorted(bases)
+
+    def store_stats(self, base: str, last_access: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """单个向量库的统计信息"""
+        files = {suffix: _file_size(f"{base}{suffix}") for suffix in _STORE_SUFFIXES}
+        if last_access is None:
+            last_access = get_store_access_log().last_access()
+        mtimes = [os.path.getmtime(f"{base}{suffix}") for suffix in _STORE_SUFFIXES if os.path.exists(f"{base}{suffix}")]
+        stats: Dict[str, Any] = {
+            "name": os.path.basename(base),
+            "path": base,
+            "sqlite_bytes": files[".sqlite"] + files[".sqlite-wal"] + files[".sqlite-shm"],
+            "faiss_bytes": files[".faiss"],
+            # 中断写入残留的临时文件，压缩时删除
+            "stale_bytes": files[".faiss.tmp"],
+            "total_bytes": sum(files.values()),
+            "last_access": last_access.get(store_key(base)) or (max(mtimes) if mtimes else None),
+            "chunks": None,
+            "vectors": None,
+        }
+        try:
+            if files[".sqlite"]:
+                sqlite_path = f"{base}.sqlite"
+                conn = sqlite3.connect(f"{Path(sqlite_path).resolve().as_uri()}?mode=ro", uri=True)
+                try:
+                    stats["chunks"] = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+                    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+                    stats["sqlite_free_bytes"] = conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size
+                    meta = read_store_meta(conn)
+                    stats["embedding_model"] = meta.get("embedding_model")
+                finally:
+                    conn.close()
+                stats["pending_ingest"] = DeepReaderVectorStore.has_pending_ingest(sqlite_path)
+            if files[".faiss"]:
+                index = index_factory.read_index_mmap(f"{base}.faiss")
+                stats["vectors"] = index.ntotal
+                stats["dimension"] = index.d
+                stats["index_type"] = index_factory.index_type_of(index)
+                stats["storage"] = index_factory.storage_of(index)
+                stats["recommended_index_type"] = index_factory.resolve_index_type(
+                    deep_reader_config.VECTOR_INDEX_TYPE, index.ntotal
+                )
+                del index
+            if stats["vectors"] is not None and stats["chunks"] is not None:
+                stats["orphan_vectors"] = max(stats["vectors"] - stats["chunks"], 0)
+        except Exception as e:
+            stats["error"] = str(e)
+        stats["needs_compaction"] = self._needs_compaction(stats)
+        return stats
+
+    @staticmethod
+    def _needs_compaction(stats: Dict[str, Any]) -> bool:
+        if "error" in stats or stats["chunks"] is None:
+            return False
+        if stats.get("orphan_vectors") or stats["stale_bytes"]:
+            return True
+        if stats.get("index_type") not in (None, "ivfpq") and stats.get("index_type") != stats.get("recommended_index_type"):
+            return True
+        free_ratio = stats.get("sqlite_free_bytes", 0) / max(stats["sqlite_bytes"], 1)
+        return free_ratio >= deep_reader_config.MEMORY_COMPACT_FREE_RATIO
+
+    def stats(self) -> Dict[str, Any]:
+        """整个目录的统计：各向量库（按最近访问时间从新到旧）、合计占用和配额"""
+        last_access = get_store_access_log().last_access()
+        stores = [self.store_stats(base, last_access) for base in self.find_stores()]
+        stores.sort(key=lambda s: s["last_access"] or 0, reverse=True)
+        store_bytes = sum(s["total_bytes"] for s in stores)
+        total_bytes = sum(path.stat().st_size for path in Path(self.memory_dir).rglob("*") if path.is_file())
+        quota_mb = deep_reader_config.MEMORY_QUOTA_MB
+        return {
+            "memory_dir": self.memory_dir,
+            "store_count": len(stores),
+            "store_bytes": store_bytes,
+            "vectors": sum(s["vectors"] or 0 for s in stores),
+            # 缓存（Embedding / 检索结果）、manifest、文库合并索引等其他文件
+            "other_bytes": total_bytes - store_bytes,
+            "total_bytes": total_bytes,
+            "quota_bytes": quota_mb * _MB if quota_mb is not None else None,
+            "stores": stores,
+        }
+
+    # =================================================================
+    # 回收
+    # =================================================================
+
+    def _library_stores(self) -> Dict[str, str]:
+        """被文库引用的向量库: store_key -> 文库名"""
+        referenced = {}
+        for path in Path(self.library_dir).glob("*.json"):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    shards = json.load(f).get("shards", [])
+            except (json.JSONDecodeError, IOError) as e:
+                logging.warning(f"[MemoryManager] 无法读取文库定义 {path}: {e}")
+                continue
+            for shard in shards:
+                # 与 DeepReaderVectorStore 一致：db_name 总是相对于 backend/memory
+                base = shard.get("db_path") or str(DEFAULT_MEMORY_DIR / shard["db_name"])
+                referenced[store_key(base)] = path.stem
+        return referenced
+
+    def _protection(self, stats: Dict[str, Any], in_use: Set[str], libraries: Dict[str, str], min_idle_hours: float) -> Optional[str]:
+        """返回不能回收该库的原因，可以回收时返回 None"""
+        key = store_key(stats["path"])
+        if key in in_use:
+            return "in_use"
+        if stats.get("pending_ingest"):
+            return "pending_ingest"
+        if key in libraries:
+            return f"library:{libraries[key]}"
+        if stats["last_access"] and time.time() - stats["last_access"] < min_idle_hours * 3600:
+            return "recent"
+        return None
+
+    def delete_store(self, base: str):
+        """删除一个向量库的全部文件，并清理池化实例、访问记录、manifest 和检索结果缓存中的相关条目"""
+        registry = get_store_registry()
+        registry.invalidate(db_path=base)
+        if os.path.dirname(os.path.abspath(base)) == str(DEFAULT_MEMORY_DIR):
+            registry.invalidate(db_name=os.path.basename(base))
+        for suffix in _STORE_SUFFIXES:
+            if os.path.exists(f"{base}{suffix}"):
+                os.remove(f"{base}{suffix}")
+        get_store_access_log().forget(base)
+        # 文档缓存以内容键（即 db_name）命名向量库，删除后该文档下次处理时重新入库
+        get_document_manifest().remove_content_key(os.path.basename(base))
+        if deep_reader_config.RAG_QUERY_CACHE_ENABLED:
+            get_query_cache().purge_store(os.path.abspath(f"{base}.sqlite"))
+        logging.info(f"[MemoryManager] 已删除向量库: {base}")
+
+    def gc(
+        self,
+        quota_mb: Optional[int] = None,
+        min_idle_hours: Optional[float] = None,
+        dry_run: bool = False,
+        compact: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        回收磁盘空间：总占用超出配额时按最近访问时间从旧到新删除可回收的库，直到不超过配额。
+
+        Args:
+            quota_mb: 配额（MB），默认使用 MEMORY_QUOTA_MB；None 且配置也为 None 时不删除任何库
+            min_idle_hours: 最近访问保护时长，默认使用 MEMORY_GC_MIN_IDLE_HOURS
+            dry_run: 只返回将要删除和压缩的库，不做任何修改
+            compact: 同时压缩剩余的、需要压缩的库
+
+        Returns:
+            回收报告：回收前后的占用、删除的库、因保护而跳过的库、压缩结果。
+        """
+        quota_mb = deep_reader_config.MEMORY_QUOTA_MB if quota_mb is None else quota_mb
+        min_idle_hours = deep_reader_config.MEMORY_GC_MIN_IDLE_HOURS if min_idle_hours is None else min_idle_hours
+        with self._lock:
+            stores = self.stats()["stores"]
+            in_use = {store_key(path) for path in get_store_registry().leased_paths()}
+            libraries = self._library_stores()
+            before = sum(s["total_bytes"] for s in stores)
+            report: Dict[str, Any] = {
+                "bytes_before": before,
+                "quota_bytes": quota_mb * _MB if quota_mb is not None else None,
+                "evicted": [],
+                "skipped": {},
+                "compacted": [],
+                "dry_run": dry_run,
+            }
+
+            remaining = before
+            evicted = set()
+            if quota_mb is not None and remaining > quota_mb * _MB:
+                # 最久未访问的排在前面
+                for stats in sorted(stores, key=lambda s: s["last_access"] or 0):
+                    if remaining <= quota_mb * _MB:
+                        break
+                    reason = self._protection(stats, in_use, libraries, min_idle_hours)
+                    if reason:
+                        report["skipped"][stats["name"]] = reason
+                        continue
+                    if not dry_run:
+                        self.delete_store(stats["path"])
+                    evicted.add(stats["path"])
+                    remaining -= stats["total_bytes"]
+                    report["evicted"].append({"name": stats["name"], "bytes": stats["total_bytes"], "last_access": stats["last_access"]})
+                if remaining > quota_mb * _MB:
+                    logging.warning(
+                        f"[MemoryManager] 回收后仍超出配额: {remaining / _MB:.0f}MB > {quota_mb}MB"
+                        f"（{len(report['skipped'])} 个库受保护）"
+                    )
+
+            if compact:
+                for stats in stores:
+                    if stats["path"] in evicted or not stats["needs_compaction"]:
+                        continue
+                    if store_key(stats["path"]) in in_use or stats.get("pending_ingest"):
+                        report["skipped"].setdefault(stats["name"], "in_use" if store_key(stats["path"]) in in_use else "pending_ingest")
+                        continue
+                    if dry_run:
+                        report["compacted"].append({"name": stats["name"], "bytes_before": stats["total_bytes"]})
+                    else:
+                        report["compacted"].append(self.compact_store(stats["path"]))
+                remaining -= sum(c["bytes_before"] - c.get("bytes_after", c["bytes_before"]) for c in report["compacted"])
+
+            report["bytes_after"] = remaining
+            return report
+
+    # =================================================================
+    # 压缩
+    # =================================================================
+
+    def compact_store(self, base: str) -> Dict[str, Any]:
+        """
+        压缩一个向量库。请勿对正在入库的库调用；其他进程的只读实例不受影响
+        （FAISS 文件通过原子替换更新，已映射的旧文件在其关闭前保持有效）。
+        """
+        faiss_path = f"{base}.faiss"
+        sqlite_path = f"{base}.sqlite"
+        if not os.path.exists(sqlite_path):
+            raise FileNotFoundError(f"找不到向量库: {sqlite_path}")
+        report: Dict[str, Any] = {
+            "name": os.path.basename(base),
+            "bytes_before": sum(_file_size(f"{base}{suffix}") for suffix in _STORE_SUFFIXES),
+            "removed_vectors": 0,
+        }
+        if os.path.exists(f"{faiss_path}.tmp"):
+            os.remove(f"{faiss_path}.tmp")
+
+        conn = sqlite3.connect(sqlite_path)
+        try:
+            if os.path.exists(faiss_path):
+                index = faiss.read_index(faiss_path)
+                current = index_factory.index_type_of(index)
+                report["index_type"] = current
+                chunk_ids = np.array([row[0] for row in conn.execute("SELECT id FROM chunks")], dtype="int64")
+                ids = index_factory.stored_ids(index)
+                index, removed = index_factory.remove_ids(index, ids[~np.isin(ids, chunk_ids)])
+                report["removed_vectors"] = removed
+                changed = removed > 0
+
+                target = index_factory.resolve_index_type(deep_reader_config.VECTOR_INDEX_TYPE, index.ntotal)
+                if index.ntotal and target != current and current != "ivfpq":
+                    # 与 rebuild_index 一致：PQ 编码是有损的，不从 ivfpq 降级重建
+                    ids, vectors = index_factory.extract_vectors(index)
+                    index = index_factory.build_index(target, index.d, ids, vectors, storage=index_factory.storage_of(index))
+                    report["index_type"] = target
+                    changed = True
+
+                if changed:
+                    tmp_path = f"{faiss_path}.tmp"
+                    faiss.write_index(index, tmp_path)
+                    os.replace(tmp_path, faiss_path)
+                    # 索引内容变化，已缓存的检索结果随之失效
+                    write_store_meta(conn, {"index_version": uuid.uuid4().hex})
+                del index
+
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'").fetchone():
+                conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('optimize')")
+                conn.commit()
+            conn.execute("VACUUM")
+            # WAL 模式下 VACUUM 先写入 WAL，再次检查点以截断 WAL 文件
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+
+        registry = get_store_registry()
+        registry.invalidate(db_path=base)
+        if os.path.dirname(os.path.abspath(base)) == str(DEFAULT_MEMORY_DIR):
+            registry.invalidate(db_name=os.path.basename(base))
+        report["bytes_after"] = sum(_file_size(f"{base}{suffix}") for suffix in _STORE_SUFFIXES)
+        logging.info(
+            f"[MemoryManager] 已压缩 {report['name']}: {report['bytes_before'] / _MB:.1f}MB -> "
+            f"{report['bytes_after'] / _MB:.1f}MB，移除 {report['removed_vectors']} 个残留向量"
+        )
+        return report
+
+    def compact(self, bases: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """压缩指定的库（默认为目录下全部需要压缩的库），跳过正在使用和入库未完成的库"""
+        with self._lock:
+            in_use = {store_key(path) for path in get_store_registry().leased_paths()}
+            if bases is None:
+                last_access = get_store_access_log().last_access()
+                bases = [base for base in self.find_stores() if self.store_stats(base, last_access)["needs_compaction"]]
+            reports = []
+            for base in bases:
+                if store_key(base) in in_use or DeepReaderVectorStore.has_pending_ingest(f"{base}.sqlite"):
+                    logging.info(f"[MemoryManager] 跳过正在使用或入库未完成的库: {base}")
+                    continue
+                reports.append(self.compact_store(base))
+            return reports
+
+
+_global_memory_manager: Optional[MemoryManager] = None
+_global_memory_manager_lock = threading.Lock()
+
+
+def get_memory_manager() -> MemoryManager:
+    """获取管理 backend/memory 的全局实例"""
+    global _global_memory_manager
+    with _global_memory_manager_lock:
+        if _global_memory_manager is None:
+            _global_memory_manager = MemoryManager()
+        return _global_memory_manager
+
+
+def _format_time(timestamp: Optional[float]) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else "-"
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    """命令行入口（也可通过 python main.py memory ... 调用）"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='memory', description='查看和回收 backend/memory 中的向量库')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    stats_parser = subparsers.add_parser('stats', help='各向量库的磁盘占用、向量数和最近访问时间')
+    stats_parser.add_argument('--json', action='store_true', help='以 JSON 输出')
+
+    gc_parser = subparsers.add_parser('gc', help='超出配额时按最近访问时间删除最久未使用的库')
+    gc_parser.add_argument('--quota-mb', type=int, help='配额（MB），默认使用 MEMORY_QUOTA_MB')
+    gc_parser.add_argument('--min-idle-hours', type=float, help='最近访问保护时长，默认使用 MEMORY_GC_MIN_IDLE_HOURS')
+    gc_parser.add_argument('--compact', action='store_true', help='同时压缩剩余的库')
+    gc_parser.add_argument('--dry-run', action='store_true', help='只列出将要删除和压缩的库')
+
+    compact_parser = subparsers.add_parser('compact', help='VACUUM SQLite 并清理、重建 FAISS 索引')
+    compact_parser.add_argument('stores', nargs='*', help='向量库路径（不带扩展名）或 backend/memory 下的 db_name，默认为全部需要压缩的库')
+    args = parser.parse_args(argv)
+
+    manager = get_memory_manager()
+    if args.command == 'stats':
+        stats = manager.stats()
+        if args.json:
+            print(json.dumps(stats, ensure_ascii=False, indent=2))
+            return
+        for store in stats["stores"]:
+            flag = " *" if store["needs_compaction"] else ""
+            print(
+                f"{store['name']}  {store['total_bytes'] / _MB:>8.1f}MB  {store['vectors'] or 0:>8} 向量  "
+                f"{store.get('index_type', '-'):<6} 最近访问 {_format_time(store['last_access'])}{flag}"
+            )
+        quota = f"{stats['quota_bytes'] / _MB:.0f}MB" if stats["quota_bytes"] is not None else "不限"
+        print(
+            f"合计: {stats['store_count']} 个库 {stats['store_bytes'] / _MB:.1f}MB，{stats['vectors']} 个向量；"
+            f"其他文件 {stats['other_bytes'] / _MB:.1f}MB；配额 {quota}（* 表示需要压缩）"
+        )
+    elif args.command == 'gc':
+        report = manager.gc(quota_mb=args.quota_mb, min_idle_hours=args.min_idle_hours, dry_run=args.dry_run, compact=args.compact)
+        action = "将删除" if args.dry_run else "已删除"
+        for item in report["evicted"]:
+            print(f"[{action}] {item['name']}  {item['bytes'] / _MB:.1f}MB  最近访问 {_format_time(item['last_access'])}")
+        for name, reason in report["skipped"].items():
+            print(f"[跳过] {name}: {reason}")
+        for item in report["compacted"]:
+            print(f"[压缩] {item['name']}  {item['bytes_before'] / _MB:.1f}MB -> {item.get('bytes_after', item['bytes_before']) / _MB:.1f}MB")
+        print(f"合计: {report['bytes_before'] / _MB:.1f}MB -> {report['bytes_after'] / _MB:.1f}MB")
+    elif args.command == 'compact':
+        bases = [store if os.path.exists(f"{store}.sqlite") else str(DEFAULT_MEMORY_DIR / store) for store in args.stores]
+        for item in manager.compact(bases or None):
+            print(
+                f"[压缩] {item['name']}  {item['bytes_before'] / _MB:.1f}MB -> {item['bytes_after'] / _MB:.1f}MB，"
+                f"移除 {item['removed_vectors']} 个残留向量"
+            )
+
+
+if __name__ == '__main__':
+    main()
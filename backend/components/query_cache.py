@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: query_cache.py
+@time: 2025-11-29
+@desc: 基于 SQLite 的持久化检索结果缓存，按 (向量库, 索引版本, 检索参数, 规范化查询) 缓存命中的块 id，
+       重复查询时跳过 Embedding 请求和索引搜索
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from ..config import deep_reader_config
+
+# 与向量数据库放在同一目录下: backend/memory/query_cache.sqlite
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent.parent / "memory" / "query_cache.sqlite"
+
+# SQLite 单条语句允许的最大参数个数（旧版本默认 999），留出其他参数的位置
+_SQLITE_MAX_VARIABLES = 900
+
+# 一个查询的有序命中：(块 id, L2 距离)，全文检索命中的块没有距离
+RankedHits = List[Tuple[int, Optional[float]]]
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询文本：合并连续空白并去掉首尾空白，仅空白不同的查询共享同一条缓存"""
+    return " ".join(query.split())
+
+
+def _query_key(query: str, params: str) -> str:
+    return hashlib.sha256(f"{params}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """
+    持久化检索结果缓存，线程安全。
+
+    - 以 (store, version, sha256(检索参数 + 规范化查询)) 为键，值为有序的 (块 id, 距离) 列表
+    - store 为向量库路径，version 为库的索引版本：入库或重建索引会生成新版本，旧版本的条目自然失效，
+      并在该库下次写入缓存时清除
+    - 条目数超过 max_entries 时按最近访问时间（LRU）淘汰
+    """
+
+    def __init__(self, db_path: str = str(DEFAULT_CACHE_PATH), max_entries: int = 50_000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_results (
+                store TEXT NOT NULL,
+                version TEXT NOT NULL,
+                query_hash TEXT NOT NULL,
+                hits TEXT NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (store, version, query_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_query_results_last_access ON query_results (last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM query_results").fetchone()[0]
+        # 已清理过旧版本条目的 (store, version)，避免每次写入都执行 DELETE
+        self._purged = set()
+
+    def get_many(self, store: str, version: str, params: str, queries: Sequence[str]) -> List[Optional[RankedHits]]:
+        """
+        批量查询缓存。params 为检索参数（检索方式、k、距离阈值等）的字符串形式。
+        返回与 queries 一一对应的列表，未命中的位置为 None。
+        """
+        hashes = [_query_key(q, params) for q in queries]
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+
+        with self._lock:
+            cursor = self._conn.cursor()
+            for start in range(0, len(unique_hashes), _SQLITE_MAX_VARIABLES):
+                batch = unique_hashes[start:start + _SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(
+                    f"SELECT query_hash, hits FROM query_results "
+                    f"WHERE store = ? AND version = ? AND query_hash IN ({placeholders})",
+                    [store, version, *batch],
+                )
+                for query_hash, hits in cursor.fetchall():
+                    found[query_hash] = [(int(i), d) for i, d in json.loads(hits)]
+
+            if found:
+                # 刷新命中条目的访问时间，供 LRU 淘汰使用
+                now = time.time()
+                cursor.executemany(
+                    "UPDATE query_results SET last_access = ? WHERE store = ? AND version = ? AND query_hash = ?",
+                    [(now, store, version, h) for h in found],
+                )
+                self._conn.commit()
+
+        return [found.get(h) for h in hashes]
+
+    def put_many(self, store: str, version: str, params: str, queries: Sequence[str], results: Sequence[RankedHits]):
+        """
+        批量写入缓存，同时清除该库旧版本的条目；写入后如超出容量则按 LRU 淘汰。
+        """
+        if not queries:
+            return
+        now = time.time()
+        rows = [
+            (store, version, _query_key(q, params), json.dumps([[i, d] for i, d in hits]), now)
+            for q, hits in zip(queries, results)
+        ]
+        with self._lock:
+            if (store, version) not in self._purged:
+                deleted = self._conn.execute(
+                    "DELETE FROM query_results WHERE store = ? AND version != ?", (store, version)
+                ).rowcount
+                self._count -= max(deleted, 0)
+                self._purged.add((store, version))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO query_results (store, version, query_hash, hits, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._count += len(rows)
+            if self._count > self.max_entries:
+                self._evict_locked()
+
+    def purge_store(self, store: str) -> int:
+        """删除某个库的全部条目（库文件被删除时调用），返回删除的条目数"""
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM query_results WHERE store = ?", (store,)).rowcount
+            self._conn.commit()
+            self._count -= max(deleted, 0)
+            self._purged = {key for key in self._purged if key[0] != store}
+        return deleted
+
+    def _evict_locked(self):
+        """在持有 _lock 时调用：删除最久未访问的条目，保留 90% 容量作为余量"""
+        self._count = self._conn.execute("SELECT COUNT(*) FROM query_results").fetchone()[0]
+        excess = self._count - int(self.max_entries * 0.9)
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM query_results WHERE rowid IN (SELECT rowid FROM query_results ORDER BY last_access LIMIT ?)",
+            (excess,),
+        )
+        self._conn.commit()
+        self._count -= excess
+        logging.info(f"[QueryCache] LRU 淘汰 {excess} 条检索结果缓存")
+
+
+_global_query_cache: Optional[QueryCache] = None
+_global_query_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> QueryCache:
+    """获取全局检索结果缓存实例（首次调用时创建缓存文件）"""
+    global _global_query_cache
+    with _global_query_cache_lock:
+        if _global_query_cache is None:
+            _global_query_cache = QueryCache(max_entries=deep_reader_config.RAG_QUERY_CACHE_MAX_ENTRIES)
+        return _global_query_cache
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: retrieval_context.py
+@time: 2025-11-28
+@desc: 检索结果后处理：合并相邻块并去掉分块重叠部分，抑制近似重复的片段，并按 token 预算装配送入 LLM 的上下文
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+from ..config import deep_reader_config
+from .token_counter import get_token_counter
+
+# 拼接多个检索片段时使用的分隔符（与原有提示词中的格式保持一致）
+CONTEXT_SEPARATOR = "\\n\\n---\\n\\n"
+
+# 判定为相邻块重叠所需的最短公共长度，过短的公共前后缀多为巧合（如换行、标点）
+_MIN_OVERLAP_CHARS = 20
+
+# 近似重复判定所用的字符 n-gram 长度
+_SHINGLE_SIZE = 5
+
+
+def _overlap_length(previous: str, following: str, max_overlap: int) -> int:
+    """
+    following 开头与 previous 结尾重复部分的长度（RecursiveCharacterTextSplitter 产生的重叠），
+    找不到足够长的重叠时返回 0。
+    """
+    limit = min(len(previous), len(following), max_overlap)
+    for length in range(limit, _MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+def _span(doc: Document) -> Tuple[int, int]:
+    """文档覆盖的 chunk_index 闭区间（合并后的片段带有 chunk_index_end）"""
+    start = doc.metadata["chunk_index"]
+    return start, doc.metadata.get("chunk_index_end", start)
+
+
+def _chunk_ids(doc: Document) -> List[int]:
+    if "chunk_ids" in doc.metadata:
+        return list(doc.metadata["chunk_ids"])
+    return [doc.metadata["chunk_id"]] if "chunk_id" in doc.metadata else []
+
+
+def _merge_span(docs: List[Document], max_overlap: int) -> Document:
+    """将同一来源、chunk_index 连续的若干块（或已合并的片段）合并为一个片段"""
+    docs = sorted(docs, key=lambda d: d.metadata["chunk_index"])
+    content = docs[0].page_content
+    previous = docs[0].page_content
+    for doc in docs[1:]:
+        overlap = _overlap_length(previous, doc.page_content, max_overlap)
+        content += doc.page_content[overlap:] if overlap else "\n" + doc.page_content
+        previous = doc.page_content
+
+    metadata = dict(docs[0].metadata)
+    metadata["chunk_index_end"] = _span(docs[-1])[1]
+    metadata["chunk_ids"] = [i for d in docs for i in _chunk_ids(d)]
+    distances = [d.metadata["distance"] for d in docs if "distance" in d.metadata]
+    if distances:
+        metadata["distance"] = min(distances)
+    else:
+        metadata.pop("distance", None)
+    return Document(page_content=content, metadata=metadata)
+
+
+def merge_adjacent_chunks(docs: List[Document], max_overlap: Optional[int] = None) -> List[Document]:
+    """
+    将同一 source_id 下 chunk_index 相邻的命中合并为一个连续片段，并去掉块之间的重叠文本。
+    合并后的片段排在其成员中排名最靠前的位置；缺少 source_id / chunk_index 的文档原样保留。
+    """
+    if max_overlap is None:
+        # 分块器实际产生的重叠可能略大于配置值（在分隔符处对齐），留出余量
+        max_overlap = deep_reader_config.RAG_CHUNK_OVERLAP * 2
+
+    positions: Dict[Tuple[str, int], int] = {}
+    for rank, doc in enumerate(docs):
+        source_id = doc.metadata.get("source_id")
+        if source_id is not None and doc.metadata.get("chunk_index") is not None:
+            start, end = _span(doc)
+            for chunk_index in range(start, end + 1):
+                positions.setdefault((source_id, chunk_index), rank)
+
+    consumed: Set[int] = set()
+    merged = []
+    for rank, doc in enumerate(docs):
+        if rank in consumed:
+            continue
+        source_id = doc.metadata.get("source_id")
+        chunk_index = doc.metadata.get("chunk_index")
+        if source_id is None or chunk_index is None:
+            merged.append(doc)
+            continue
+
+        # 向前、向后扩展到所有连续命中的块
+        members = [rank]
+        consumed.add(rank)
+        start, end = _span(doc)
+        while positions.get((source_id, start - 1), rank) not in consumed:
+            member = positions[(source_id, start - 1)]
+            members.append(member)
+            consumed.add(member)
+            start = _span(docs[member])[0]
+        while positions.get((source_id, end + 1), rank) not in consumed:
+            member = positions[(source_id, end + 1)]
+            members.append(member)
+            consumed.add(member)
+            end = _span(docs[member])[1]
+        if len(members) == 1:
+            merged.append(doc)
+        else:
+            merged.append(_merge_span([docs[m] for m in members], max_overlap))
+    return merged
+
+
+def _shingles(text: str) -> Set[str]:
+    text = "".join(text.split())
+    if len(text) <= _SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + _SHINGLE_SIZE] for i in range(len(text) - _SHINGLE_SIZE + 1)}
+
+
+def suppress_near_duplicates(docs: List[Document], threshold: Optional[float] = None) -> List[Document]:
+    """
+    按排名顺序保留文档，丢弃与已保留文档高度重复的片段（字符 n-gram 的 Jaccard 相似度或包含度不低于阈值），
+    例如页眉页脚、重复出现的免责声明、被其他片段完整包含的短片段。
+    """
+    threshold = deep_reader_config.RAG_DEDUP_THRESHOLD if threshold is None else threshold
+    kept: List[Document] = []
+    kept_shingles: List[Set[str]] = []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        duplicate = False
+        for other in kept_shingles:
+            common = len(shingles & other)
+            if not common:
+                continue
+            jaccard = common / len(shingles | other)
+            containment = common / min(len(shingles), len(other))
+            if jaccard >= threshold or containment >= 0.95:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(doc)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def deduplicate_hits(docs: List[Document]) -> List[Document]:
+    """检索结果的标准后处理：先合并相邻块，再抑制近似重复"""
+    return suppress_near_duplicates(merge_adjacent_chunks(docs))
+
+
+def pack_context(
+    hits: List[Document],
+    max_tokens: int,
+    neighbors: Iterable[Document] = (),
+) -> List[Document]:
+    """
+    按 token 预算装配上下文：
+
+    1. 合并相邻块、抑制近似重复（deduplicate_hits）
+    2. 按检索排名（即得分）依次放入片段，放不下的跳过；排名第一的片段本身超出预算时截断保留
+    3. 预算有剩余时，按排名为已选片段补充前后相邻的块（neighbors，通常来自 fetch_neighbors），
+       让命中的句子带上完整的上下文
+    4. 再次合并相邻块，按排名输出
+
+    token 数使用 TokenCounter.count_tokens 计算；合并时去掉的重叠文本只会让实际用量更少。
+    """
+    counter = get_token_counter()
+    separator_tokens = counter.count_tokens(CONTEXT_SEPARATOR)
+    selected: List[Tuple[float, Document]] = []
+    used = 0
+
+    for rank, doc in enumerate(deduplicate_hits(hits)):
+        cost = counter.count_tokens(doc.page_content) + (separator_tokens if selected else 0)
+        if used + cost <= max_tokens:
+            selected.append((rank, doc))
+            used += cost
+        elif not selected:
+            text = counter.truncate(doc.page_content, max_tokens)
+            selected.append((rank, Document(page_content=text, metadata={**doc.metadata, "truncated": True})))
+            used = counter.count_tokens(text)
+
+    neighbor_map = {
+        (doc.metadata["source_id"], doc.metadata["chunk_index"]): doc
+        for doc in neighbors
+        if doc.metadata.get("source_id") is not None and doc.metadata.get("chunk_index") is not None
+    }
+    if neighbor_map and used < max_tokens:
+        covered = set()
+        for _, doc in selected:
+            if doc.metadata.get("source_id") is not None and doc.metadata.get("chunk_index") is not None:
+                start, end = _span(doc)
+                covered.update((doc.metadata["source_id"], i) for i in range(start, end + 1))
+        for rank, doc in list(selected):
+            if doc.metadata.get("source_id") is None or doc.metadata.get("chunk_index") is None:
+                continue
+            start, end = _span(doc)
+            for position in ((doc.metadata["source_id"], start - 1), (doc.metadata["source_id"], end + 1)):
+                neighbor = neighbor_map.get(position)
+                if neighbor is None or position in covered:
+                    continue
+                cost = counter.count_tokens(neighbor.page_content) + separator_tokens
+                if used + cost > max_tokens:
+                    continue
+                # 相邻块紧跟在其所属命中之后
+                selected.append((rank + 0.5, neighbor))
+                covered.add(position)
+                used += cost
+
+    selected.sort(key=lambda item: item[0])
+    return merge_adjacent_chunks([doc for _, doc in selected])
+
+
+def join_context(docs: List[Document]) -> str:
+    """将检索片段拼接为送入提示词的上下文字符串"""
+    return CONTEXT_SEPARATOR.join(doc.page_content for doc in docs)
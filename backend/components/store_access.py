@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: store_access.py
+@time: 2025-12-04
+@desc: 记录各向量库的最近访问时间（backend/memory/store_access.sqlite），供 MemoryManager 按 LRU 回收磁盘空间
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+DEFAULT_ACCESS_LOG_PATH = Path(__file__).resolve().parent.parent / "memory" / "store_access.sqlite"
+
+# 同一个库两次写入访问时间的最小间隔（秒），检索热路径上不必每次都提交事务
+_TOUCH_INTERVAL = 60.0
+
+
+def store_key(db_path: str) -> str:
+    """向量库的标识：不带扩展名的绝对路径（与 .faiss / .sqlite 文件共用）"""
+    base = db_path[:-len(".sqlite")] if db_path.endswith(".sqlite") else db_path
+    return os.path.abspath(base)
+
+
+class StoreAccessLog:
+    """线程安全的访问时间记录，以 store_key 为键"""
+
+    def __init__(self, db_path: str = str(DEFAULT_ACCESS_LOG_PATH)):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS store_access (
+                store TEXT PRIMARY KEY,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        # 本进程最近一次写入各库访问时间的时刻
+        self._written: Dict[str, float] = {}
+
+    def touch(self, db_path: str):
+        """记录一次访问；距离上次写入不足 _TOUCH_INTERVAL 秒时跳过"""
+        key = store_key(db_path)
+        now = time.time()
+        with self._lock:
+            if now - self._written.get(key, 0.0) < _TOUCH_INTERVAL:
+                return
+            self._written[key] = now
+            self._conn.execute(
+                "INSERT OR REPLACE INTO store_access (store, last_access) VALUES (?, ?)", (key, now)
+            )
+            self._conn.commit()
+
+    def last_access(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT store, last_access FROM store_access").fetchall())
+
+    def forget(self, db_path: str):
+        """删除某个库的记录（库文件被删除时调用）"""
+        key = store_key(db_path)
+        with self._lock:
+            self._written.pop(key, None)
+            self._conn.execute("DELETE FROM store_access WHERE store = ?", (key,))
+            self._conn.commit()
+
+
+_global_access_log: Optional[StoreAccessLog] = None
+_global_access_log_lock = threading.Lock()
+
+
+def get_store_access_log() -> StoreAccessLog:
+    """获取全局访问记录实例（首次调用时创建记录文件）"""
+    global _global_access_log
+    with _global_access_log_lock:
+        if _global_access_log is None:
+            _global_access_log = StoreAccessLog()
+        return _global_access_log
+
+
+def record_store_access(db_path: str):
+    """
+    记录向量库的一次访问（打开或从池中取出时调用）。
+    访问记录只影响回收顺序，记录文件不可用时静默跳过，不影响检索。
+    """
+    try:
+        get_store_access_log().touch(db_path)
+    except (sqlite3.Error, OSError) as e:
+        logging.debug(f"[StoreAccessLog] 访问记录不可用: {e}")
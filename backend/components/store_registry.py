@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: store_registry.py
+@time: 2025-11-20
+@desc: 进程级的 DeepReaderVectorStore 池，按 db_name 复用已打开的 FAISS 索引、SQLite 连接和 Embedding 客户端
+"""
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional, Set
+
+from ..config import deep_reader_config
+from .store_access import record_store_access
+from .vector_store import DeepReaderVectorStore
+
+
+class _PoolEntry:
+    """池中的一个条目：一个已打开的向量存储及其引用计数"""
+
+    def __init__(self, key: str, store: DeepReaderVectorStore):
+        self.key = key
+        self.store = store
+        self.refcount = 0
+        # 被 invalidate 后置为 True，最后一个使用者释放时关闭
+        self.stale = False
+
+
+class VectorStoreRegistry:
+    """
+    线程安全的向量存储注册表。
+
+    - 同一个 db_name 在进程内只保留一个打开的实例（索引、SQLite 连接、Embedding 客户端各一份）
+    - 通过 acquire/release（或 lease 上下文管理器）进行引用计数
+    - 超过容量时按 LRU 关闭未被引用的实例
+    - 写入（add_texts）之后调用 invalidate，使后续 acquire 重新从磁盘加载
+    - read_only=True 的实例以内存映射方式加载索引，与可写实例分别池化
+    """
+
+    def __init__(self, max_size: int = 8):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _PoolEntry]" = OrderedDict()
+        # id(store) -> entry，用于 release 时定位条目（包括已被移出 _entries 的失效条目）
+        self._leased: Dict[int, _PoolEntry] = {}
+
+    @staticmethod
+    def _make_key(db_name: Optional[str], db_path: Optional[str], read_only: bool = False) -> str:
+        if db_path:
+            key = f"path:{db_path}"
+        elif db_name:
+            key = f"name:{db_name}"
+        else:
+            raise ValueError("必须提供 db_name 或 db_path")
+        return f"{key}:ro" if read_only else key
+
+    def acquire(
+        self,
+        db_name: Optional[str] = None,
+        db_path: Optional[str] = None,
+        read_only: bool = False,
+    ) -> DeepReaderVectorStore:
+        """
+        获取一个池化的向量存储实例，引用计数 +1。使用完毕后必须调用 release。
+        """
+        key = self._make_key(db_name, db_path, read_only)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.refcount += 1
+                self._leased[id(entry.store)] = entry
+                store = entry.store
+            else:
+                store = None
+        if store is not None:
+            record_store_access(store.db_path)
+            return store
+
+        # 在锁外加载索引，避免一个大文件的读取阻塞其他 db 的获取
+        logging.info(f"[StoreRegistry] 打开向量存储: {key}")
+        store = DeepReaderVectorStore(db_name=db_name, db_path=db_path, read_only=read_only)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # 另一个线程抢先完成了加载，丢弃本次创建的实例
+                store.close()
+            else:
+                entry = _PoolEntry(key, store)
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+            entry.refcount += 1
+            self._leased[id(entry.store)] = entry
+            self._evict_locked()
+            return entry.store
+
+    def release(self, store: DeepReaderVectorStore):
+        """归还一个通过 acquire 获取的实例，引用计数 -1"""
+        with self._lock:
+            entry = self._leased.get(id(store))
+            if entry is None:
+                logging.warning("[StoreRegistry] 尝试释放一个不属于注册表的向量存储实例")
+                return
+            entry.refcount -= 1
+            if entry.refcount > 0:
+                return
+            del self._leased[id(store)]
+            if entry.stale:
+                entry.store.close()
+            else:
+                self._evict_locked()
+
+    @contextmanager
+    def lease(
+        self,
+        db_name: Optional[str] = None,
+        db_path: Optional[str] = None,
+        read_only: bool = False,
+    ) -> Iterator[DeepReaderVectorStore]:
+        """acquire/release 的上下文管理器形式"""
+        store = self.acquire(db_name=db_name, db_path=db_path, read_only=read_only)
+        try:
+            yield store
+        finally:
+            self.release(store)
+
+    @asynccontextmanager
+    async def alease(
+        self,
+        db_name: Optional[str] = None,
+        db_path: Optional[str] = None,
+        read_only: bool = False,
+    ) -> AsyncIterator[DeepReaderVectorStore]:
+        """
+        lease 的异步形式：首次打开存储时需要从磁盘读取 FAISS 索引，放到线程中执行以免阻塞事件循环
+        """
+        store = await asyncio.to_thread(self.acquire, db_name, db_path, read_only)
+        try:
+            yield store
+        finally:
+            self.release(store)
+
+    def invalidate(self, db_name: Optional[str] = None, db_path: Optional[str] = None):
+        """
+        使某个 db 的池化实例（可写和只读两种模式）失效。仍在使用中的实例会在最后一次 release 时关闭，
+        之后的 acquire 将重新从磁盘加载最新的索引。
+        """
+        keys = [self._make_key(db_name, db_path, read_only) for read_only in (False, True)]
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is None:
+                    continue
+                logging.info(f"[StoreRegistry] 向量存储已失效: {key}")
+                if entry.refcount > 0:
+                    entry.stale = True
+                else:
+                    entry.store.close()
+
+    def clear(self):
+        """关闭所有未被引用的实例，并让仍在使用中的实例在释放时关闭"""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.refcount > 0:
+                    entry.stale = True
+                else:
+                    entry.store.close()
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """返回每个池化 db 当前的引用计数"""
+        with self._lock:
+            return {key: entry.refcount for key, entry in self._entries.items()}
+
+    def leased_paths(self) -> Set[str]:
+        """返回当前被引用（refcount > 0）的实例的 SQLite 路径，MemoryManager 不会回收或压缩这些库"""
+        with self._lock:
+            return {entry.store.db_path for entry in self._leased.values()}
+
+    def _evict_locked(self):
+        """在持有 _lock 时调用：按 LRU 顺序关闭未被引用的实例，直到不超过容量"""
+        if len(self._entries) <= self.max_size:
+            return
+        for key in list(self._entries.keys()):
+            if len(self._entries) <= self.max_size:
+                break
+            entry = self._entries[key]
+            if entry.refcount == 0:
+                logging.info(f"[StoreRegistry] LRU 淘汰向量存储: {key}")
+                del self._entries[key]
+                entry.store.close()
+
+
+# 全局单例实例
+_global_store_registry = VectorStoreRegistry(max_size=deep_reader_config.VECTOR_STORE_POOL_SIZE)
+
+
+def get_store_registry() -> VectorStoreRegistry:
+    """获取全局向量存储注册表实例"""
+    return _global_store_registry
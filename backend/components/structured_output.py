@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: structured_output.py
+@time: 2025-12-09
+@desc: 结构化输出的辅助函数：将 Pydantic Schema 转换为各提供商原生的结构化输出参数
+       （Gemini response_schema / OpenAI response_format），以及模型输出的本地解析、形状纠正与校验
+"""
+import copy
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple, Type, get_args, get_origin
+
+from json_repair import loads as json_repair_loads
+from pydantic import BaseModel, RootModel, TypeAdapter, ValidationError
+
+# Gemini 的 Schema（OpenAPI 子集）支持的字段
+_GEMINI_SCHEMA_KEYS = {"type", "description", "properties", "required", "items", "enum", "format", "nullable"}
+
+_CODE_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+
+# 提供商拒绝原生结构化输出参数时，错误信息中会出现的参数名（去掉下划线、转为小写后比较，
+# 兼容 response_schema / responseSchema 等写法）
+_STRUCTURED_OUTPUT_PARAMS = ("responseformat", "responseschema", "responsemimetype", "jsonschema")
+
+# 一个待修复的部分：(列表中的下标，整体输出为 None；原始内容；校验错误)
+InvalidPart = Tuple[Optional[int], Any, str]
+
+
+def list_item_type(schema: Type[BaseModel]) -> Optional[Any]:
+    """schema 为 RootModel[List[X]] 时返回 X，否则返回 None"""
+    if issubclass(schema, RootModel):
+        annotation = schema.model_fields["root"].annotation
+        if get_origin(annotation) in (list, List):
+            return get_args(annotation)[0]
+    return None
+
+
+def _resolve_refs(node: Any, defs: Dict[str, Any]) -> Any:
+    if isinstance(node, dict):
+        if "$ref" in node:
+            return _resolve_refs(copy.deepcopy(defs[node["$ref"].split("/")[-1]]), defs)
+        return {key: _resolve_refs(value, defs) for key, value in node.items() if key != "$defs"}
+    if isinstance(node, list):
+        return [_resolve_refs(value, defs) for value in node]
+    return node
+
+
+def inline_json_schema(schema: Any) -> Dict[str, Any]:
+    """生成展开了 $ref 的 JSON Schema（schema 可以是 Pydantic 模型或任意类型注解）"""
+    raw = TypeAdapter(schema).json_schema()
+    return _resolve_refs(raw, raw.get("$defs", {}))
+
+
+def _gemini_node(node: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if "type" not in node:
+        return None
+    converted = {key: value for key, value in node.items() if key in _GEMINI_SCHEMA_KEYS}
+    if node["type"] == "object":
+        if not node.get("properties"):
+            return None
+        properties = {}
+        for name, child in node["properties"].items():
+            properties[name] = _gemini_node(child)
+            if properties[name] is None:
+                return None
+        converted["properties"] = properties
+    if node["type"] == "array":
+        items = _gemini_node(node.get("items", {}))
+        if items is None:
+            return None
+        converted["items"] = items
+    return converted
+
+
+def gemini_response_schema(schema: Type[BaseModel]) -> Optional[Dict[str, Any]]:
+    """
+    转换为 Gemini response_schema。Gemini 不接受没有固定字段的对象（如任意结构的 rawdata），
+    Schema 中含有这类字段时返回 None，调用方只启用 JSON 模式。
+    """
+    return _gemini_node(inline_json_schema(schema))
+
+
+def provider_response_kwargs(llm_provider: str, schema: Type[BaseModel], mode: str) -> Dict[str, Any]:
+    """
+    按提供商生成原生结构化输出参数，合并到 llm_kwargs 中传给 create_chat_completion。
+
+    Args:
+        mode: 'schema' 使用 JSON Schema 约束，Schema 无法表达时退回 JSON 模式；'json' 只启用 JSON 模式；'off' 不传参数。
+    """
+    if mode == "off":
+        return {}
+    if llm_provider == "google_genai":
+        kwargs: Dict[str, Any] = {"response_mime_type": "application/json"}
+        if mode == "schema":
+            response_schema = gemini_response_schema(schema)
+            if response_schema is not None:
+                kwargs["response_schema"] = response_schema
+        return kwargs
+    if llm_provider in ("openai", "azure_openai"):
+        # OpenAI 的 JSON 模式要求顶层为对象，顶层为数组的 Schema 只依靠提示词和本地校验
+        if list_item_type(schema) is not None:
+            return {}
+        if mode == "json":
+            return {"model_kwargs": {"response_format": {"type": "json_object"}}}
+        return {"model_kwargs": {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": schema.__name__, "schema": inline_json_schema(schema), "strict": False},
+        }}}
+    return {}
+
+
+def rejects_structured_output(error: BaseException) -> bool:
+    """
+    不可重试的请求错误是否由原生结构化输出参数引起（错误信息中提到了这些参数）。
+    安全拦截、上下文超长等与参数无关的请求错误返回 False，不应去掉参数重发。
+    """
+    message = str(error).lower().replace("_", "")
+    return any(param in message for param in _STRUCTURED_OUTPUT_PARAMS)
+
+
+def extract_json(text: str) -> Optional[Any]:
+    """去掉代码块包装后用 json_repair 解析，解析不出 JSON 对象或数组时返回 None"""
+    cleaned = text.strip()
+    match = _CODE_FENCE_PATTERN.match(cleaned)
+    if match:
+        cleaned = match.group(1)
+    try:
+        data = json_repair_loads(cleaned)
+    except (ValueError, RecursionError):
+        return None
+    return data if isinstance(data, (dict, list)) else None
+
+
+def coerce_shape(data: Any, schema: Type[BaseModel]) -> Any:
+    """
+    纠正常见的顶层形状偏差：要求数组时返回了 {"items": [...]} 或单个对象，
+    要求对象时返回了只含一个对象的数组。
+    """
+    if data is None:
+        return None
+    if list_item_type(schema) is not None:
+        if isinstance(data, dict):
+            if len(data) == 1 and isinstance(next(iter(data.values())), list):
+                return next(iter(data.values()))
+            return [data]
+        return data
+    if isinstance(data, list) and len(data) == 1 and isinstance(data[0], dict):
+        return data[0]
+    return data
+
+
+def format_validation_errors(error: ValidationError, limit: int = 10) -> str:
+    lines = []
+    for detail in error.errors()[:limit]:
+        location = ".".join(str(part) for part in detail["loc"]) or "<root>"
+        lines.append(f"- {location}: {detail['msg']}")
+    return "\n".join(lines)
+
+
+def validate_items(item_type: Any, items: Dict[int, Any]) -> Tuple[Dict[int, Any], List[InvalidPart]]:
+    """逐条校验数组元素，返回 (合格元素，按下标)、不合格元素列表"""
+    adapter = TypeAdapter(item_type)
+    valid = {}
+    invalid = []
+    for index, item in items.items():
+        try:
+            valid[index] = adapter.validate_python(item)
+        except ValidationError as e:
+            invalid.append((index, item, format_validation_errors(e)))
+    return valid, invalid
+
+
+def dump_for_repair(content: Any) -> str:
+    return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False, indent=2)
@@ -48,6 +48,22 @@ class TokenCounter:
         # 混合文本平均约2.5字符/token
         return int(len(text) / 2.5)
     
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """将文本截断到不超过 max_tokens 个 token"""
+        if max_tokens <= 0 or not text:
+            return ""
+        if self.encoder:
+            try:
+                tokens = self.encoder.encode(text)
+                if len(tokens) <= max_tokens:
+                    return text
+                return self.encoder.decode(tokens[:max_tokens])
+            except Exception as e:
+                logging.warning(f"Token 截断失败: {e}，使用简单估算")
+        
+        # 与 count_tokens 的简单估算保持一致：约2.5字符/token
+        return text[:int(max_tokens * 2.5)]
+    
     def add_call(self, llm_type: str, prompt: str, response: str):
         """
         记录一次 LLM 调用
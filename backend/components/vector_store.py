@@ -1,25 +1,248 @@
+import asyncio
 import faiss
+import hashlib
 import sqlite3
 import numpy as np
 import json
 import os
+import re
 from pathlib import Path
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_core.vectorstores import VectorStore
 from langchain_core.documents import Document
-from typing import List, Dict, Any, Iterable, Optional, Type
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple, Type
 import tiktoken
 import logging
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from ..config import deep_reader_config
+from .embedding_cache import CachedEmbeddings, get_embedding_cache
+from .embedding_provider import EmbeddingProvider, get_embedding_provider, provider_from_model_id
+from .embedding_scheduler import EmbeddingBatchScheduler, plan_token_batches
+from .query_cache import get_query_cache
+from .store_access import record_store_access
+from . import index_factory
 
 # 禁用 FAISS 的 OpenMP 多线程，避免与 gRPC 并发冲突
 # 这是导致 "OMP: Error #179: Function pthread_mutex_init failed" 的根本原因
 faiss.omp_set_num_threads(1)
 
+# SQLite 单条语句允许的最大参数个数（旧版本默认 999）
+_SQLITE_MAX_VARIABLES = 900
+
+# similarity_search 支持的检索方式
+SEARCH_TYPES = ("vector", "hybrid", "lexical")
+
+# chunks 表中从元数据提取出的带类型列（建有索引，可用于过滤检索），其余元数据仍保存在 metadata JSON 中
+METADATA_COLUMNS = {
+    "source_id": "TEXT",
+    "chunk_index": "INTEGER",
+    "section": "TEXT",
+    "start_index": "INTEGER",
+}
+
+# 过滤条件中支持的比较运算符
+_FILTER_OPERATORS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+# 无法使用 tiktoken 编码时估算 token 数所用的平均字符数（与 TokenCounter 的简单估算一致）
+_CHARS_PER_TOKEN_ESTIMATE = 2.5
+
+# 全文检索查询中最多使用的词数，避免长查询拆出过多 trigram 拖慢 FTS5
+_FTS_MAX_TERMS = 64
+
+# 查询中的英文/数字词（如 AAPL、600519、1,234.5、12%）和连续的中日韩字符
+_FTS_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9.,%_\-]*|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+
+# 异步检索路径使用的有界线程池：FAISS 搜索和 SQLite 读取在这里执行，不阻塞事件循环
+_SEARCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=deep_reader_config.VECTOR_SEARCH_MAX_WORKERS,
+    thread_name_prefix="vector-search",
+)
+
+def _load_batch_encoding() -> Optional["tiktoken.Encoding"]:
+    """加载 cl100k_base 编码（首次使用需要联网下载），失败时返回 None"""
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logging.warning(
+            f"无法加载 tiktoken 编码 cl100k_base（请检查能否访问 openaipublic.blob.core.windows.net）: {e}，"
+            "入库批次改按字符数估算 token 数"
+        )
+        return None
+
+
+def configure_connection(conn: sqlite3.Connection, read_only: bool = False):
+    """
+    设置连接级别的 SQLite 参数：
+
+    - WAL 日志：写入不阻塞并发读取，API 服务中的检索请求与入库可以同时进行（写入方设置，持久保存在库文件中）
+    - synchronous=NORMAL：WAL 模式下只在检查点时 fsync，断电最多丢失最近提交的事务，不会损坏数据库
+    - 页缓存和内存映射大小见 VECTOR_SQLITE_CACHE_MB / VECTOR_SQLITE_MMAP_MB
+    """
+    if not read_only:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{deep_reader_config.VECTOR_SQLITE_CACHE_MB * 1024}")
+    conn.execute(f"PRAGMA mmap_size={deep_reader_config.VECTOR_SQLITE_MMAP_MB * 1024 * 1024}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def read_store_meta(conn: sqlite3.Connection) -> Dict[str, str]:
+    """读取库级别的元信息（向量维度、存储精度等），旧版本创建的库没有该表时返回空字典"""
+    exists = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'store_meta'"
+    ).fetchone()
+    if not exists:
+        return {}
+    return dict(conn.execute("SELECT key, value FROM store_meta").fetchall())
+
+
+def write_store_meta(conn: sqlite3.Connection, values: Dict[str, Any]):
+    """写入库级别的元信息并提交"""
+    conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.executemany(
+        "INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)",
+        [(key, str(value)) for key, value in values.items()],
+    )
+    conn.commit()
+
+
+def ensure_metadata_columns(conn: sqlite3.Connection) -> int:
+    """
+    为旧版本创建的 chunks 表补充 METADATA_COLUMNS 中的列和索引，并从 metadata JSON 回填。
+
+    Returns:
+        回填的行数。
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(chunks)").fetchall()}
+    missing = [column for column in METADATA_COLUMNS if column not in existing]
+    for column in missing:
+        conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} {METADATA_COLUMNS[column]}")
+    backfilled = 0
+    if missing:
+        assignments = ", ".join(f"{column} = json_extract(metadata, '$.{column}')" for column in METADATA_COLUMNS)
+        backfilled = conn.execute(f"UPDATE chunks SET {assignments} WHERE metadata IS NOT NULL").rowcount
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source_id, chunk_index)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_section ON chunks (section)")
+    conn.commit()
+    if backfilled:
+        logging.info(f"[VectorStore] 已为 {backfilled} 个块回填元数据列")
+    return backfilled
+
+
+def _filter_clause(filter: Dict[str, Any], typed_columns: bool = True) -> Tuple[str, List[Any]]:
+    """
+    将过滤条件转换为 chunks 表上的 SQL WHERE 子句。
+
+    filter 的键为 METADATA_COLUMNS 中的列名，值可以是：
+    - 标量：等于，如 {"source_id": "chapter_3"}
+    - 列表：属于其中之一，如 {"section": ["一、公司概况", "二、财务分析"]}
+    - 比较运算符字典：{"chunk_index": {"$gte": 10, "$lte": 40}}，支持 $gt / $gte / $lt / $lte / $in
+
+    typed_columns=False 时（只读打开的旧库尚未迁移）改用 json_extract 读取 metadata，需要扫描全表。
+    """
+    clauses: List[str] = []
+    params: List[Any] = []
+    for key, value in filter.items():
+        if key not in METADATA_COLUMNS:
+            raise ValueError(f"不支持按 {key} 过滤，可选字段为 {' / '.join(METADATA_COLUMNS)}")
+        column = key if typed_columns else f"json_extract(metadata, '$.{key}')"
+        if isinstance(value, dict):
+            conditions = value
+        elif isinstance(value, (list, tuple, set)):
+            conditions = {"$in": value}
+        else:
+            conditions = {"$eq": value}
+        for operator, operand in conditions.items():
+            if operator == "$eq":
+                clauses.append(f"{column} = ?")
+                params.append(operand)
+            elif operator == "$in":
+                operand = list(operand)
+                if not operand:
+                    clauses.append("0")
+                    continue
+                clauses.append(f"{column} IN ({','.join('?' * len(operand))})")
+                params.extend(operand)
+            elif operator in _FILTER_OPERATORS:
+                clauses.append(f"{column} {_FILTER_OPERATORS[operator]} ?")
+                params.append(operand)
+            else:
+                raise ValueError(f"不支持的过滤运算符: {operator}")
+    return " AND ".join(clauses) or "1", params
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int, rrf_k: Optional[int] = None) -> List[int]:
+    """
+    倒数排名融合（RRF）：每个 id 的得分为其在各路排名中 1 / (rrf_k + 名次) 之和，返回得分最高的 k 个 id。
+    """
+    rrf_k = rrf_k or deep_reader_config.RAG_HYBRID_RRF_K
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+
+def _fts_match_expression(query: str, trigram: bool) -> Optional[str]:
+    """
+    将自然语言查询转换为 FTS5 MATCH 表达式（各词之间为 OR，由 BM25 决定排序）。
+
+    trigram 分词器只能匹配不少于 3 个字符的词：英文/数字词整体作为短语匹配，
+    连续的中文拆成相互重叠的三字片段，命中片段越多的块 BM25 得分越高。
+    更短的词见 _short_terms。
+    """
+    terms = []
+    for token in _FTS_TOKEN_PATTERN.findall(query):
+        token = token.strip(".,-")
+        if not trigram or token.isascii():
+            if len(token) >= (3 if trigram else 1):
+                terms.append(token)
+        elif len(token) >= 3:
+            terms.extend(token[i:i + 3] for i in range(len(token) - 2))
+    terms = list(dict.fromkeys(terms))[:_FTS_MAX_TERMS]
+    if not terms:
+        return None
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _short_terms(query: str) -> List[str]:
+    """
+    trigram 分词器检索不到的两字符词（如股票代码 GE、5G，数字 70，中文词 营收），由 _lexical_ids 改用子串扫描匹配。
+    单个字符几乎出现在每个块中，不参与检索。
+    """
+    terms = []
+    for token in _FTS_TOKEN_PATTERN.findall(query):
+        token = token.strip(".,-")
+        if len(token) == 2:
+            terms.append(token)
+    return list(dict.fromkeys(terms))[:_FTS_MAX_TERMS]
+
+
 class DeepReaderVectorStore(VectorStore):
     """
     一个基于 FAISS 和 SQLite 的自定义向量存储，与 LangChain 集成。
+
+    read_only=True 时以只读方式打开已有的库：FAISS 索引通过内存映射加载（打开几乎瞬时完成，
+    多个实例和进程共享同一份页缓存），SQLite 以 mode=ro 打开，写入操作会抛出 RuntimeError。
     """
-    def __init__(self, db_name: str = None, db_path: str = None, embedding_model_name: str = "text-embedding-3-large", **kwargs: Any):
+    def __init__(
+        self,
+        db_name: str = None,
+        db_path: str = None,
+        embedding_model_name: Optional[str] = None,
+        embedding_provider: Optional[str] = None,
+        index_type: Optional[str] = None,
+        dimensions: Optional[int] = None,
+        storage: Optional[str] = None,
+        read_only: bool = False,
+        **kwargs: Any,
+    ):
         # 1. 确定文件路径
         if db_path:
             # 如果提供了db_path，直接使用它（不加扩展名）
@@ -38,172 +261,685 @@ class DeepReaderVectorStore(VectorStore):
             raise ValueError("必须提供 db_name 或 db_path")
         
         # 确保目录存在
-        if hasattr(self, 'db_path'):
+        if hasattr(self, 'db_path') and not read_only:
             os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
 
-        # 2. 预加载 tiktoken 编码（提前触发下载，避免在向量化时失败）
-        try:
-            # 根据模型名称确定需要的编码
-            if "text-embedding-3" in embedding_model_name or "gpt-4" in embedding_model_name or "gpt-3.5" in embedding_model_name:
-                encoding_name = "cl100k_base"
-            else:
-                encoding_name = "cl100k_base"  # 默认使用 cl100k_base
-            
-            logging.info(f"预加载 tiktoken 编码: {encoding_name}")
-            tiktoken.get_encoding(encoding_name)
-            logging.info("tiktoken 编码加载成功")
-        except Exception as e:
-            logging.error(f"预加载 tiktoken 编码失败: {e}")
-            logging.error("这可能是网络连接问题。请检查:")
-            logging.error("1. 网络连接是否正常")
-            logging.error("2. 是否可以访问 openaipublic.blob.core.windows.net")
-            logging.error("3. SSL 证书是否正常")
-            raise RuntimeError(f"无法加载 tiktoken 编码，请检查网络连接: {e}") from e
-
-        # 3. 初始化 Embedding 模型
-        self.embedding_model = OpenAIEmbeddings(model=embedding_model_name, api_key=os.environ.get("OPENAI_API_KEY"))
-        self.dimension = 3072  # text-embedding-3-large 的维度
-
-        # 4. 加载或创建数据库和 FAISS 索引
+        # 新建库使用的 Embedding 后端；已有的库以 store_meta 中记录的模型为准
+        self._requested_provider = get_embedding_provider(embedding_provider, embedding_model_name)
+
+        self.read_only = read_only
+        # 'auto' / 'flat' / 'hnsw' / 'ivfpq'，见 DeepReaderConfig.VECTOR_INDEX_TYPE
+        self.index_type = index_type or deep_reader_config.VECTOR_INDEX_TYPE
+        # 新建库时使用的维度和存储精度；已有的库以 store_meta 中记录的值为准。
+        # 未指定维度时使用模型的原生维度，只在建库时查询（本地模型需要先加载权重）
+        self._requested_dimension = dimensions or deep_reader_config.EMBEDDING_DIMENSIONS
+        self._requested_storage = storage or deep_reader_config.VECTOR_STORAGE
+
+        # 2. 加载或创建数据库和 FAISS 索引（确定 self.dimension、self.storage 和 self.embedding_model_id）
         self._load_or_create_db()
 
+        # 3. 初始化 Embedding 模型：始终使用建库时的模型，维度小于原生维度时请求缩短后的向量
+        if self.embedding_model_id == self._requested_provider.model_id:
+            provider = self._requested_provider
+        else:
+            logging.info(
+                f"[VectorStore] 该库由 {self.embedding_model_id} 构建，与当前配置的 "
+                f"{self._requested_provider.model_id} 不同，查询和入库沿用建库时的模型"
+            )
+            provider = provider_from_model_id(self.embedding_model_id)
+        self.embedding_provider: EmbeddingProvider = provider
+        embedding_model = provider.create(self.dimension)
+        if deep_reader_config.EMBEDDING_CACHE_ENABLED and provider.cacheable:
+            # 通过持久化缓存包装，相同文本（按内容哈希）只向量化一次；不同模型/维度的向量使用不同的命名空间
+            namespace = provider.cache_namespace(self.dimension)
+            embedding_model = CachedEmbeddings(embedding_model, get_embedding_cache(), namespace=namespace)
+        self.embedding_model = embedding_model
+
+        # 4. 预加载 tiktoken 编码，入库时按 token 数切分批次。只有 OpenAI 后端需要精确计数以免超过单次请求的
+        #    token 上限（本地模型的分词不同）；其他后端、只读实例或编码无法下载（离线）时按字符数估算
+        self.encoding = None
+        if provider.name == "openai" and not read_only:
+            self.encoding = _load_batch_encoding()
+
+        # 记录访问时间，供 MemoryManager 按最近访问顺序回收磁盘空间
+        record_store_access(self.db_path)
+
     def _load_or_create_db(self):
-        # 初始化 SQLite，只确保表存在
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # 初始化 SQLite：整个实例生命周期内复用同一个连接（由 _lock 串行化访问），
+        # 以便在 VectorStoreRegistry 中池化时不必每次查询都重新建立连接
+        self._lock = threading.RLock()
+        if self.read_only:
+            self._open_read_only()
+            return
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        configure_connection(self._conn)
+        cursor = self._conn.cursor()
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS chunks (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 content TEXT NOT NULL,
-                metadata TEXT
+                metadata TEXT,
+                source_id TEXT,
+                chunk_index INTEGER,
+                section TEXT,
+                start_index INTEGER
+            )
+        """)
+        # 可续传入库的进度记录：next_offset 为已提交到 SQLite 的高水位，flushed_offset 为已落盘到 FAISS 文件的高水位
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_progress (
+                ingest_id TEXT PRIMARY KEY,
+                next_offset INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                completed INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL,
+                flushed_offset INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        if "flushed_offset" not in {row[1] for row in cursor.execute("PRAGMA table_info(ingest_progress)")}:
+            # 旧版本每批都先写 FAISS 文件再提交 SQLite，已记录的高水位都已落盘
+            cursor.execute("ALTER TABLE ingest_progress ADD COLUMN flushed_offset INTEGER NOT NULL DEFAULT 0")
+            cursor.execute("UPDATE ingest_progress SET flushed_offset = next_offset")
+        # 父子分块时的父窗口（整段/整节原文），只存一份；chunks 中的子块通过 metadata.parent_index 指向所属父窗口
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS parents (
+                source_id TEXT NOT NULL,
+                parent_index INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                section TEXT,
+                start_index INTEGER,
+                PRIMARY KEY (source_id, parent_index)
             )
         """)
-        conn.commit()
-        conn.close()
+        self._conn.commit()
+        self.has_parents = self._detect_parents()
+        ensure_metadata_columns(self._conn)
+        self.typed_columns = True
+        self._ensure_fts()
 
-        # 初始化 FAISS
+        index = None
+        self._index_load_failed = False
         if os.path.exists(self.faiss_path):
             try:
-                self.index = faiss.read_index(self.faiss_path)
+                index = faiss.read_index(self.faiss_path)
             except Exception as e:
                 print(f"无法加载 FAISS 索引，将创建新索引: {e}")
-                index = faiss.IndexFlatL2(self.dimension)
-                self.index = faiss.IndexIDMap(index)
+                self._index_load_failed = True
+
+        # 确定向量维度和存储精度：优先使用建库时记录的值，旧版本创建的库按索引本身推断
+        meta = read_store_meta(self._conn)
+        if "dimension" in meta:
+            self.dimension = int(meta["dimension"])
+            self.storage = meta.get("storage", "float32")
+        elif index is not None:
+            self.dimension = index.d
+            self.storage = index_factory.storage_of(index)
         else:
-            index = faiss.IndexFlatL2(self.dimension)
-            self.index = faiss.IndexIDMap(index)
+            self.dimension = self._requested_dimension or self._requested_provider.native_dimension()
+            self.storage = self._requested_storage
+        if self.dimension != (self._requested_dimension or self.dimension) or self.storage != self._requested_storage:
+            logging.info(
+                f"[VectorStore] 该库使用 {self.dimension} 维 / {self.storage} 存储，与当前配置不同，"
+                f"如需转换请使用 backend/components/index_migration.py"
+            )
+        has_vectors = index is not None and index.ntotal > 0
+        self.embedding_model_id = meta.get("embedding_model") or self._default_embedding_model_id(has_vectors)
+        recorded = {"dimension": self.dimension, "storage": self.storage, "embedding_model": self.embedding_model_id}
+        if any(meta.get(key) != str(value) for key, value in recorded.items()):
+            write_store_meta(self._conn, recorded)
+        # 索引版本：每次入库或重建索引时更新，检索结果缓存以此判断是否失效
+        self.index_version = meta.get("index_version")
+        if self.index_version is None:
+            self._bump_index_version()
 
-    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        # 初始化 FAISS：新库总是从 flat 索引开始，入库完成后再按向量数重建为近似索引
+        if index is None:
+            index = index_factory.create_index("flat", self.dimension, storage=self.storage)
+            if not index.is_trained:
+                # int8 量化需要用数据训练：先以 float32 入库，入库完成后由 rebuild_index 转换
+                index = index_factory.create_index("flat", self.dimension)
+        self.index = index
+        index_factory.configure_search(self.index)
+        # 已加入内存索引、尚未写入 FAISS 文件的批次数和向量字节数
+        self._unflushed_batches = 0
+        self._unflushed_bytes = 0
+
+        self._reconcile_index()
+
+    def _open_read_only(self):
+        """
+        只读模式：不创建表、不写入任何文件，也不做 _reconcile_index
+        （残留的未提交 id 在 _fetch_chunks 中查不到对应的行，会被自然忽略）。
+        """
+        if not os.path.exists(self.faiss_path) or not os.path.exists(self.db_path):
+            raise FileNotFoundError(f"只读模式要求向量库已存在: {self.db_path} / {self.faiss_path}")
+        self._conn = sqlite3.connect(f"{Path(self.db_path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        configure_connection(self._conn, read_only=True)
+        self.index = index_factory.read_index_mmap(self.faiss_path)
+        self.fts_tokenizer = self._detect_fts_tokenizer()
+        self.has_parents = self._detect_parents()
+        # 尚未迁移的旧库没有元数据列，过滤检索退化为 json_extract 全表扫描
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)").fetchall()}
+        self.typed_columns = all(column in existing for column in METADATA_COLUMNS)
+        meta = read_store_meta(self._conn)
+        self.dimension = int(meta.get("dimension", self.index.d))
+        self.storage = meta.get("storage", index_factory.storage_of(self.index))
+        self.embedding_model_id = meta.get("embedding_model") or self._default_embedding_model_id(self.index.ntotal > 0)
+        # 旧库没有记录索引版本时无法判断缓存是否过期，不使用检索结果缓存
+        self.index_version = meta.get("index_version")
+        index_factory.configure_search(self.index)
+
+    def _default_embedding_model_id(self, has_vectors: bool) -> str:
+        """
+        store_meta 中没有记录 Embedding 模型时使用的模型 id：已有向量的旧库由引入可插拔后端之前的版本构建，
+        当时总是使用 OpenAI 的 EMBEDDING_MODEL；空库则使用当前配置的后端。
+        """
+        if has_vectors:
+            return get_embedding_provider("openai").model_id
+        return self._requested_provider.model_id
+
+    def _detect_parents(self) -> bool:
+        """该库是否以父子分块方式入库（parents 表存在且非空）"""
+        exists = self._conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'parents'"
+        ).fetchone()
+        return bool(exists) and self._conn.execute("SELECT 1 FROM parents LIMIT 1").fetchone() is not None
+
+    def _detect_fts_tokenizer(self) -> Optional[str]:
+        """返回已有全文索引使用的分词器（'trigram' / 'unicode61'），没有全文索引时返回 None"""
+        row = self._conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'"
+        ).fetchone()
+        if not row:
+            return None
+        return "trigram" if "trigram" in row[0] else "unicode61"
+
+    def _ensure_fts(self):
+        """
+        创建与 chunks 表同步的 FTS5 全文索引（外部内容表 + 触发器），旧库首次打开时回填已有的块。
+        优先使用 trigram 分词器（SQLite >= 3.34，支持中文和代码、数字的子串匹配），不可用时退化为 unicode61；
+        SQLite 未编译 FTS5 时全文检索不可用，hybrid 检索退化为纯向量检索。
+        """
+        self.fts_tokenizer = self._detect_fts_tokenizer()
+        if self.fts_tokenizer:
+            return
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE chunks_fts USING fts5("
+                    f"content, content='chunks', content_rowid='id', tokenize='{tokenizer}')"
+                )
+                break
+            except sqlite3.OperationalError as e:
+                logging.info(f"[VectorStore] FTS5 分词器 {tokenizer} 不可用: {e}")
+        else:
+            logging.warning("[VectorStore] 当前 SQLite 不支持 FTS5，全文检索不可用")
+            return
+
+        self._conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_ai AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_ad AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_au AFTER UPDATE OF content ON chunks BEGIN
+                INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
+            END;
+        """)
+        # 旧库中已有的块一次性回填
+        self._conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+        self._conn.commit()
+        self.fts_tokenizer = self._detect_fts_tokenizer()
+        logging.info(f"[VectorStore] 已创建全文索引（{self.fts_tokenizer}）")
+
+    def _ensure_writable(self):
+        # 内存映射的索引不能被修改，faiss 在这种情况下会直接断言失败并终止进程，必须提前拦截
+        if self.read_only:
+            raise RuntimeError(f"向量库以只读模式打开，不能写入: {self.db_path}")
+
+    def _bump_index_version(self, commit: bool = True):
+        """生成新的索引版本号；commit=False 时随调用方的事务一起提交"""
+        self.index_version = uuid.uuid4().hex
+        self._conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('index_version', ?)", (self.index_version,)
+        )
+        if commit:
+            self._conn.commit()
+
+    def _reconcile_index(self):
+        """
+        加载时对齐 SQLite 和 FAISS 文件（SQLite 每批提交，FAISS 文件每 VECTOR_INDEX_FLUSH_BATCHES 批才落盘一次）：
+
+        - FAISS 中多出 SQLite 已回滚的 id（旧版本先写 FAISS 文件再提交 SQLite，在两者之间中断）：从索引中移除
+        - SQLite 中多出最后一次落盘之后提交的块：删除这些行，并将未完成入库任务的高水位回退到 flushed_offset，
+          续传时重新向量化这些批次（启用 Embedding 缓存时直接命中缓存，不再调用 API）
+        """
+        with self._lock:
+            row_count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            if self.index.ntotal == row_count:
+                # 已提交的批次都已落盘（可能在写完 FAISS 文件、推进 flushed_offset 之前中断）。
+                # 没有更新任何行时也要提交：UPDATE 语句会隐式开启事务，不提交会一直持有写锁
+                self._conn.execute(
+                    "UPDATE ingest_progress SET flushed_offset = next_offset "
+                    "WHERE completed = 0 AND flushed_offset != next_offset"
+                )
+                self._conn.commit()
+                return
+            ids = index_factory.stored_ids(self.index)
+            if self.index.ntotal > row_count:
+                max_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM chunks").fetchone()[0]
+                self.index, removed = index_factory.remove_ids(self.index, ids[ids > max_id])
+                if removed:
+                    logging.warning(f"[VectorStore] 移除了 {removed} 个未提交到 SQLite 的 FAISS 向量")
+                    self._flush_index()
+                    self._bump_index_version()
+                return
+            if self._index_load_failed:
+                logging.warning("[VectorStore] FAISS 索引加载失败，保留 SQLite 中的块，不做回滚")
+                return
+            flushed_max_id = int(ids.max()) if len(ids) else 0
+            removed = self._conn.execute("DELETE FROM chunks WHERE id > ?", (flushed_max_id,)).rowcount
+            self._conn.execute("UPDATE ingest_progress SET next_offset = flushed_offset WHERE completed = 0")
+            self._bump_index_version(commit=False)
+            self._conn.commit()
+            if removed:
+                logging.warning(f"[VectorStore] 回滚了 {removed} 个尚未落盘到 FAISS 文件的块，续传时将重新向量化")
+
+    def rebuild_index(self, index_type: Optional[str] = None) -> str:
+        """
+        按索引类型和存储精度（self.storage）重建 FAISS 索引（训练后重新加入全部向量）并原子落盘。
+
+        Args:
+            index_type: 目标类型，默认使用实例的 index_type；'auto' 按当前向量数选择。
+
+        Returns:
+            重建后的索引类型。
+        """
+        self._ensure_writable()
+        with self._lock:
+            current = index_factory.index_type_of(self.index)
+            if self.index.ntotal == 0:
+                return current
+            target = index_factory.resolve_index_type(index_type or self.index_type, self.index.ntotal)
+            current_storage = index_factory.storage_of(self.index)
+            if target == current and (target == "ivfpq" or current_storage == self.storage):
+                return current
+            if current == "ivfpq":
+                # PQ 编码是有损的，从中取出的向量无法还原原始精度
+                logging.warning(f"[VectorStore] 当前为 ivfpq 索引，不会降级重建为 {target}")
+                return current
+            start = time.time()
+            ids, vectors = index_factory.extract_vectors(self.index)
+            self.index = index_factory.build_index(target, self.dimension, ids, vectors, storage=self.storage)
+            self._flush_index()
+            # 近似索引的结果与原索引不同，已缓存的检索结果随之失效
+            self._bump_index_version()
+            logging.info(
+                f"[VectorStore] 索引已从 {current}/{current_storage} 重建为 {target}/{self.storage}"
+                f"（{len(ids)} 个向量，耗时 {time.time() - start:.1f}s）"
+            )
+            return target
+
+    def _write_index(self):
+        """原子地保存 FAISS 索引：先写临时文件再替换，避免中断时留下损坏的索引文件"""
+        tmp_path = f"{self.faiss_path}.tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, self.faiss_path)
+
+    def _flush_index(self):
+        """
+        将内存中的 FAISS 索引落盘，并把未完成入库任务的 flushed_offset 推进到高水位：
+        此后进程中断，已提交的批次在重新打开时都无需回滚。
+        """
+        with self._lock:
+            self._write_index()
+            self._conn.execute("UPDATE ingest_progress SET flushed_offset = next_offset WHERE completed = 0")
+            self._conn.commit()
+            self._unflushed_batches = 0
+            self._unflushed_bytes = 0
+
+    def _flush_pending(self):
+        """落盘最后一次刷新之后加入内存索引的批次（入库失败时尽量保住已付费的向量，失败只记录日志）"""
+        if self.read_only or not self._unflushed_batches:
+            return
+        try:
+            self._flush_index()
+        except Exception as e:
+            logging.error(f"[VectorStore] FAISS 索引落盘失败，未落盘的批次将在重新打开时回滚: {e}")
+
+    @staticmethod
+    def has_pending_ingest(sqlite_path: str) -> bool:
+        """
+        检查某个数据库是否存在尚未完成的可续传入库任务（无需加载 FAISS 索引）。
+        """
+        if not os.path.exists(sqlite_path):
+            return False
+        conn = sqlite3.connect(sqlite_path)
+        try:
+            row = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'ingest_progress'"
+            ).fetchone()
+            if not row:
+                return False
+            return conn.execute("SELECT COUNT(*) FROM ingest_progress WHERE completed = 0").fetchone()[0] > 0
+        finally:
+            conn.close()
+
+    def _count_tokens(self, text: str) -> int:
+        """入库批次规划用的 token 数：有 tiktoken 编码时精确计数，否则按字符数估算"""
+        if self.encoding is not None:
+            return len(self.encoding.encode_ordinary(text))
+        return int(len(text) / _CHARS_PER_TOKEN_ESTIMATE) + 1
+
+    @staticmethod
+    def _ingest_fingerprint(texts: List[str]) -> str:
+        digest = hashlib.sha256()
+        for text in texts:
+            digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    def add_parents(self, parents: List[Dict[str, Any]]) -> int:
+        """
+        保存父子分块的父窗口（{"content", "metadata": {"source_id", "parent_index", "section", "start_index"}}），
+        应在入库子块之前调用。按 (source_id, parent_index) 覆盖写入，续传入库时重复调用不会产生重复行。
+        """
+        self._ensure_writable()
+        rows = [
+            (
+                parent["metadata"]["source_id"],
+                parent["metadata"]["parent_index"],
+                parent["content"],
+                parent["metadata"].get("section"),
+                parent["metadata"].get("start_index"),
+            )
+            for parent in parents
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO parents (source_id, parent_index, content, section, start_index) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            if rows:
+                self.has_parents = True
+        return len(rows)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        resumable: bool = False,
+        **kwargs: Any,
+    ) -> List[str]:
         """
         将文本和元数据添加到向量存储中。
-        支持大文档批量处理，避免超过 OpenAI API 的 token 限制（单次请求最大 300k tokens）。
+        按 token 数切分批次（EMBEDDING_BATCH_MAX_TOKENS），避免超过 OpenAI API 的 token 限制（单次请求最大 300k tokens）。
+
+        以流式方式逐批入库：每批向量化后立即提交到 SQLite 并加入内存中的 FAISS 索引，
+        FAISS 文件每 VECTOR_INDEX_FLUSH_BATCHES 批（或 VECTOR_INDEX_FLUSH_MB）以及入库结束时落盘一次。
+        resumable=True 时按输入文本的指纹记录高水位，失败后以相同输入重试会从断点继续，
+        已落盘的批次不会再次向量化。
+
+        Returns:
+            本次调用新写入的块 id 列表。
         """
-        texts_list = list(texts)
-        if not texts_list:
+        prepared = self._prepare_ingest(texts, metadatas, resumable)
+        if prepared is None:
             return []
+        texts_list, metadatas, ingest_id, batches = prepared
+
+        chunk_ids = []
+        for batch_num, (i, j) in enumerate(batches, start=1):
+            batch_texts = texts_list[i:j]
+            print(f"  正在向量化第 {batch_num}/{len(batches)} 批 ({len(batch_texts)} 个块)...")
 
-        # 确保 metadatas 列表长度与 texts_list 匹配
-        if metadatas is None:
-            metadatas = [{} for _ in texts_list]
-        
-        # 1. 批量向量化（分批处理以避免超过 API 限制）
-        batch_size = 100  # 每批最多 100 个块，保守估计确保不超过 300k token
-        all_embeddings = []
-        
-        print(f"开始向量化 {len(texts_list)} 个文本块...")
-        
-        for i in range(0, len(texts_list), batch_size):
-            batch_texts = texts_list[i:i+batch_size]
-            batch_num = i // batch_size + 1
-            total_batches = (len(texts_list) + batch_size - 1) // batch_size
-            
-            print(f"  正在向量化第 {batch_num}/{total_batches} 批 ({len(batch_texts)} 个块)...")
-            
             try:
                 batch_embeddings = self.embedding_model.embed_documents(batch_texts)
-                all_embeddings.extend(batch_embeddings)
-                print(f"  ✅ 第 {batch_num} 批完成")
             except Exception as e:
                 print(f"  ❌ 第 {batch_num} 批向量化失败: {e}")
+                self._flush_pending()
                 raise
-        
-        embeddings_np = np.array(all_embeddings, dtype='float32')
 
-        # 2. 将文本和元数据存入 SQLite，并获取 ID
-        print(f"正在存储文本块到 SQLite...")
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+            embeddings_np = np.array(batch_embeddings, dtype='float32')
+            del batch_embeddings
+            chunk_ids.extend(self._commit_batch(batch_texts, metadatas[i:j], embeddings_np, ingest_id, j))
+            print(f"  ✅ 第 {batch_num} 批完成")
+
+        self._finish_ingest(ingest_id, len(chunk_ids))
+        return [str(cid) for cid in chunk_ids]
+
+    async def aadd_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        resumable: bool = False,
+        **kwargs: Any,
+    ) -> List[str]:
+        """
+        add_texts 的并发版本：多个向量化批次同时在途（EMBEDDING_MAX_CONCURRENCY），
+        遇到 429 时自适应降低并发并退避重试。批次仍按顺序提交，断点续传语义与 add_texts 相同。
+        """
+        prepared = await asyncio.to_thread(self._prepare_ingest, texts, metadatas, resumable)
+        if prepared is None:
+            return []
+        texts_list, metadatas, ingest_id, batches = prepared
+
         chunk_ids = []
-            
-        for content, meta in zip(texts_list, metadatas):
-            cursor.execute("INSERT INTO chunks (content, metadata) VALUES (?, ?)", 
-                                (content, json.dumps(meta)))
-            chunk_ids.append(cursor.lastrowid)
-        conn.commit()
-        conn.close()
-
-        # 3. 将向量存入 FAISS
-        print(f"正在存储向量到 FAISS 索引...")
-        ids_np = np.array(chunk_ids, dtype='int64')
-        self.index.add_with_ids(embeddings_np, ids_np)
-        
-        # 4. 保存 FAISS 索引
-        faiss.write_index(self.index, self.faiss_path)
-        print(f"✅ 成功添加 {len(texts_list)} 个块到 RAG 存储。")
-        
+
+        async def embed_batch(i: int, j: int) -> List[List[float]]:
+            return await self.embedding_model.aembed_documents(texts_list[i:j])
+
+        async def on_batch(batch_index: int, batch: Tuple[int, int], vectors: List[List[float]]):
+            i, j = batch
+            embeddings_np = np.array(vectors, dtype='float32')
+            # SQLite 写入和 FAISS 落盘放到线程中执行，不阻塞其他批次的请求
+            chunk_ids.extend(await asyncio.to_thread(
+                self._commit_batch, texts_list[i:j], metadatas[i:j], embeddings_np, ingest_id, j
+            ))
+            print(f"  ✅ 第 {batch_index + 1}/{len(batches)} 批完成 ({j - i} 个块)")
+
+        scheduler = EmbeddingBatchScheduler(max_concurrency=deep_reader_config.EMBEDDING_MAX_CONCURRENCY)
+        try:
+            await scheduler.run(batches, embed_batch, on_batch)
+        except BaseException:
+            await asyncio.to_thread(self._flush_pending)
+            raise
+
+        await asyncio.to_thread(self._finish_ingest, ingest_id, len(chunk_ids))
         return [str(cid) for cid in chunk_ids]
 
-    def similarity_search(self, query: str, k: int = 10, **kwargs: Any) -> List[Document]:
+    def _prepare_ingest(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]],
+        resumable: bool,
+    ) -> Optional[Tuple[List[str], List[dict], Optional[str], List[Tuple[int, int]]]]:
         """
-        根据查询向量，在 FAISS 中进行相似度搜索。
+        入库前的准备：补齐元数据、登记可续传任务并从高水位开始按 token 数规划批次。
+        没有需要入库的内容时返回 None。
+        """
+        self._ensure_writable()
+        texts_list = list(texts)
+        if not texts_list:
+            return None
+
+        # 确保 metadatas 列表长度与 texts_list 匹配
+        if metadatas is None:
+            metadatas = [{} for _ in texts_list]
+
+        start = 0
+        ingest_id = None
+        if resumable:
+            ingest_id = self._ingest_fingerprint(texts_list)
+            start = self._begin_ingest(ingest_id, len(texts_list))
+            if start >= len(texts_list):
+                print(f"该批文本此前已完整入库，跳过。")
+                return None
+            if start > 0:
+                print(f"从断点继续入库：已完成 {start}/{len(texts_list)} 个块。")
+
+        token_counts = [self._count_tokens(t) for t in texts_list[start:]]
+        batches = plan_token_batches(
+            token_counts,
+            max_tokens=deep_reader_config.EMBEDDING_BATCH_MAX_TOKENS,
+            max_items=deep_reader_config.EMBEDDING_BATCH_MAX_ITEMS,
+            offset=start,
+        )
+        print(f"开始向量化 {len(texts_list) - start} 个文本块（{sum(token_counts)} tokens，{len(batches)} 批）...")
+        return texts_list, metadatas, ingest_id, batches
+
+    def _finish_ingest(self, ingest_id: Optional[str], added: int):
+        # 入库完成后按向量数决定是否需要重建为近似索引（ivfpq 需要用全部向量训练，重建时会落盘）；
+        # 未重建时落盘最后一次刷新之后的批次。落盘之后才将任务标记为完成
+        self.rebuild_index()
+        with self._lock:
+            if self._unflushed_batches:
+                self._flush_index()
+            if ingest_id:
+                self._conn.execute("UPDATE ingest_progress SET completed = 1 WHERE ingest_id = ?", (ingest_id,))
+                self._conn.commit()
+        print(f"✅ 成功添加 {added} 个块到 RAG 存储。")
+
+    def _begin_ingest(self, ingest_id: str, total: int) -> int:
+        """登记一个可续传入库任务，返回应继续的起始偏移（高水位）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT next_offset FROM ingest_progress WHERE ingest_id = ?", (ingest_id,)
+            ).fetchone()
+            if row:
+                return row[0]
+            self._conn.execute(
+                "INSERT INTO ingest_progress (ingest_id, next_offset, total, completed, updated_at) VALUES (?, 0, ?, 0, ?)",
+                (ingest_id, total, time.time()),
+            )
+            self._conn.commit()
+            return 0
+
+    def _commit_batch(
+        self,
+        batch_texts: List[str],
+        batch_metadatas: List[dict],
+        embeddings_np: np.ndarray,
+        ingest_id: Optional[str],
+        next_offset: int,
+    ) -> List[int]:
+        """
+        将一批文本和向量作为一个整体提交：SQLite 行、内存索引中的向量和高水位要么都生效，要么都不生效。
+        FAISS 文件累计 VECTOR_INDEX_FLUSH_BATCHES 批或 VECTOR_INDEX_FLUSH_MB 后才落盘，
+        不必每批重写整个索引文件。
+        """
+        with self._lock:
+            cursor = self._conn.cursor()
+            chunk_ids = []
+            previous_version = self.index_version
+            try:
+                # 1. 写入 SQLite（暂不提交）：BEGIN IMMEDIATE 先取得写锁，再预先分配一段连续的 id，
+                #    整批用一条 executemany 写入，不必逐行读取 lastrowid
+                if not self._conn.in_transaction:
+                    cursor.execute("BEGIN IMMEDIATE")
+                first_id = self._next_chunk_id(cursor)
+                chunk_ids = list(range(first_id, first_id + len(batch_texts)))
+                cursor.executemany(
+                    "INSERT INTO chunks (id, content, metadata, source_id, chunk_index, section, start_index) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (chunk_id, content, json.dumps(meta), *(meta.get(column) for column in METADATA_COLUMNS))
+                        for chunk_id, content, meta in zip(chunk_ids, batch_texts, batch_metadatas)
+                    ],
+                )
+                if ingest_id:
+                    cursor.execute(
+                        "UPDATE ingest_progress SET next_offset = ?, updated_at = ? WHERE ingest_id = ?",
+                        (next_offset, time.time(), ingest_id),
+                    )
+                self._bump_index_version(commit=False)
+
+                # 2. 加入内存中的 FAISS 索引
+                ids_np = np.array(chunk_ids, dtype='int64')
+                self.index.add_with_ids(embeddings_np, ids_np)
+
+                # 3. 提交 SQLite 事务
+                try:
+                    self._conn.commit()
+                except Exception:
+                    self.index, _ = index_factory.remove_ids(self.index, ids_np)
+                    raise
+            except Exception:
+                self._conn.rollback()
+                self.index_version = previous_version
+                raise
+
+            # 4. 累计到阈值时落盘
+            self._unflushed_batches += 1
+            self._unflushed_bytes += embeddings_np.nbytes
+            if (
+                self._unflushed_batches >= deep_reader_config.VECTOR_INDEX_FLUSH_BATCHES
+                or self._unflushed_bytes >= deep_reader_config.VECTOR_INDEX_FLUSH_MB * 1024 * 1024
+            ):
+                self._flush_index()
+        return chunk_ids
+
+    @staticmethod
+    def _next_chunk_id(cursor: sqlite3.Cursor) -> int:
+        """
+        下一个可用的块 id。chunks 使用 AUTOINCREMENT，已删除或回滚前分配过的 id 记录在 sqlite_sequence 中，
+        取两者的最大值可保证 id 不会被复用（FAISS 中可能残留未提交的旧 id）。
+        """
+        max_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM chunks").fetchone()[0]
+        row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'chunks'").fetchone()
+        return max(max_id, row[0] if row else 0) + 1
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 10,
+        search_type: str = "vector",
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        相似度搜索。返回文档的 metadata 中附带 chunk_id，以及向量检索得到的 distance（L2 距离，越小越相关）。
+
+        Args:
+            query: 查询文本。
+            k: 返回的文档数量。
+            search_type: 'vector' 为 FAISS 向量检索；'lexical' 为 FTS5 全文检索（BM25 排序，不调用 Embedding）；
+                'hybrid' 将两者的排名按倒数排名融合（RRF）。
+            max_distance: 向量检索结果的距离阈值，超过阈值的块被丢弃（全文检索命中的块不受影响）。
+            filter: 按元数据列预先筛选候选块，如 {"section": "三、财务分析"}、
+                {"source_id": "doc1", "chunk_index": {"$gte": 10, "$lte": 40}}，
+                只在筛选出的块中检索（FAISS IDSelector），格式见 _filter_clause。
         """
-        import logging
-        import sys
-        import traceback
-        
         try:
-            # 步骤1: Embedding
-            logging.debug(f"[VectorStore] 开始 embed_query...")
-            sys.stdout.flush()
-            
-            query_embedding = self.embedding_model.embed_query(query)
-            
-            logging.debug(f"[VectorStore] embed_query 完成，维度: {len(query_embedding)}")
-            sys.stdout.flush()
-            
-            query_embedding_np = np.array([query_embedding], dtype='float32')
+            # 步骤1: 查询检索结果缓存，命中时跳过 Embedding 和索引搜索
+            cached = self._cached_hits([query], k, search_type, max_distance, filter)
 
-            # 步骤2: FAISS 搜索
-            logging.debug(f"[VectorStore] 开始 FAISS index.search...")
-            sys.stdout.flush()
-            
-            distances, chunk_ids = self.index.search(query_embedding_np, k)
-            
-            logging.debug(f"[VectorStore] FAISS search 完成，找到 {len(chunk_ids[0])} 个结果")
-            sys.stdout.flush()
+            query_embedding_np = None
+            if search_type != "lexical" and cached[0] is None:
+                # 步骤2: Embedding
+                logging.debug(f"[VectorStore] 开始 embed_query...")
+                sys.stdout.flush()
+
+                query_embedding = self.embedding_model.embed_query(query)
+
+                logging.debug(f"[VectorStore] embed_query 完成，维度: {len(query_embedding)}")
+                sys.stdout.flush()
+
+                query_embedding_np = np.array([query_embedding], dtype='float32')
+
+            # 步骤3 & 4: 检索并从 SQLite 获取内容
+            results = self._search([query], query_embedding_np, k, search_type, max_distance, cached, filter)[0]
 
-            # 步骤3: 从 SQLite 获取内容
-            logging.debug(f"[VectorStore] 开始从 SQLite 获取内容...")
-            sys.stdout.flush()
-            
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            results = []
-            for i in chunk_ids[0]:
-                if i == -1: continue # FAISS 在结果不足k个时会返回-1
-                
-                cursor.execute("SELECT content, metadata FROM chunks WHERE id = ?", (int(i),))
-                res = cursor.fetchone()
-                if res:
-                    metadata = json.loads(res[1]) if res[1] else {}
-                    results.append(Document(page_content=res[0], metadata=metadata))
-            conn.close()
-            
             logging.debug(f"[VectorStore] similarity_search 完成，返回 {len(results)} 个文档")
             sys.stdout.flush()
-            
+
             return results
-            
+
         except Exception as e:
             logging.critical(f"[VectorStore] !!! similarity_search 发生异常 !!!")
             logging.critical(f"异常类型: {type(e).__name__}")
@@ -212,11 +948,580 @@ class DeepReaderVectorStore(VectorStore):
             sys.stdout.flush()
             raise
 
+    def similarity_search_batch(
+        self,
+        queries: List[str],
+        k: int = 10,
+        search_type: str = "vector",
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Document]]:
+        """
+        批量相似度搜索：一次 embed_documents 请求向量化全部未命中缓存的查询，
+        一次矩阵 index.search 检索，一次 SQLite 查询取回所有命中的块。
+        search_type、max_distance 和 filter 的含义与 similarity_search 相同。
+
+        Returns:
+            与 queries 一一对应的文档列表。
+        """
+        if not queries:
+            return []
+
+        try:
+            queries = list(queries)
+            cached = self._cached_hits(queries, k, search_type, max_distance, filter)
+            misses = [q for q, hits in zip(queries, cached) if hits is None]
+
+            query_embeddings_np = None
+            if search_type != "lexical" and misses:
+                logging.debug(f"[VectorStore] 开始批量 embed，共 {len(misses)} 个查询...")
+                query_embeddings = self.embedding_model.embed_documents(misses)
+                query_embeddings_np = np.array(query_embeddings, dtype='float32')
+
+            results = self._search(queries, query_embeddings_np, k, search_type, max_distance, cached, filter)
+
+            logging.debug(f"[VectorStore] similarity_search_batch 完成，返回 {sum(len(r) for r in results)} 个文档")
+            return results
+
+        except Exception as e:
+            logging.critical(f"[VectorStore] !!! similarity_search_batch 发生异常 !!!")
+            logging.critical(f"异常类型: {type(e).__name__}")
+            logging.critical(f"异常信息: {e}")
+            logging.critical(f"调用栈:\n{traceback.format_exc()}")
+            sys.stdout.flush()
+            raise
+
+    async def asimilarity_search(
+        self,
+        query: str,
+        k: int = 10,
+        search_type: str = "vector",
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        similarity_search 的原生异步版本：使用 aembed_query 发起 embedding 请求，
+        FAISS 搜索、全文检索和 SQLite 读取放到有界线程池中执行，不阻塞事件循环。
+        """
+        try:
+            loop = asyncio.get_running_loop()
+            cached = await loop.run_in_executor(
+                _SEARCH_EXECUTOR, self._cached_hits, [query], k, search_type, max_distance, filter
+            )
+
+            query_embedding_np = None
+            if search_type != "lexical" and cached[0] is None:
+                query_embedding = await self.embedding_model.aembed_query(query)
+                query_embedding_np = np.array([query_embedding], dtype='float32')
+
+            results = await loop.run_in_executor(
+                _SEARCH_EXECUTOR, self._search, [query], query_embedding_np, k, search_type, max_distance, cached, filter
+            )
+            return results[0]
+
+        except Exception as e:
+            logging.critical(f"[VectorStore] !!! asimilarity_search 发生异常 !!!")
+            logging.critical(f"异常类型: {type(e).__name__}")
+            logging.critical(f"异常信息: {e}")
+            logging.critical(f"调用栈:\n{traceback.format_exc()}")
+            raise
+
+    async def asimilarity_search_batch(
+        self,
+        queries: List[str],
+        k: int = 10,
+        search_type: str = "vector",
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Document]]:
+        """
+        similarity_search_batch 的原生异步版本。
+        """
+        if not queries:
+            return []
+
+        try:
+            queries = list(queries)
+            loop = asyncio.get_running_loop()
+            cached = await loop.run_in_executor(
+                _SEARCH_EXECUTOR, self._cached_hits, queries, k, search_type, max_distance, filter
+            )
+            misses = [q for q, hits in zip(queries, cached) if hits is None]
+
+            query_embeddings_np = None
+            if search_type != "lexical" and misses:
+                query_embeddings = await self.embedding_model.aembed_documents(misses)
+                query_embeddings_np = np.array(query_embeddings, dtype='float32')
+
+            return await loop.run_in_executor(
+                _SEARCH_EXECUTOR, self._search, queries, query_embeddings_np, k, search_type, max_distance, cached, filter
+            )
+
+        except Exception as e:
+            logging.critical(f"[VectorStore] !!! asimilarity_search_batch 发生异常 !!!")
+            logging.critical(f"异常类型: {type(e).__name__}")
+            logging.critical(f"异常信息: {e}")
+            logging.critical(f"调用栈:\n{traceback.format_exc()}")
+            raise
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 10,
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """
+        向量检索并返回每个文档的 L2 距离（越小越相关）。向量均已归一化，距离范围为 [0, 2]。
+        """
+        cached = self._cached_hits([query], k, "vector", max_distance, filter)
+        query_embedding_np = None
+        if cached[0] is None:
+            query_embedding_np = np.array([self.embedding_model.embed_query(query)], dtype='float32')
+        docs = self._search([query], query_embedding_np, k, "vector", max_distance, cached, filter)[0]
+        return [(doc, doc.metadata["distance"]) for doc in docs]
+
+    async def asimilarity_search_with_score(
+        self,
+        query: str,
+        k: int = 10,
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """
+        similarity_search_with_score 的原生异步版本。
+        """
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(_SEARCH_EXECUTOR, self._cached_hits, [query], k, "vector", max_distance, filter)
+        query_embedding_np = None
+        if cached[0] is None:
+            query_embedding_np = np.array([await self.embedding_model.aembed_query(query)], dtype='float32')
+        docs = (await loop.run_in_executor(
+            _SEARCH_EXECUTOR, self._search, [query], query_embedding_np, k, "vector", max_distance, cached, filter
+        ))[0]
+        return [(doc, doc.metadata["distance"]) for doc in docs]
+
+    def lexical_search(self, query: str, k: int = 10, filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """
+        纯全文检索的快速路径：FTS5 + BM25 排序，不调用 Embedding API。
+        适合股票代码、财务科目、具体数字等精确词的查找。
+        """
+        cached = self._cached_hits([query], k, "lexical", filter=filter)
+        return self._search([query], None, k, "lexical", cached=cached, filter=filter)[0]
+
+    def search_with_vectors(
+        self,
+        queries: List[str],
+        query_vectors: Optional[np.ndarray],
+        k: int = 10,
+        search_type: str = "vector",
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Document]]:
+        """
+        使用调用方已向量化的查询检索（如 DocumentLibrary 跨多个库检索时每个查询只向量化一次）。
+        query_vectors 与 queries 一一对应，lexical 检索时可为 None；其余参数与 similarity_search 相同。
+        """
+        cached = self._cached_hits(queries, k, search_type, max_distance, filter)
+        misses = [i for i, hits in enumerate(cached) if hits is None]
+        vectors = None
+        if query_vectors is not None and misses:
+            vectors = np.ascontiguousarray(np.asarray(query_vectors, dtype="float32")[misses])
+        return self._search(queries, vectors, k, search_type, max_distance, cached, filter)
+
+    def get_by_ids(self, ids: Sequence[int]) -> List[Document]:
+        """按块 id 读取文档（metadata 中附带 chunk_id），不存在的 id 被忽略，返回顺序与 ids 一致"""
+        return self._docs_for_hits([[(int(i), None) for i in ids]])[0]
+
+    def fetch_neighbors(self, docs: List[Document], window: int = 1) -> List[Document]:
+        """
+        取回检索命中块前后各 window 个相邻块（同一 source_id 下 chunk_index 相邻），供上下文装配时扩展命中片段。
+        同一文档的块按顺序入库、id 连续，这里按 id 范围读取后再以 source_id / chunk_index 校验；
+        已在 docs 中的块不会重复返回。
+        """
+        if any(doc.metadata.get("parent") for doc in docs):
+            return self._fetch_parent_neighbors(docs, window)
+
+        wanted = set()
+        present = set()
+        for doc in docs:
+            source_id = doc.metadata.get("source_id")
+            chunk_index = doc.metadata.get("chunk_index")
+            chunk_ids = doc.metadata.get("chunk_ids") or [doc.metadata.get("chunk_id")]
+            chunk_ids = [i for i in chunk_ids if i is not None]
+            if source_id is None or chunk_index is None or not chunk_ids:
+                continue
+            present.update(chunk_ids)
+            wanted.update(range(min(chunk_ids) - window, max(chunk_ids) + window + 1))
+
+        rows = self._fetch_chunks(wanted - present)
+        covered = {
+            (doc.metadata.get("source_id"), i)
+            for doc in docs
+            if doc.metadata.get("chunk_index") is not None
+            for i in range(doc.metadata["chunk_index"], doc.metadata.get("chunk_index_end", doc.metadata["chunk_index"]) + 1)
+        }
+        neighbors = []
+        for chunk_id in sorted(rows):
+            content, metadata = rows[chunk_id]
+            position = (metadata.get("source_id"), metadata.get("chunk_index"))
+            if position[1] is None or position in covered:
+                continue
+            neighbors.append(Document(page_content=content, metadata={**metadata, "chunk_id": chunk_id}))
+        return neighbors
+
+    async def afetch_neighbors(self, docs: List[Document], window: int = 1) -> List[Document]:
+        """
+        fetch_neighbors 的异步版本，SQLite 读取在检索线程池中执行。
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_SEARCH_EXECUTOR, self.fetch_neighbors, docs, window)
+
+    def expand_parents_batch(self, docs_list: List[List[Document]]) -> List[List[Document]]:
+        """
+        将每个查询命中的子块替换为其所属的父窗口：同一父窗口的多个子块只保留一份，
+        排在其中排名最靠前的子块的位置，距离取最小值。所有查询的父窗口通过一次 SQLite 查询取回。
+
+        返回的父窗口 metadata 中 chunk_index 为 parent_index（相邻父窗口可被 merge_adjacent_chunks 合并），
+        parent=True，chunk_ids 为命中的子块 id。没有 parent_index 的文档（平铺分块的库）原样保留。
+        """
+        if not self.has_parents:
+            return docs_list
+        parents = self._fetch_parents({
+            (doc.metadata["source_id"], doc.metadata["parent_index"])
+            for docs in docs_list
+            for doc in docs
+            if doc.metadata.get("parent_index") is not None
+        })
+        results = []
+        for docs in docs_list:
+            expanded: List[Document] = []
+            by_key: Dict[Tuple[str, int], Document] = {}
+            for doc in docs:
+                key = (doc.metadata.get("source_id"), doc.metadata.get("parent_index"))
+                if key not in parents:
+                    expanded.append(doc)
+                    continue
+                parent = by_key.get(key)
+                if parent is None:
+                    parent = self._parent_document(key, parents[key])
+                    by_key[key] = parent
+                    expanded.append(parent)
+                if "chunk_id" in doc.metadata:
+                    parent.metadata["chunk_ids"].append(doc.metadata["chunk_id"])
+                if "distance" in doc.metadata:
+                    parent.metadata["distance"] = min(parent.metadata.get("distance", np.inf), doc.metadata["distance"])
+            results.append(expanded)
+        return results
+
+    async def aexpand_parents_batch(self, docs_list: List[List[Document]]) -> List[List[Document]]:
+        """
+        expand_parents_batch 的异步版本，SQLite 读取在检索线程池中执行。
+        """
+        if not self.has_parents:
+            return docs_list
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_SEARCH_EXECUTOR, self.expand_parents_batch, docs_list)
+
+    @staticmethod
+    def _parent_document(key: Tuple[str, int], row: Tuple[str, Optional[str], Optional[int]]) -> Document:
+        content, section, start_index = row
+        return Document(page_content=content, metadata={
+            "source_id": key[0],
+            "chunk_index": key[1],
+            "parent_index": key[1],
+            "section": section,
+            "start_index": start_index,
+            "parent": True,
+            "chunk_ids": [],
+        })
+
+    def _fetch_parents(self, keys: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], Tuple[str, Optional[str], Optional[int]]]:
+        """按 (source_id, parent_index) 批量读取父窗口，按 source_id 分组以 IN 查询"""
+        grouped: Dict[str, List[int]] = {}
+        for source_id, parent_index in keys:
+            grouped.setdefault(source_id, []).append(parent_index)
+        rows = {}
+        with self._lock:
+            cursor = self._conn.cursor()
+            for source_id, indices in grouped.items():
+                for start in range(0, len(indices), _SQLITE_MAX_VARIABLES):
+                    batch = indices[start:start + _SQLITE_MAX_VARIABLES]
+                    placeholders = ",".join("?" * len(batch))
+                    cursor.execute(
+                        f"SELECT parent_index, content, section, start_index FROM parents "
+                        f"WHERE source_id = ? AND parent_index IN ({placeholders})",
+                        [source_id, *batch],
+                    )
+                    for parent_index, content, section, start_index in cursor.fetchall():
+                        rows[(source_id, parent_index)] = (content, section, start_index)
+        return rows
+
+    def _fetch_parent_neighbors(self, docs: List[Document], window: int) -> List[Document]:
+        """fetch_neighbors 的父窗口版本：取回命中父窗口前后各 window 个父窗口"""
+        covered = set()
+        for doc in docs:
+            source_id = doc.metadata.get("source_id")
+            if source_id is None or doc.metadata.get("chunk_index") is None:
+                continue
+            start = doc.metadata["chunk_index"]
+            covered.update((source_id, i) for i in range(start, doc.metadata.get("chunk_index_end", start) + 1))
+        wanted = {
+            (source_id, i + offset)
+            for source_id, i in covered
+            for offset in range(-window, window + 1)
+            if i + offset >= 0
+        } - covered
+        rows = self._fetch_parents(wanted)
+        return [self._parent_document(key, rows[key]) for key in sorted(rows)]
+
+    def _search(
+        self,
+        queries: List[str],
+        query_vectors: Optional[np.ndarray],
+        k: int,
+        search_type: str,
+        max_distance: Optional[float] = None,
+        cached: Optional[List[Optional[List[Tuple[int, Optional[float]]]]]] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Document]]:
+        """
+        按 search_type 得到每个查询的有序命中 (块 id, 距离)，并一次性从 SQLite 取回全部命中块。
+
+        cached 为 _cached_hits 的结果：已命中缓存的查询不再搜索，query_vectors 只包含未命中查询的向量。
+        新的搜索结果会写入检索结果缓存。
+        """
+        if search_type not in SEARCH_TYPES:
+            raise ValueError(f"未知的检索方式: {search_type}，可选值为 {' / '.join(SEARCH_TYPES)}")
+
+        ranked_hits = list(cached) if cached is not None else [None] * len(queries)
+        misses = [i for i, hits in enumerate(ranked_hits) if hits is None]
+        if misses:
+            miss_queries = [queries[i] for i in misses]
+            fresh = self._ranked_hits(miss_queries, query_vectors, k, search_type, max_distance, filter)
+            for i, hits in zip(misses, fresh):
+                ranked_hits[i] = hits
+            self._store_cached_hits(miss_queries, fresh, k, search_type, max_distance, filter)
+        return self._docs_for_hits(ranked_hits)
+
+    def _ranked_hits(
+        self,
+        queries: List[str],
+        query_vectors: Optional[np.ndarray],
+        k: int,
+        search_type: str,
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Tuple[int, Optional[float]]]]:
+        # 有过滤条件时先从 SQLite 的索引列中选出候选块 id，向量检索只在这些 id 中进行
+        subset = self._filter_ids(filter) if filter else None
+        if search_type == "lexical":
+            ranked_hits = [[(i, None) for i in self._lexical_ids(query, k, filter)] for query in queries]
+        elif search_type == "vector":
+            ranked_hits = self._vector_hits(query_vectors, k, max_distance, subset)
+        else:
+            # 两路各取更多候选再融合，避免只在一路中排名靠后的相关块被截断
+            fetch_k = max(k, deep_reader_config.RAG_HYBRID_FETCH_K)
+            ranked_hits = []
+            for query, dense in zip(queries, self._vector_hits(query_vectors, fetch_k, max_distance, subset)):
+                distances = dict(dense)
+                fused = reciprocal_rank_fusion([list(distances), self._lexical_ids(query, fetch_k, filter)], k)
+                ranked_hits.append([(i, distances.get(i)) for i in fused])
+        return ranked_hits
+
+    def _query_cache_params(
+        self,
+        k: int,
+        search_type: str,
+        max_distance: Optional[float],
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> Optional[str]:
+        """检索结果缓存键中的检索参数部分；缓存未启用或该库没有索引版本时返回 None"""
+        if not deep_reader_config.RAG_QUERY_CACHE_ENABLED or not self.index_version:
+            return None
+        params = f"{search_type}|k={k}|max_distance={max_distance}"
+        if search_type != "vector":
+            # 全文检索加入短词匹配后结果不同，不复用之前缓存的命中
+            params += "|short_terms"
+        if search_type == "hybrid":
+            params += f"|fetch_k={deep_reader_config.RAG_HYBRID_FETCH_K}|rrf_k={deep_reader_config.RAG_HYBRID_RRF_K}"
+        if filter:
+            params += f"|filter={json.dumps(filter, sort_keys=True, ensure_ascii=False, default=list)}"
+        return params
+
+    def _cached_hits(
+        self,
+        queries: List[str],
+        k: int,
+        search_type: str,
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Optional[List[Tuple[int, Optional[float]]]]]:
+        """查询检索结果缓存，返回与 queries 一一对应的有序命中，未命中的位置为 None"""
+        params = self._query_cache_params(k, search_type, max_distance, filter)
+        if params is None:
+            return [None] * len(queries)
+        try:
+            cached = get_query_cache().get_many(os.path.abspath(self.db_path), self.index_version, params, queries)
+        except sqlite3.Error as e:
+            logging.warning(f"[VectorStore] 读取检索结果缓存失败: {e}")
+            return [None] * len(queries)
+        hits = sum(1 for c in cached if c is not None)
+        if hits:
+            logging.debug(f"[VectorStore] 检索结果缓存命中 {hits}/{len(queries)}")
+        return cached
+
+    def _store_cached_hits(
+        self,
+        queries: List[str],
+        ranked_hits: List[List[Tuple[int, Optional[float]]]],
+        k: int,
+        search_type: str,
+        max_distance: Optional[float] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ):
+        params = self._query_cache_params(k, search_type, max_distance, filter)
+        if params is None:
+            return
+        try:
+            get_query_cache().put_many(os.path.abspath(self.db_path), self.index_version, params, queries, ranked_hits)
+        except sqlite3.Error as e:
+            logging.warning(f"[VectorStore] 写入检索结果缓存失败: {e}")
+
+    def _vector_hits(
+        self,
+        query_vectors: np.ndarray,
+        k: int,
+        max_distance: Optional[float] = None,
+        subset: Optional[np.ndarray] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        logging.debug(f"[VectorStore] 开始 FAISS index.search，查询数: {len(query_vectors)}...")
+        if subset is None:
+            distances, chunk_ids = self.index.search(query_vectors, k)
+        else:
+            distances, chunk_ids = index_factory.search_subset(self.index, query_vectors, k, subset)
+        # IndexFlatL2 等返回的是 L2 距离的平方，这里换算为距离本身
+        distances = np.sqrt(np.maximum(distances, 0))
+        hits = []
+        for row_ids, row_distances in zip(chunk_ids, distances):
+            # FAISS 在结果不足k个时会返回-1
+            hits.append([
+                (int(i), float(d))
+                for i, d in zip(row_ids, row_distances)
+                if i != -1 and (max_distance is None or d <= max_distance)
+            ])
+        return hits
+
+    def _lexical_ids(self, query: str, k: int, filter: Optional[Dict[str, Any]] = None) -> List[int]:
+        """
+        FTS5 全文检索，按 BM25 排序返回块 id；没有全文索引或查询中没有可检索的词时返回空列表。
+        trigram 分词器下查询中的两字符词另行子串匹配，两路排名按倒数排名融合。
+        """
+        if not self.fts_tokenizer:
+            return []
+        trigram = self.fts_tokenizer == "trigram"
+        match = _fts_match_expression(query, trigram=trigram)
+        short_terms = _short_terms(query) if trigram else []
+        if not match and not short_terms:
+            return []
+        rankings = []
+        with self._lock:
+            if match and not filter:
+                rows = self._conn.execute(
+                    "SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (match, k),
+                ).fetchall()
+                rankings.append([row[0] for row in rows])
+            elif match:
+                clause, params = _filter_clause(filter, self.typed_columns)
+                rows = self._conn.execute(
+                    "SELECT chunks_fts.rowid FROM chunks_fts JOIN chunks ON chunks.id = chunks_fts.rowid "
+                    f"WHERE chunks_fts MATCH ? AND {clause} ORDER BY rank LIMIT ?",
+                    (match, *params, k),
+                ).fetchall()
+                rankings.append([row[0] for row in rows])
+            if short_terms:
+                rankings.append(self._short_term_ids(short_terms, k, filter))
+        if len(rankings) == 1:
+            return rankings[0]
+        return reciprocal_rank_fusion(rankings, k)
+
+    def _short_term_ids(self, terms: List[str], k: int, filter: Optional[Dict[str, Any]] = None) -> List[int]:
+        """
+        对 chunks.content 做子串扫描，按命中的短词个数排序返回块 id（需持有 _lock）。
+        区分大小写（instr），避免 GE 之类的代码命中 general 等普通单词；扫描全表，
+        单篇文档的块数下开销可以接受。
+        """
+        clause, params = _filter_clause(filter, self.typed_columns) if filter else ("1", [])
+        hits = " + ".join("(instr(content, ?) > 0)" for _ in terms)
+        rows = self._conn.execute(
+            f"SELECT id FROM (SELECT id, {hits} AS hits FROM chunks WHERE {clause}) "
+            "WHERE hits > 0 ORDER BY hits DESC, id LIMIT ?",
+            (*terms, *params, k),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _filter_ids(self, filter: Dict[str, Any]) -> np.ndarray:
+        """返回满足过滤条件的全部块 id"""
+        clause, params = _filter_clause(filter, self.typed_columns)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id FROM chunks WHERE {clause}", params).fetchall()
+        return np.array([row[0] for row in rows], dtype="int64")
+
+    def _docs_for_hits(self, ranked_hits: List[List[Tuple[int, Optional[float]]]]) -> List[List[Document]]:
+        rows = self._fetch_chunks({i for hits in ranked_hits for i, _ in hits})
+        results = []
+        for hits in ranked_hits:
+            docs = []
+            for i, distance in hits:
+                res = rows.get(i)
+                if res:
+                    content, metadata = res
+                    metadata = {**metadata, "chunk_id": i}
+                    if distance is not None:
+                        metadata["distance"] = distance
+                    docs.append(Document(page_content=content, metadata=metadata))
+            results.append(docs)
+        return results
+
+    def _fetch_chunks(self, chunk_ids: Iterable[int]) -> Dict[int, Tuple[str, dict]]:
+        """
+        使用 WHERE id IN (...) 批量读取块内容和元数据。
+        """
+        ids = list(chunk_ids)
+        rows = {}
+        if not ids:
+            return rows
+
+        with self._lock:
+            cursor = self._conn.cursor()
+            # SQLite 对单条语句的参数数量有限制，超长列表分段查询
+            for start in range(0, len(ids), _SQLITE_MAX_VARIABLES):
+                batch = ids[start:start + _SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(f"SELECT id, content, metadata FROM chunks WHERE id IN ({placeholders})", batch)
+                for chunk_id, content, metadata in cursor.fetchall():
+                    rows[chunk_id] = (content, json.loads(metadata) if metadata else {})
+        return rows
+
+    def close(self):
+        """
+        释放该实例持有的 SQLite 连接（先落盘尚未写入 FAISS 文件的批次）。关闭后实例不可再使用。
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._flush_pending()
+                self._conn.close()
+                self._conn = None
+
     @classmethod
     def from_texts(
         cls: Type["DeepReaderVectorStore"],
         texts: List[str],
-        embedding: OpenAIEmbeddings,
+        embedding: Embeddings,
         metadatas: Optional[List[dict]] = None,
         db_path: Optional[str] = None,
         db_name: Optional[str] = "default_from_texts_db",
@@ -233,5 +1538,5 @@ class DeepReaderVectorStore(VectorStore):
         return store
 
     def _select_relevance_score_fn(self):
-        # 这是 VectorStore 中的一个抽象方法，需要一个虚拟实现
-        pass
+        # 向量已归一化，similarity_search_with_score 返回 L2 距离，按欧氏距离换算为 [0, 1] 的相关度
+        return self._euclidean_relevance_score_fn
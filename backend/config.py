@@ -5,7 +5,7 @@
 @time: 2025-06-26 11:00
 @desc: DeepReader backend configuration settings
 """
-from typing import Literal, Dict, Any
+from typing import Literal, Dict, Any, List, Optional
 
 
 class DeepReaderConfig:
@@ -31,11 +31,67 @@ class DeepReaderConfig:
     # Search LLM - 用于需要联网搜索的任务
     SEARCH_LLM_PROVIDER: str = "google_genai"
     SEARCH_LLM_MODEL: str = "gemini-2.5-flash"
+
+    # Google GenAI 原生 SDK 客户端（Search LLM）：进程内复用，连接池大小、长连接保持时间和单次请求超时
+    GOOGLE_GENAI_MAX_CONNECTIONS: int = 20
+    GOOGLE_GENAI_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    GOOGLE_GENAI_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+    GOOGLE_GENAI_TIMEOUT_SECONDS: Optional[float] = 120.0
     
     # LLM 通用参数
     TEMPERATURE: float = 0.5
     LLM_KWARGS: Dict[str, Any] = {}
 
+    # 是否启用持久化 LLM 响应缓存（backend/memory/llm_cache.sqlite）：fast / smart / writer 三个层级的调用
+    # 按 (层级, 模型, 温度, 调用参数, 提示词) 缓存响应，断点续跑、重跑报告或调试提示词时相同的调用直接复用；
+    # 单次调用可通过 use_cache=False 绕过。联网搜索的 search_llm 结果有时效性，不缓存
+    LLM_CACHE_ENABLED: bool = False
+
+    # 响应缓存的有效期（小时），None 表示不过期
+    LLM_CACHE_TTL_HOURS: Optional[float] = 168.0
+
+    # 响应缓存的总大小上限（MB），超出后先清除过期条目，再按最近访问时间淘汰
+    LLM_CACHE_MAX_MB: int = 512
+
+    # LLM 调用调度（backend/components/llm_scheduler.py）：各层级的最大并发数、每分钟请求数和每分钟 token 数，
+    # None 表示不限制。超出的调用按到达顺序排队，平稳消耗配额而不是突发后被 429 拒绝
+    LLM_MAX_CONCURRENCY: Dict[str, Optional[int]] = {
+        "fast_llm": 16, "smart_llm": 8, "writer_llm": 4, "search_llm": 4,
+    }
+    LLM_RPM: Dict[str, Optional[int]] = {
+        "fast_llm": 600, "smart_llm": 600, "writer_llm": 120, "search_llm": 300,
+    }
+    LLM_TPM: Dict[str, Optional[int]] = {
+        "fast_llm": 1_000_000, "smart_llm": 1_000_000, "writer_llm": 1_000_000, "search_llm": None,
+    }
+
+    # 请求数 / token 预算允许的突发量，以秒计（令牌桶容量 = 每分钟预算 * 秒数 / 60）
+    LLM_RATE_BURST_SECONDS: float = 10.0
+
+    # LLM 调用失败的重试：限流 (429)、超时、5xx、网络错误和空响应按指数退避（全抖动）重试，
+    # 服务端给出 Retry-After 时至少等待该时长；请求参数错误、鉴权失败等不可重试的错误直接抛出 LLMError
+    LLM_MAX_RETRIES: int = 4
+    LLM_RETRY_BASE_DELAY: float = 1.0
+    LLM_RETRY_MAX_DELAY: float = 60.0
+
+    # 单次 LLM 调用（不含排队）的超时秒数，超时按可重试错误处理，None 表示不限制
+    LLM_TIMEOUT_SECONDS: Optional[float] = 300.0
+
+    # 对冲请求（hedged request）：调用耗时超过该层级近期 p95 延迟（不低于 LLM_HEDGE_MIN_DELAY 秒）时
+    # 再发出一个相同的请求，取先返回的结果并取消另一个。以少量额外的 token 消耗降低串行阅读循环的长尾延迟；
+    # 近期成功调用少于 LLM_HEDGE_MIN_SAMPLES 次时不对冲。单次调用可通过 hedge=True/False 覆盖
+    LLM_HEDGING_ENABLED: bool = False
+    LLM_HEDGE_TIERS: List[str] = ["fast_llm"]
+    LLM_HEDGE_MIN_DELAY: float = 2.0
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+
+    # 结构化输出（call_structured_llm）：'schema' 传入模型原生的 JSON Schema 约束（Gemini response_schema /
+    # OpenAI response_format），Schema 无法表达时退回 JSON 模式；'json' 只启用 JSON 模式；'off' 只依靠提示词
+    LLM_STRUCTURED_OUTPUT: Literal['schema', 'json', 'off'] = 'schema'
+
+    # 本地解析和校验后仍不合格时，只把不合格的部分发回模型修正的最大次数（不重发原始提示词）
+    LLM_STRUCTURED_REPAIR_ATTEMPTS: int = 2
+
     # =================================================================
     # 文档解析配置
     # =================================================================
@@ -49,6 +105,157 @@ class DeepReaderConfig:
     # 这个数值越大，阅读速度越快，但是阅读精度可能有一定程度下降。类似于“一目十行”速度越快。
     SNIPPET_CHUNK_SIZE: int = 3000
 
+    # =================================================================
+    # 向量存储配置
+    # =================================================================
+
+    # Embedding 后端（backend/components/embedding_provider.py）
+    # - 'openai': OpenAI Embedding API，模型见 EMBEDDING_MODEL
+    # - 'local': 本地 CPU 模型（需安装 sentence-transformers），查询无需网络往返，模型见 LOCAL_EMBEDDING_MODEL
+    # - 'hashing': 确定性哈希向量，不依赖网络和模型文件，仅用于测试和离线调试
+    # 仅对新建的库生效，已有的库沿用建库时记录的模型（store_meta 中的 embedding_model）
+    EMBEDDING_PROVIDER: Literal['openai', 'local', 'hashing'] = 'openai'
+
+    # 向量化所用的 OpenAI Embedding 模型
+    EMBEDDING_MODEL: str = "text-embedding-3-large"
+
+    # 本地 Embedding 模型（sentence-transformers 模型名或本地路径）及推理后端（'torch' / 'onnx'）
+    LOCAL_EMBEDDING_MODEL: str = "BAAI/bge-small-zh-v1.5"
+    LOCAL_EMBEDDING_BACKEND: Literal['torch', 'onnx'] = 'torch'
+
+    # 本地模型每次推理的批大小，以及推理线程数（None 表示使用 PyTorch 默认值，即 CPU 核数）
+    LOCAL_EMBEDDING_BATCH_SIZE: int = 64
+    LOCAL_EMBEDDING_THREADS: Optional[int] = None
+
+    # 'hashing' 后端的向量维度
+    HASH_EMBEDDING_DIMENSIONS: int = 256
+
+    # 请求缩短后的向量维度（text-embedding-3 系列支持 dimensions 参数），None 表示使用模型原生维度。
+    # 仅对新建的库生效，已有的库沿用建库时记录的维度（可用 backend/components/index_migration.py 转换）
+    EMBEDDING_DIMENSIONS: Optional[int] = None
+
+    # RAG 分块方式
+    # - 'parent_child': 两级分块、无重叠——按段落/章节切出父窗口（只在 SQLite 中保存一份），
+    #   每个父窗口再切成小的子块用于向量化；检索命中子块后返回去重的父窗口作为上下文
+    # - 'flat': 单级分块，向量化的块即送入 LLM 的上下文，相邻块之间有重叠
+    # 改为 'parent_child' 后文档的 RAG 缓存键随之变化，已处理过的文档会重新分块并全部重新向量化
+    RAG_CHUNKING: Literal['parent_child', 'flat'] = 'flat'
+
+    # 'parent_child' 分块参数：父窗口和子块的最大字符数
+    RAG_PARENT_CHUNK_SIZE: int = 1500
+    RAG_CHILD_CHUNK_SIZE: int = 300
+
+    # 'flat' 分块参数：每个块的字符数和相邻块的重叠字符数
+    RAG_CHUNK_SIZE: int = 1000
+    RAG_CHUNK_OVERLAP: int = 200
+
+    # 入库向量化时每个请求批次的最大 token 数和最大条数（OpenAI 单次请求上限为 300k tokens / 2048 条）
+    EMBEDDING_BATCH_MAX_TOKENS: int = 40_000
+    EMBEDDING_BATCH_MAX_ITEMS: int = 256
+
+    # 入库向量化时同时在途的最大请求数（遇到 429 时会自动降低）
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+
+    # 入库时 FAISS 索引文件的落盘频率：SQLite 每批提交，内存中的索引每累计这么多批或这么多 MB 新向量才整体写盘一次，
+    # 入库结束时总会落盘。进程中断时，最后一次落盘之后提交的批次在重新打开时回滚，续传时重新向量化
+    VECTOR_INDEX_FLUSH_BATCHES: int = 16
+    VECTOR_INDEX_FLUSH_MB: int = 256
+
+    # 进程内最多同时保持打开的向量存储数量（超出后按 LRU 关闭未被使用的实例）
+    VECTOR_STORE_POOL_SIZE: int = 8
+
+    # 异步检索时执行 FAISS 搜索和 SQLite 读取的线程池大小
+    VECTOR_SEARCH_MAX_WORKERS: int = 4
+
+    # 向量库 SQLite 连接的页缓存大小和内存映射读取大小（MB，按连接计）
+    VECTOR_SQLITE_CACHE_MB: int = 64
+    VECTOR_SQLITE_MMAP_MB: int = 256
+
+    # 是否启用持久化 Embedding 缓存（backend/memory/embedding_cache.sqlite），
+    # 相同文本在重复入库或重复查询时不再调用 Embedding API。与 LLM 响应缓存一样默认关闭：
+    # 缓存文件随处理过的文本增长（上限见 EMBEDDING_CACHE_MAX_ENTRIES），不计入 MEMORY_QUOTA_MB
+    EMBEDDING_CACHE_ENABLED: bool = False
+
+    # Embedding 缓存最多保留的向量条数，超出后按最近访问时间淘汰
+    # （text-embedding-3-large 每条约 12 KB）
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 100_000
+
+    # FAISS 索引类型
+    # - 'auto': 按向量数自动选择，入库完成后在超过阈值时自动重建为近似索引
+    # - 'flat': 精确暴力搜索，适合单篇文档
+    # - 'hnsw': 图索引，召回高、查询快，但内存占用与 flat 相当
+    # - 'ivfpq': 倒排 + 乘积量化，每个向量只占 VECTOR_INDEX_PQ_M 字节，适合多文档大型文库
+    VECTOR_INDEX_TYPE: Literal['auto', 'flat', 'hnsw', 'ivfpq'] = 'auto'
+
+    # 'auto' 模式下的切换阈值：向量数达到 HNSW 阈值改用 hnsw，达到 IVFPQ 阈值改用 ivfpq
+    VECTOR_INDEX_HNSW_THRESHOLD: int = 20_000
+    VECTOR_INDEX_IVFPQ_THRESHOLD: int = 200_000
+
+    # HNSW 参数：每个节点的邻居数，以及构建/查询时的候选队列长度（越大召回越高、越慢）
+    VECTOR_INDEX_HNSW_M: int = 32
+    VECTOR_INDEX_EF_CONSTRUCTION: int = 80
+    VECTOR_INDEX_EF_SEARCH: int = 128
+
+    # IVF-PQ 参数：查询时探查的聚类数，以及每个向量的 PQ 子量化器个数（需整除向量维度）
+    VECTOR_INDEX_NPROBE: int = 32
+    VECTOR_INDEX_PQ_M: int = 96
+
+    # flat / hnsw 索引中向量的存储精度：'float32' 为全精度，'float16' 占用减半，
+    # 'int8' 为标量量化、占用降为 1/4（需要训练，新库先以 float32 入库，入库完成后转换）。
+    # 与 EMBEDDING_DIMENSIONS 一样只对新建的库生效
+    VECTOR_STORAGE: Literal['float32', 'float16', 'int8'] = 'float32'
+
+    # RAG 检索方式
+    # - 'vector': 仅 FAISS 向量检索
+    # - 'hybrid': 向量检索与 SQLite FTS5 全文检索（BM25）按倒数排名融合，兼顾语义和股票代码、数字等精确词
+    # - 'lexical': 仅全文检索，不调用 Embedding API，延迟最低
+    RAG_SEARCH_TYPE: Literal['vector', 'hybrid', 'lexical'] = 'vector'
+
+    # hybrid 检索时每一路取回的候选数，以及倒数排名融合的平滑常数 k
+    RAG_HYBRID_FETCH_K: int = 50
+    RAG_HYBRID_RRF_K: int = 60
+
+    # 向量检索的 L2 距离阈值（向量已归一化，距离 = sqrt(2 - 2 * 余弦相似度)），超过阈值的块不送入 LLM；
+    # 如 1.25 约对应余弦相似度 0.22；None 表示不过滤，总是返回 k 个结果
+    RAG_MAX_DISTANCE: Optional[float] = None
+
+    # 检索片段近似重复判定阈值（字符 5-gram 的 Jaccard 相似度），达到阈值的片段只保留排名靠前的一个
+    RAG_DEDUP_THRESHOLD: float = 0.8
+
+    # 送入 LLM 的检索上下文 token 预算：ReviewerAgent 回答问题 / 写作环节取素材。
+    # 按得分依次装入片段，到预算为止
+    RAG_REVIEWER_CONTEXT_TOKENS: int = 4000
+    RAG_WRITER_CONTEXT_TOKENS: int = 6000
+
+    # 装配上下文时为命中块补充的前后相邻块数（预算有剩余时才补充），0 表示不扩展。
+    # 开启后每次检索多一次 SQLite 查询，送入 LLM 的上下文也与只取命中块时不同
+    RAG_CONTEXT_NEIGHBOR_WINDOW: int = 0
+
+    # 是否启用持久化检索结果缓存（backend/memory/query_cache.sqlite）：相同的查询在索引未变化时
+    # 直接复用命中的块 id，跳过 Embedding 请求和索引搜索；入库或重建索引后自动失效。
+    # 与 LLM 响应缓存一样默认关闭，缓存文件不计入 MEMORY_QUOTA_MB
+    RAG_QUERY_CACHE_ENABLED: bool = False
+
+    # 检索结果缓存最多保留的条目数，超出后按最近访问时间淘汰
+    RAG_QUERY_CACHE_MAX_ENTRIES: int = 50_000
+
+    # 多文档文库（backend/components/library.py）跨分片并行检索的线程数
+    LIBRARY_SEARCH_MAX_WORKERS: int = 8
+
+    # 文库的总向量数达到该阈值时，自动将各分片合并为一个近似索引（类型按 VECTOR_INDEX_TYPE 和向量数选择），
+    # 向量检索只需搜索一次；None 表示不自动合并
+    LIBRARY_CONSOLIDATE_THRESHOLD: Optional[int] = 200_000
+
+    # backend/memory 中向量库的磁盘配额（MB）：回收（python main.py memory gc 或 /api/memory/gc）时
+    # 超出配额则按最近访问时间删除最久未使用的库；None 表示不限制
+    MEMORY_QUOTA_MB: Optional[int] = 20_480
+
+    # 最近该时长（小时）内访问过的库不会被回收
+    MEMORY_GC_MIN_IDLE_HOURS: float = 24.0
+
+    # 压缩阈值：SQLite 空闲页占文件大小的比例达到该值时 VACUUM（FAISS 中有残留向量或索引类型落后时总会重建）
+    MEMORY_COMPACT_FREE_RATIO: float = 0.2
+
     # =================================================================
     # 报告生成模式配置
     # =================================================================
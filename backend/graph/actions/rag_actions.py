@@ -1,16 +1,22 @@
 from langchain_text_splitters import RecursiveCharacterTextSplitter, Language
 from backend.components.vector_store import DeepReaderVectorStore
-from typing import List, Dict, Any
+from backend.components.store_registry import get_store_registry
+from backend.components.retrieval_context import join_context, pack_context
+from typing import List, Dict, Any, Optional, Tuple
+from langchain_core.documents import Document
 from backend.prompts import REVIEWER_AGENT_PROMPT
-from backend.components.llm import call_fast_llm
+from backend.components.llm import call_structured_llm
+from backend.components.llm_errors import LLMError
+from backend.schemas import ReviewerAnswer
 import logging
-import json
-from json_repair import loads as json_repair_loads
 import asyncio
+import bisect
+import re
 import traceback
 import sys
 import signal
 import faulthandler
+from backend.config import deep_reader_config
 
 # 启用 faulthandler 来捕获 segmentation fault 的详细信息
 faulthandler.enable()
@@ -26,34 +32,133 @@ def _segfault_handler(signum, frame):
 # 注册信号处理器
 signal.signal(signal.SIGSEGV, _segfault_handler)
 
+# Markdown 标题行，用于给每个块标注所属章节
+_HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+?)\s*#*\s*$", re.MULTILINE)
+
+def _section_locator(markdown_content: str):
+    """返回一个函数：给定原文中的位置，返回该位置之前最近的 Markdown 标题（位置未知时为 None）"""
+    headings = [(m.start(), m.group(1)) for m in _HEADING_PATTERN.finditer(markdown_content)]
+    heading_starts = [start for start, _ in headings]
+
+    def section_at(position: int) -> Optional[str]:
+        if position < 0:
+            return None
+        index = bisect.bisect_right(heading_starts, position) - 1
+        return headings[index][1] if index >= 0 else None
+
+    return section_at
+
 def chunk_document(markdown_content: str, source_id: str) -> List[Dict[str, Any]]:
     """
     使用 RecursiveCharacterTextSplitter 将 Markdown 文档分块。
+    每个块的元数据包含 source_id、chunk_index、在原文中的起始位置 start_index
+    以及所属章节 section（块起始位置之前最近的 Markdown 标题），可用于按章节过滤检索。
     """
-    # 设定一个合理的块大小和重叠
+    # 块大小和重叠由配置决定（同时参与 RAG 缓存键的计算）
     text_splitter = RecursiveCharacterTextSplitter.from_language(
         language=Language.MARKDOWN,
-        chunk_size=1000,
-        chunk_overlap=200, # 稍微减小重叠以获得更好的上下文连续性
+        chunk_size=deep_reader_config.RAG_CHUNK_SIZE,
+        chunk_overlap=deep_reader_config.RAG_CHUNK_OVERLAP,
     )
     
     chunks = text_splitter.split_text(markdown_content)
+
+    section_at = _section_locator(markdown_content)
     
     # 为每个块附上元数据
     chunk_objects = []
+    search_from = 0
     for i, chunk in enumerate(chunks):
+        # 块按顺序产生且相邻块最多重叠 chunk_overlap 个字符，从上一块之后附近开始查找即可
+        start_index = markdown_content.find(chunk, max(0, search_from - deep_reader_config.RAG_CHUNK_OVERLAP * 2))
+        if start_index < 0:
+            start_index = markdown_content.find(chunk)
+        if start_index >= 0:
+            search_from = start_index + len(chunk)
         chunk_objects.append({
             "content": chunk,
             "metadata": {
                 "source_id": source_id,
-                "chunk_index": i
+                "chunk_index": i,
+                "start_index": start_index if start_index >= 0 else None,
+                "section": section_at(start_index),
             }
         })
     return chunk_objects
 
-def persist_chunks(chunk_objects: List[Dict[str, Any]], db_name: str = None, db_path: str = None):
+def chunk_document_parent_child(markdown_content: str, source_id: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     """
-    将分块后的文档持久化到 RAG 数据库。
+    两级、无重叠地分块：先按 Markdown 结构（标题、段落）切出不超过 RAG_PARENT_CHUNK_SIZE 字符的父窗口，
+    再将每个父窗口切成不超过 RAG_CHILD_CHUNK_SIZE 字符的子块，子块不跨越父窗口边界。
+
+    Returns:
+        (子块列表, 父窗口列表)。子块与 chunk_document 的输出格式相同，元数据额外带有 parent_index，
+        用于向量化和检索；父窗口的元数据为 source_id、parent_index、start_index、section，
+        通过 DeepReaderVectorStore.add_parents 保存，检索时替换命中的子块作为上下文。
+    """
+    parent_splitter = RecursiveCharacterTextSplitter.from_language(
+        language=Language.MARKDOWN,
+        chunk_size=deep_reader_config.RAG_PARENT_CHUNK_SIZE,
+        chunk_overlap=0,
+    )
+    child_splitter = RecursiveCharacterTextSplitter.from_language(
+        language=Language.MARKDOWN,
+        chunk_size=deep_reader_config.RAG_CHILD_CHUNK_SIZE,
+        chunk_overlap=0,
+    )
+    section_at = _section_locator(markdown_content)
+
+    parents = []
+    children = []
+    search_from = 0
+    for parent_index, parent in enumerate(parent_splitter.split_text(markdown_content)):
+        parent_start = markdown_content.find(parent, search_from)
+        if parent_start < 0:
+            parent_start = markdown_content.find(parent)
+        if parent_start >= 0:
+            search_from = parent_start + len(parent)
+        parents.append({
+            "content": parent,
+            "metadata": {
+                "source_id": source_id,
+                "parent_index": parent_index,
+                "start_index": parent_start if parent_start >= 0 else None,
+                "section": section_at(parent_start),
+            }
+        })
+
+        offset = 0
+        for child in child_splitter.split_text(parent):
+            child_offset = parent.find(child, offset)
+            if child_offset >= 0:
+                offset = child_offset + len(child)
+            child_start = parent_start + child_offset if parent_start >= 0 and child_offset >= 0 else -1
+            children.append({
+                "content": child,
+                "metadata": {
+                    "source_id": source_id,
+                    "chunk_index": len(children),
+                    "start_index": child_start if child_start >= 0 else None,
+                    "section": section_at(child_start),
+                    "parent_index": parent_index,
+                }
+            })
+    return children, parents
+
+def split_document(markdown_content: str, source_id: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """按配置 RAG_CHUNKING 分块，返回 (向量化的块, 父窗口)；平铺分块时父窗口为空列表"""
+    if deep_reader_config.RAG_CHUNKING == "parent_child":
+        return chunk_document_parent_child(markdown_content, source_id)
+    return chunk_document(markdown_content, source_id), []
+
+def persist_chunks(
+    chunk_objects: List[Dict[str, Any]],
+    db_name: str = None,
+    db_path: str = None,
+    parents: Optional[List[Dict[str, Any]]] = None,
+):
+    """
+    将分块后的文档持久化到 RAG 数据库。parents 为父子分块的父窗口，在子块之前写入。
     """
     if not chunk_objects:
         print("没有可持久化的块。")
@@ -65,28 +170,63 @@ def persist_chunks(chunk_objects: List[Dict[str, Any]], db_name: str = None, db_
     contents = [obj['content'] for obj in chunk_objects]
     metadatas = [obj['metadata'] for obj in chunk_objects]
     
-    vector_store.add_texts(texts=contents, metadatas=metadatas)
+    try:
+        if parents:
+            vector_store.add_parents(parents)
+        # 可续传模式：每批提交后记录高水位，失败后重试会从断点继续
+        vector_store.add_texts(texts=contents, metadatas=metadatas, resumable=True)
+    finally:
+        vector_store.close()
+        # 写入后使池中的旧实例失效，后续检索会重新加载最新索引
+        get_store_registry().invalidate(db_name=db_name, db_path=db_path)
+
+async def apersist_chunks(
+    chunk_objects: List[Dict[str, Any]],
+    db_name: str = None,
+    db_path: str = None,
+    parents: Optional[List[Dict[str, Any]]] = None,
+):
+    """
+    persist_chunks 的异步版本：多个向量化批次并发请求，并对 API 限流自适应退避。
+    """
+    if not chunk_objects:
+        print("没有可持久化的块。")
+        return
+
+    vector_store = await asyncio.to_thread(DeepReaderVectorStore, db_name=db_name, db_path=db_path)
+
+    contents = [obj['content'] for obj in chunk_objects]
+    metadatas = [obj['metadata'] for obj in chunk_objects]
+
+    try:
+        if parents:
+            await asyncio.to_thread(vector_store.add_parents, parents)
+        # 可续传模式：每批提交后记录高水位，失败后重试会从断点继续
+        await vector_store.aadd_texts(texts=contents, metadatas=metadatas, resumable=True)
+    finally:
+        vector_store.close()
+        # 写入后使池中的旧实例失效，后续检索会重新加载最新索引
+        get_store_registry().invalidate(db_name=db_name, db_path=db_path)
 
 async def _answer_single_question(
     question: str, 
-    vector_store: DeepReaderVectorStore, 
+    retrieved_docs: List[Document], 
     user_question: str,
-    question_index: int = 0
+    question_index: int = 0,
+    neighbors: Optional[List[Document]] = None
 ) -> Dict[str, Any]:
     """
-    (内部函数) 异步处理单个问题。
+    (内部函数) 异步处理单个问题。检索已由调用方批量完成，这里只负责装配上下文并调用 LLM 作答。
     """
     try:
-        # 1. 在全书范围内检索相关片段
-        logging.debug(f"[Q{question_index}] 开始 similarity_search: {question[:30]}...")
+        # 1. 在 token 预算内按得分装配调用方批量检索到的全书相关片段（必要时补充相邻块）
+        retrieved_docs = pack_context(
+            retrieved_docs, deep_reader_config.RAG_REVIEWER_CONTEXT_TOKENS, neighbors or ()
+        )
+        logging.debug(f"[Q{question_index}] 使用 {len(retrieved_docs)} 个检索片段回答: {question[:30]}...")
         sys.stdout.flush()  # 强制刷新输出
         
-        retrieved_docs = vector_store.similarity_search(question, k=10)
-        
-        logging.debug(f"[Q{question_index}] similarity_search 完成，获取 {len(retrieved_docs)} 个文档")
-        sys.stdout.flush()
-        
-        context = "\\n\\n---\\n\\n".join([doc.page_content for doc in retrieved_docs])
+        context = join_context(retrieved_docs)
 
         # 2. 将上下文和问题喂给 LLM
         prompt = REVIEWER_AGENT_PROMPT.format(
@@ -95,35 +235,23 @@ async def _answer_single_question(
             user_question=user_question
         )
         
-        for attempt in range(3):
-            logging.info(f"[Q{question_index}] ReviewerAgent 回答问题 (尝试 {attempt + 1}/3): {question[:50]}...")
-            sys.stdout.flush()
-            
-            response_json_str = await call_fast_llm(prompt)
-            
-            # 3. 解析 LLM 返回的 JSON
-            try:
-                if response_json_str.strip().startswith("```json"):
-                    response_json_str = response_json_str.strip()[7:-3].strip()
-                
-                parsed_obj = json_repair_loads(response_json_str)
-
-                if not isinstance(parsed_obj, dict) or not all(k in parsed_obj for k in ["question", "content_retrieve_answer"]):
-                        raise ValueError("ReviewerAgent 返回的 JSON 对象缺少必需的键。")
-
-                logging.debug(f"[Q{question_index}] 问题回答完成")
-                return parsed_obj # 成功解析并验证后，返回结果
-            except (json.JSONDecodeError, ValueError) as e:
-                logging.warning(f"ReviewerAgent JSON 解析失败 (尝试 {attempt + 1}/3): {e}\\n原始响应: {response_json_str}")
-                if attempt == 2: # 最后一次尝试失败
-                    logging.error(f"ReviewerAgent 对问题 '{question[:50]}...' 的回答在所有重试后解析失败: {e}")
-                    return {
-                        "question": question,
-                        "content_retrieve_answer": f"Error parsing answer after retries: {e}",
-                        "error": str(e)
-                    }
-        # 理论上不会执行到这里
-        return {"question": question, "content_retrieve_answer": "Unexpected error after retry loop.", "error": "Unexpected flow exit."}
+        logging.info(f"[Q{question_index}] ReviewerAgent 回答问题: {question[:50]}...")
+        sys.stdout.flush()
+        try:
+            answer = await call_structured_llm(prompt, ReviewerAnswer, tier="fast_llm")
+        except LLMError as e:
+            logging.error(f"ReviewerAgent 对问题 '{question[:50]}...' 未能得到有效的回答: {e}")
+            return {
+                "question": question,
+                "content_retrieve_answer": f"Error getting a valid answer: {e}",
+                "error": str(e)
+            }
+
+        parsed_obj = answer.model_dump()
+        # 模型漏填 question 时用原问题补全，不必为此重新请求
+        parsed_obj["question"] = parsed_obj["question"] or question
+        logging.debug(f"[Q{question_index}] 问题回答完成")
+        return parsed_obj
     
     except Exception as e:
         logging.critical(f"[Q{question_index}] !!! _answer_single_question 发生异常 !!!")
@@ -163,24 +291,46 @@ async def chat_with_retriever(
     sys.stdout.flush()
     
     try:
-        # 加载 RAG 存储
+        # 从注册表获取（复用）RAG 存储：检索只读，索引以内存映射方式加载，多个任务共享同一份页缓存
         logging.info(f"正在加载向量存储: {db_name}")
         sys.stdout.flush()
         
-        vector_store = DeepReaderVectorStore(db_name=db_name)
-        
-        logging.info(f"向量存储加载完成，FAISS 索引大小: {vector_store.index.ntotal}")
-        sys.stdout.flush()
-        
+        try:
+            async with get_store_registry().alease(db_name=db_name, read_only=True) as vector_store:
+                logging.info(f"向量存储加载完成，FAISS 索引大小: {vector_store.index.ntotal}")
+                sys.stdout.flush()
+
+                # 一次 embedding 请求 + 一次矩阵搜索，批量检索所有问题的相关片段（不阻塞事件循环）
+                retrieved_docs_list = await vector_store.asimilarity_search_batch(
+                    questions,
+                    k=10,
+                    search_type=deep_reader_config.RAG_SEARCH_TYPE,
+                    max_distance=deep_reader_config.RAG_MAX_DISTANCE,
+                )
+                # 父子分块的库：命中的子块替换为去重后的父窗口（一次 SQLite 查询）
+                retrieved_docs_list = await vector_store.aexpand_parents_batch(retrieved_docs_list)
+                # 一次 SQLite 查询取回所有命中块的相邻块，装配上下文时在预算内扩展命中片段
+                neighbors = []
+                if deep_reader_config.RAG_CONTEXT_NEIGHBOR_WINDOW > 0:
+                    neighbors = await vector_store.afetch_neighbors(
+                        [doc for docs in retrieved_docs_list for doc in docs],
+                        window=deep_reader_config.RAG_CONTEXT_NEIGHBOR_WINDOW,
+                    )
+        except FileNotFoundError as e:
+            # 文档尚未入库：与空库一样没有可用的检索片段，各问题在没有上下文的情况下作答
+            logging.warning(f"向量存储不存在，将在没有检索上下文的情况下回答: {e}")
+            retrieved_docs_list = [[] for _ in questions]
+            neighbors = []
+
         # 为每个问题创建一个异步任务（带索引用于调试）
         tasks = [
-            _answer_single_question(question, vector_store, user_question, i)
-            for i, question in enumerate(questions)
+            _answer_single_question(question, retrieved_docs, user_question, i, neighbors)
+            for i, (question, retrieved_docs) in enumerate(zip(questions, retrieved_docs_list))
         ]
-        
+
         logging.info(f"已创建 {len(tasks)} 个异步任务，开始并发执行...")
         sys.stdout.flush()
-        
+
         # 并发执行所有任务
         answers = await asyncio.gather(*tasks, return_exceptions=True)
         
@@ -206,7 +356,14 @@ async def chat_with_retriever(
         raise 
 
 
-async def retrieve_rag_context(query: str, db_name: str, k: int = 10) -> str:
+async def retrieve_rag_context(
+    query: str,
+    db_name: str,
+    k: int = 10,
+    search_type: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    filter: Optional[Dict[str, Any]] = None,
+) -> str:
     """
     直接从向量数据库中检索与查询相关的上下文片段。
 
@@ -217,23 +374,44 @@ async def retrieve_rag_context(query: str, db_name: str, k: int = 10) -> str:
         query: 用于检索的查询字符串 (例如章节标题和简介)。
         db_name: 数据库名称。
         k: 要检索的文档数量。
+        search_type: 'vector' / 'hybrid' / 'lexical'，默认使用配置 RAG_SEARCH_TYPE。
+        max_tokens: 上下文的 token 预算，默认使用配置 RAG_WRITER_CONTEXT_TOKENS。
+        filter: 元数据过滤条件（如 {"section": [...]}），只在相关章节中检索，格式见 DeepReaderVectorStore.similarity_search。
 
     Returns:
         一个包含所有检索到的片段内容的、用分隔符拼接起来的字符串。
     """
     logging.info(f"--- RAG Context Retrieval start, query: {query[:70]}... ---")
     try:
-        # 加载 RAG 存储
-        vector_store = DeepReaderVectorStore(db_name=db_name)
-
-        # 1. 在全书范围内检索相关片段
-        retrieved_docs = vector_store.similarity_search(query, k=k)
+        # 从注册表获取（复用）RAG 存储：检索只读，索引以内存映射方式加载，多个任务共享同一份页缓存
+        async with get_store_registry().alease(db_name=db_name, read_only=True) as vector_store:
+            # 1. 在全书范围内检索相关片段（异步，可与其他素材准备任务真正并行）
+            retrieved_docs = await vector_store.asimilarity_search(
+                query,
+                k=k,
+                search_type=search_type or deep_reader_config.RAG_SEARCH_TYPE,
+                max_distance=deep_reader_config.RAG_MAX_DISTANCE,
+                filter=filter,
+            )
+            retrieved_docs = (await vector_store.aexpand_parents_batch([retrieved_docs]))[0]
+            neighbors = []
+            if deep_reader_config.RAG_CONTEXT_NEIGHBOR_WINDOW > 0:
+                neighbors = await vector_store.afetch_neighbors(
+                    retrieved_docs, window=deep_reader_config.RAG_CONTEXT_NEIGHBOR_WINDOW
+                )
         
-        # 2. 拼接内容
-        context = "\\n\\n---\\n\\n".join([doc.page_content for doc in retrieved_docs])
+        # 2. 在 token 预算内按得分装配片段（合并相邻块、去重、补充相邻块）后拼接内容
+        retrieved_docs = pack_context(
+            retrieved_docs, max_tokens or deep_reader_config.RAG_WRITER_CONTEXT_TOKENS, neighbors
+        )
+        context = join_context(retrieved_docs)
         
-        logging.info(f"--- RAG Context Retrieval finished, retrieved {len(retrieved_docs)} chunks. ---")
+        logging.info(f"--- RAG Context Retrieval finished, packed {len(retrieved_docs)} passages. ---")
         return context
+    except FileNotFoundError as e:
+        # 文档尚未入库：与空库一样返回空上下文
+        logging.warning(f"RAG Context Retrieval: 向量存储不存在，返回空上下文: {e}")
+        return ""
     except Exception as e:
         logging.error(f"RAG Context Retrieval failed: {e}")
         return f"Error during RAG context retrieval: {e}" 
\ No newline at end of file
@@ -7,8 +7,6 @@
 """
 import logging
 from typing import Dict, Any, List
-import json
-from json_repair import loads as json_repair_loads
 
 from backend.read_state import DeepReaderState
 from backend.prompts import (
@@ -16,7 +14,9 @@ from backend.prompts import (
     SUMMARY_AGENT_PROMPT, 
     KEY_INFO_AGENT_PROMPT
 )
-from backend.components.llm import call_fast_llm, call_smart_llm
+from backend.components.llm import call_smart_llm, call_structured_llm
+from backend.components.llm_errors import LLMError
+from backend.schemas import KeyInfoOutput, ReadingAgentOutput
 from backend.config import deep_reader_config
 
 
@@ -55,39 +55,20 @@ async def reading_agent_action(
         max_questions=max_questions
     )
     
-    for attempt in range(3):
-        logging.info(f"--- ReadingAgent 分析片段 (尝试 {attempt + 1}/3) ---")
-        response_json_str = await call_fast_llm(prompt)
-        try:
-            # 清理并解析 LLM 返回的 JSON 字符串
-            if response_json_str.strip().startswith("```json"):
-                response_json_str = response_json_str.strip()[7:-3].strip()
-            
-            data = json_repair_loads(response_json_str)
-
-            # 新的验证逻辑：确保返回的是一个列表，且列表内元素结构正确
-            if not isinstance(data, list):
-                raise ValueError("LLM 返回的不是一个 JSON 列表。")
-            
-            for item in data:
-                if not isinstance(item, dict) or not all(k in item for k in ["title", "chapter_summary", "questions"]):
-                    raise ValueError("JSON 列表中的对象缺少 'title', 'chapter_summary', 或 'questions' 键。")
-                
-            logging.info("--- ReadingAgent 分析完成 ---")
-            return data
-        except (json.JSONDecodeError, ValueError) as e:
-            logging.warning(f"ReadingAgent JSON 解析或验证失败 (尝试 {attempt + 1}/3): {e}\\n原始响应: {response_json_str}")
-            if attempt == 2:
-                logging.error(f"ReadingAgent 在所有重试后仍然失败: {e}")
-                return [{
-                    "title": "Parsing Error",
-                    "chapter_summary": f"Failed to parse summary from LLM response after retries. Error: {e}",
-                    "questions": [],
-                    "error": str(e)
-                }]
-                
-    # 理论上不会执行到这里
-    return [{"title": "Unexpected Error", "chapter_summary": "An unexpected error occurred in reading_agent_action.", "questions": [], "error": "Unexpected flow exit."}]
+    logging.info("--- ReadingAgent 分析片段 ---")
+    try:
+        chapters = await call_structured_llm(prompt, ReadingAgentOutput, tier="fast_llm")
+    except LLMError as e:
+        logging.error(f"ReadingAgent 未能得到有效的分析结果: {e}")
+        return [{
+            "title": "Parsing Error",
+            "chapter_summary": f"Failed to get a valid analysis from LLM. Error: {e}",
+            "questions": [],
+            "error": str(e)
+        }]
+
+    logging.info("--- ReadingAgent 分析完成 ---")
+    return chapters.model_dump()
 
 
 async def summary_agent_action(
@@ -149,43 +130,27 @@ async def key_info_agent_action(
         last_data_item_context=last_data_item_context
     )
 
-    for attempt in range(3):
-        logging.info(f"--- KeyInfoAgent 提取信息 (尝试 {attempt + 1}/3) ---")
-        response_str = await call_fast_llm(prompt)
-
-        try:
-            if response_str.strip().startswith("```json"):
-                response_str = response_str.strip()[7:-3].strip()
-            
-            data = json_repair_loads(response_str)
-
-            # 检查是否为 "无有价值数据" 的特定JSON响应
-            if isinstance(data, list) and len(data) > 0 and data[0].get("data_name") == "无有价值数据":
-                logging.info("--- KeyInfoAgent 未在本片段发现有价值数据 (JSON格式) ---")
-                return []
-
-            if not isinstance(data, list):
-                raise ValueError("LLM 返回的不是一个 JSON 列表。")
-            
-            for item in data:
-                if not isinstance(item, dict) or not all(k in item for k in ["data_name", "description", "rawdata", "originfrom"]):
-                    raise ValueError("JSON 列表中的对象缺少 'data_name', 'description', 'rawdata', 或 'originfrom' 键。")
-                
-            logging.info("--- KeyInfoAgent 关键信息提取完成 ---")
-            return data
-        except (json.JSONDecodeError, ValueError) as e:
-            logging.warning(f"KeyInfoAgent JSON 解析或验证失败 (尝试 {attempt + 1}/3): {e}\\n原始响应: {response_str}")
-            if attempt == 2:
-                logging.error(f"KeyInfoAgent 在所有重试后仍然失败: {e}")
-                return [{
-                    "data_name": "Parsing Error",
-                    "description": f"Failed to parse key information from LLM response after retries. Error: {e}",
-                    "rawdata": {},
-                    "originfrom": "N/A",
-                    "error": str(e)
-                }]
-                
-    return [{"data_name": "Unexpected Error", "description": "An unexpected error occurred in key_info_agent_action.", "rawdata": {}, "originfrom": "N/A", "error": "Unexpected flow exit."}]
+    logging.info("--- KeyInfoAgent 提取信息 ---")
+    try:
+        items = await call_structured_llm(prompt, KeyInfoOutput, tier="fast_llm")
+    except LLMError as e:
+        logging.error(f"KeyInfoAgent 未能得到有效的提取结果: {e}")
+        return [{
+            "data_name": "Parsing Error",
+            "description": f"Failed to get valid key information from LLM. Error: {e}",
+            "rawdata": {},
+            "originfrom": "N/A",
+            "error": str(e)
+        }]
+
+    data = items.model_dump()
+    # 检查是否为 "无有价值数据" 的特定响应
+    if data and data[0].get("data_name") == "无有价值数据":
+        logging.info("--- KeyInfoAgent 未在本片段发现有价值数据 ---")
+        return []
+
+    logging.info("--- KeyInfoAgent 关键信息提取完成 ---")
+    return data
 
 
 # 后续将在此处添加具体的业务 action 函数，例如:
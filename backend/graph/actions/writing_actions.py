@@ -20,7 +20,9 @@ from backend.prompts import (
     SELECT_RELEVANT_SUMMARIES_PROMPT,
     SELECT_RELEVANT_KEY_INFO_PROMPT,
 )
-from backend.components.llm import call_smart_llm, call_writer_llm, call_fast_llm
+from backend.components.llm import call_smart_llm, call_fast_llm, call_structured_llm
+from backend.components.llm_errors import LLMError
+from backend.schemas import ReportOutline, SectionDraft, ThemeAnalysis
 # from utils.google_llm import call_google_llm
 from backend.graph.actions.rag_actions import chat_with_retriever
 from backend.config import deep_reader_config
@@ -277,7 +279,11 @@ async def analyze_narrative_flow_action(chapter_summaries: Dict[str, str]) -> st
     prompt = ANALYZE_NARRATIVE_FLOW_PROMPT.format(
         all_chapter_summaries=json.dumps(chapter_summaries, ensure_ascii=False, indent=2)
     )
-    narrative_outline = await call_smart_llm(prompt)
+    try:
+        narrative_outline = await call_smart_llm(prompt)
+    except LLMError as e:
+        logging.error(f"脉络分析师未能得到有效的叙事脉络: {e}")
+        return f"Error getting a valid narrative outline: {e}"
     logging.info(f"脉络分析师生成的内容: {narrative_outline}")
     logging.info("--- 脉络分析师完成工作 ---")
     return narrative_outline
@@ -311,27 +317,19 @@ async def extract_themes_action(
         feedback_section=feedback_section
     )
     
-    for attempt in range(3): # 重试3次
-        logging.info(f"--- 主题思想家提炼中 (尝试 {attempt + 1}/3) ---")
-        response_json_str = await call_smart_llm(prompt)
-        try:
-            themes = _robust_json_parser(response_json_str)
-            if not isinstance(themes, dict) or not all(k in themes for k in ["key_idea", "key_conclusion", "key_evidence"]):
-                raise ValueError("JSON object is missing required keys.")
-            logging.info("--- 主题思想家完成工作 ---")
-            return themes
-        except (json.JSONDecodeError, ValueError) as e:
-            logging.warning(f"主题思想家 JSON 解析失败 (尝试 {attempt + 1}/3): {e}\\n原始响应: {response_json_str}")
-            if attempt == 2: # 最后一次尝试失败
-                logging.error(f"主题思想家 JSON 解析在所有重试后失败: {e}")
-                return {
-                    "key_idea": f"Error parsing response after retries: {e}",
-                    "key_conclusion": "",
-                    "key_evidence": ""
-                }
-
-    # 如果循环结束仍未返回，则返回错误（理论上不会执行到这里）
-    return {"key_idea": "An unexpected error occurred in extract_themes_action.", "key_conclusion": "", "key_evidence": ""}
+    logging.info("--- 主题思想家提炼中 ---")
+    try:
+        themes = await call_structured_llm(prompt, ThemeAnalysis, tier="smart_llm")
+    except LLMError as e:
+        logging.error(f"主题思想家未能得到有效的提炼结果: {e}")
+        return {
+            "key_idea": f"Error getting a valid response: {e}",
+            "key_conclusion": "",
+            "key_evidence": ""
+        }
+
+    logging.info("--- 主题思想家完成工作 ---")
+    return themes.model_dump()
 
 
 async def critique_and_refine_action(
@@ -358,7 +356,12 @@ async def critique_and_refine_action(
         background_summary=background_summary,
         raw_reviewer_outputs=json.dumps(raw_reviewer_outputs, ensure_ascii=False, indent=2)
     )
-    feedback = await call_smart_llm(prompt)
+    try:
+        feedback = await call_smart_llm(prompt)
+    except LLMError as e:
+        # 本轮没有批判意见：主题思想家按无反馈重新提炼，辩论继续
+        logging.error(f"批判者未能得到有效的反馈: {e}")
+        return ""
     logging.info("--- 批判者完成工作 ---")
     return feedback
 
@@ -392,21 +395,15 @@ async def generate_final_outline_action(
         final_key_evidence=final_keys.get("key_evidence", ""),
         outline_constraints=outline_constraints
     )
-    for attempt in range(3):
-        logging.info(f"--- 总编辑生成大纲中 (尝试 {attempt + 1}/3) ---")
-        response_json_str = await call_writer_llm(prompt)
-        try:
-            final_outline = _robust_json_parser(response_json_str)
-            if not isinstance(final_outline, list):
-                 raise ValueError("LLM did not return a list for the outline.")
-            logging.info("--- 总编辑完成工作 ---")
-            return final_outline
-        except (json.JSONDecodeError, ValueError) as e:
-            logging.warning(f"总编辑 JSON 解析失败 (尝试 {attempt + 1}/3): {e}\\n原始响应: {response_json_str}")
-            if attempt == 2:
-                logging.error(f"总编辑 JSON 解析在所有重试后失败: {e}")
-                return [{"title": f"Error parsing outline after retries: {e}", "content_brief": "", "children": []}]
-    return [{"title": "An unexpected error occurred in generate_final_outline_action.", "content_brief": "", "children": []}]
+    logging.info("--- 总编辑生成大纲中 ---")
+    try:
+        final_outline = await call_structured_llm(prompt, ReportOutline, tier="writer_llm")
+    except LLMError as e:
+        logging.error(f"总编辑未能得到有效的大纲: {e}")
+        return [{"title": f"Error getting a valid outline: {e}", "content_brief": "", "children": []}]
+
+    logging.info("--- 总编辑完成工作 ---")
+    return final_outline.model_dump()
 
 
 async def write_section_action(
@@ -443,40 +440,19 @@ async def write_section_action(
         current_section_brief=current_section_brief
     )
     
-    for attempt in range(3):
-        logging.info(f"--- Writer 撰写章节: {current_section_title} (尝试 {attempt + 1}/3) ---")
-        response_json_str = await call_writer_llm(prompt)
-        try:
-            data = _robust_json_parser(response_json_str)
-            if not isinstance(data, dict) or not all(k in data for k in ["written_part", "part_summary"]):
-                raise ValueError("JSON object is missing 'written_part' or 'part_summary'.")
-            
-            written_part = data.get("written_part", [])
-            part_summary = data.get("part_summary", "")
+    logging.info(f"--- Writer 撰写章节: {current_section_title} ---")
+    try:
+        draft = await call_structured_llm(prompt, SectionDraft, tier="writer_llm")
+    except LLMError as e:
+        logging.error(f"Writer 未能得到有效的章节内容: {e}")
+        error_text = f"Error during generation of section '{current_section_title}': {e}"
+        return [error_text], error_text
 
-            if not isinstance(written_part, list):
-                 raise ValueError("'written_part' should be a list of strings (paragraphs).")
-            
-            # 对每个段落进行表格格式清理
-            cleaned_written_part = []
-            for paragraph in written_part:
-                if isinstance(paragraph, str):
-                    cleaned_paragraph = _clean_markdown_tables(paragraph)
-                    cleaned_written_part.append(cleaned_paragraph)
-                else:
-                    cleaned_written_part.append(paragraph)
-            
-            logging.info(f"--- Writer 完成撰写章节: {current_section_title} ---")
-            return cleaned_written_part, part_summary
-        except (json.JSONDecodeError, ValueError) as e:
-            logging.warning(f"Writer JSON 解析失败 (尝试 {attempt + 1}/3): {e}\\n原始响应: {response_json_str}")
-            if attempt == 2:
-                logging.error(f"Writer JSON 解析在所有重试后失败: {e}")
-                error_text = f"Error during generation of section '{current_section_title}' after retries: {e}"
-                return [error_text], error_text
-    
-    error_text = f"An unexpected error occurred in write_section_action for section '{current_section_title}'."
-    return [error_text], error_text
+    # 对每个段落进行表格格式清理
+    cleaned_written_part = [_clean_markdown_tables(paragraph) for paragraph in draft.written_part]
+
+    logging.info(f"--- Writer 完成撰写章节: {current_section_title} ---")
+    return cleaned_written_part, draft.part_summary
 
 
 async def select_and_retrieve_summaries_action(
@@ -500,7 +476,11 @@ async def select_and_retrieve_summaries_action(
 
     for attempt in range(3):
         logging.info(f"--- 为 '{current_section_title}' 动态筛选相关摘要 (尝试 {attempt + 1}/3) ---")
-        response_json_str = await call_fast_llm(prompt)
+        try:
+            response_json_str = await call_fast_llm(prompt)
+        except LLMError as e:
+            logging.error(f"筛选相关摘要时调用 LLM 失败: {e}")
+            return f"Error selecting summaries: {e}"
         try:
             # 使用增强的解析函数
             suggested_titles = _extract_titles_from_llm_response(response_json_str)
@@ -569,7 +549,11 @@ async def select_and_retrieve_key_info_action(
 
     for attempt in range(3):
         logging.info(f"--- 筛选关键信息 (尝试 {attempt + 1}/3) ---")
-        response_json_str = await call_smart_llm(prompt)
+        try:
+            response_json_str = await call_smart_llm(prompt)
+        except LLMError as e:
+            logging.error(f"筛选关键信息时调用 LLM 失败: {e}")
+            return f"Error selecting key information: {e}"
         try:
             # 使用增强的解析函数
             suggested_data_names = _extract_data_names_from_llm_response(response_json_str)
@@ -18,6 +18,7 @@ from backend.graph.actions.reading_knowledge_actions import (
     key_info_agent_action,
 )
 from ..actions.rag_actions import chat_with_retriever
+from backend.components.llm_errors import LLMError
 from thefuzz import fuzz
 
 def _get_full_content_and_mark_read(node: Dict[str, Any]) -> str:
@@ -182,7 +183,10 @@ async def iterative_reading_node(state: DeepReaderState) -> Dict[str, Any]:
     newly_generated_summaries = "\\n".join(filter(None, all_summaries))
     new_background_memory = background_memory # 默认继承
     if newly_generated_summaries:
-        new_background_memory = await summary_agent_action(newly_generated_summaries, all_answers_text)
+        try:
+            new_background_memory = await summary_agent_action(newly_generated_summaries, all_answers_text)
+        except LLMError as e:
+            logging.error(f"SummaryAgent 调用 LLM 失败，沿用原背景记忆: {e}")
 
     # --- 步骤 5: 更新状态 ---
     # A. 标记当前片段为已读
@@ -5,24 +5,26 @@
 @time: 2025-06-25 14:15
 @desc: 一个多功能的 LangGraph 节点，负责文档的完整预处理和持久化流程。
 """
+import asyncio
 import logging
 import os
-import hashlib
 from pathlib import Path
 from typing import Dict, Any
 
 from ..actions import rag_actions, docparsing_actions
+from ...components.document_cache import get_document_manifest
+from ...components.vector_store import DeepReaderVectorStore
 # from ..state import DeepReaderState  # 假设的状态对象，用于类型提示
 
 
 async def rag_persistence_node(state: Dict[str, Any]) -> Dict[str, Any]:
     """
     一个异步的 LangGraph 节点，负责执行以下一系列操作：
-    1. 检查基于文档路径哈希的缓存是否存在，如果存在则跳过。
+    1. 检查基于文档内容哈希（及分块/Embedding 参数）的缓存是否存在，如果存在则跳过。
     2. 如果缓存不存在，则根据输入路径智能解析文档（PDF, EPUB, URL）。
     3. 使用 LLM 从文档内容中提取元数据。
     4. 将解析后的文本内容分块。
-    5. 将分块持久化到以文档哈希命名的 RAG 向量数据库中。
+    5. 将分块持久化到以内容键命名的 RAG 向量数据库中。
     6. 返回所有产出，以更新图的核心状态。
     """
     logging.info("--- 进入增强型 RAG 持久化节点 ---")
@@ -32,8 +34,12 @@ async def rag_persistence_node(state: Dict[str, Any]) -> Dict[str, Any]:
         logging.error("错误: 在 state 中未找到 'document_path'。")
         return {"error": "Missing document_path in state"}
 
-    # 1. 生成基于路径哈希的唯一数据库名
-    db_name_hash = hashlib.md5(document_path.encode()).hexdigest()
+    # 1. 生成基于文件内容的唯一数据库名：同一文件换路径上传可复用，同一路径的文件被修改则重新构建
+    db_name_hash = await asyncio.to_thread(
+        get_document_manifest().resolve_content_key,
+        document_path,
+        state.get("raw_markdown_content"),
+    )
     # 基于当前文件路径计算 deepreader 根目录
     current_file = Path(__file__).resolve()
     deepreader_root = current_file.parent.parent.parent.parent  # backend/graph/nodes/../../../.. -> deepreader/
@@ -45,7 +51,8 @@ async def rag_persistence_node(state: Dict[str, Any]) -> Dict[str, Any]:
     faiss_path = db_base_path / f"{db_name_hash}.faiss"
     sqlite_path = db_base_path / f"{db_name_hash}.sqlite"
 
-    if faiss_path.exists() and sqlite_path.exists():
+    pending_ingest = DeepReaderVectorStore.has_pending_ingest(str(sqlite_path))
+    if faiss_path.exists() and sqlite_path.exists() and not pending_ingest:
         logging.info(f"发现文档 '{document_path}' 的现有数据库 '{db_name_hash}'。跳过处理。")
         return {
             "db_name": db_name_hash,
@@ -53,8 +60,11 @@ async def rag_persistence_node(state: Dict[str, Any]) -> Dict[str, Any]:
             "error": None
         }
 
-    # 3. 如果缓存不存在，执行完整流程
-    logging.info(f"未找到缓存，开始为 '{document_path}' 执行完整处理流程。")
+    # 3. 如果缓存不存在（或上次入库中断），执行完整流程；入库会从上次的高水位继续
+    if pending_ingest:
+        logging.info(f"数据库 '{db_name_hash}' 存在未完成的入库任务，将从断点继续。")
+    else:
+        logging.info(f"未找到缓存，开始为 '{document_path}' 执行完整处理流程。")
     try:
         # 3.1. 优先使用 state中的内容，否则路由解析，获取原始 Markdown
         raw_markdown_content = state.get("raw_markdown_content")
@@ -77,12 +87,15 @@ async def rag_persistence_node(state: Dict[str, Any]) -> Dict[str, Any]:
         else:
             logging.info("在 state 中发现现有元数据，将直接使用。")
 
-        # 3.3. 内容分块
-        chunks = rag_actions.chunk_document(raw_markdown_content, source_id=document_path)
-        logging.info(f"内容分块完成，共 {len(chunks)} 个块。")
+        # 3.3. 内容分块（父子分块时同时得到父窗口）
+        chunks, parents = rag_actions.split_document(raw_markdown_content, source_id=document_path)
+        if parents:
+            logging.info(f"内容分块完成，共 {len(parents)} 个父窗口、{len(chunks)} 个子块。")
+        else:
+            logging.info(f"内容分块完成，共 {len(chunks)} 个块。")
 
         # 3.4. 持久化分块，使用哈希作为 db_name
-        rag_actions.persist_chunks(chunk_objects=chunks, db_name=db_name_hash)
+        await rag_actions.apersist_chunks(chunk_objects=chunks, db_name=db_name_hash, parents=parents)
 
         # 3.5. 返回所有要更新到 state 的字段
         logging.info(f"--- RAG 持久化节点成功完成，新数据库: '{db_name_hash}' ---")
@@ -413,3 +413,29 @@ Example output:
   "市场预期数据"
 ]
 """
+
+
+# --------------------------------------------------------------------------------
+# Structured Output Repair Prompt (结构化输出修正)
+# --------------------------------------------------------------------------------
+
+STRUCTURED_OUTPUT_REPAIR_PROMPT = """
+Your previous output below does not conform to the required JSON Schema. Your task is to fix it.
+
+**Instructions:**
+1.  Fix ONLY the problems listed under "Validation Errors" (missing fields, wrong types, broken JSON syntax).
+2.  Keep all existing content unchanged: do not rewrite, summarize, translate, or add new information. If a required field is missing, fill it using only information already present in the output.
+3.  If the output is a JSON array, return an array with exactly the same number of elements, in the same order.
+
+**JSON Schema:**
+{schema}
+
+**Validation Errors:**
+{errors}
+
+**Output to Fix:**
+{content}
+
+**Output Format:**
+You MUST respond with the corrected JSON only. Do NOT include any text outside of the JSON.
+"""
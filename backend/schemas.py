@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: schemas.py
+@time: 2025-12-09
+@desc: 各 Agent 结构化输出的 Pydantic Schema，供 call_structured_llm 约束模型输出并在本地校验
+"""
+from typing import Any, List
+
+from pydantic import BaseModel, ConfigDict, Field, RootModel, field_validator
+
+
+def _as_list(value: Any) -> Any:
+    """模型偶尔把单个字符串当作列表返回，或者用 null 表示空列表"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return value
+
+
+class AgentOutputModel(BaseModel):
+    """
+    各 Agent 输出对象的基类：保留模型额外返回的字段（model_dump 时原样输出），
+    下游的状态和报告与直接使用解析出的 JSON 时一致
+    """
+    model_config = ConfigDict(extra="allow")
+
+
+# --------------------------------------------------------------------------------
+# Phase 1: Iterative Reading (迭代式阅读阶段)
+# --------------------------------------------------------------------------------
+
+class ChapterAnalysis(AgentOutputModel):
+    """ReadingAgent 对片段中一个章节的分析"""
+    title: str = Field(description="章节标题")
+    chapter_summary: str = Field(description="章节内容、逻辑、关键论点与证据的详细总结")
+    questions: List[str] = Field(default_factory=list, description="针对该章节的深度问题")
+
+    @field_validator("questions", mode="before")
+    @classmethod
+    def normalize_questions(cls, value: Any) -> Any:
+        return _as_list(value)
+
+
+class ReadingAgentOutput(RootModel[List[ChapterAnalysis]]):
+    """READING_AGENT_PROMPT 的输出：片段中识别出的章节列表"""
+
+
+class KeyInfoItem(AgentOutputModel):
+    """KeyInfoAgent 提取的一条关键数据或论断"""
+    data_name: str = Field(description="该数据或论断的简明标题")
+    description: str = Field(description="该数据或论断与核心问题相关的意义")
+    rawdata: Any = Field(default_factory=dict, description="原始数据，如键值对或表格行")
+    originfrom: str = Field(default="", description="数据来源的章节标题")
+
+
+class KeyInfoOutput(RootModel[List[KeyInfoItem]]):
+    """KEY_INFO_AGENT_PROMPT 的输出"""
+
+
+class ReviewerAnswer(AgentOutputModel):
+    """ReviewerAgent 基于检索上下文的回答"""
+    question: str = Field(default="", description="被回答的问题")
+    content_retrieve_answer: str = Field(description="严格基于检索上下文的回答")
+
+
+# --------------------------------------------------------------------------------
+# Phase 2: Report Generation (写作研讨会阶段)
+# --------------------------------------------------------------------------------
+
+class ThemeAnalysis(AgentOutputModel):
+    """主题思想家提炼的核心思想"""
+    key_idea: str
+    key_conclusion: str
+    key_evidence: str
+
+
+class OutlineSubsection(AgentOutputModel):
+    title: str
+    content_brief: str = ""
+
+
+class OutlineSection(AgentOutputModel):
+    title: str
+    content_brief: str = ""
+    children: List[OutlineSubsection] = Field(default_factory=list)
+
+    @field_validator("children", mode="before")
+    @classmethod
+    def normalize_children(cls, value: Any) -> Any:
+        return _as_list(value)
+
+
+class ReportOutline(RootModel[List[OutlineSection]]):
+    """GENERATE_FINAL_OUTLINE_PROMPT 的输出：两级报告大纲"""
+
+
+class SectionDraft(AgentOutputModel):
+    """Writer 撰写的一个报告章节"""
+    written_part: List[str] = Field(description="章节正文，每个字符串为一个段落")
+    part_summary: str = Field(description="本章节内容的一段式总结，供下一章节参考")
+
+    @field_validator("written_part", mode="before")
+    @classmethod
+    def normalize_written_part(cls, value: Any) -> Any:
+        return _as_list(value)
@@ -14,7 +14,8 @@ import sys
 import hashlib
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Any
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
 import aiofiles
 
 from fastapi import (
@@ -47,6 +48,9 @@ if str(deepreader_root) not in sys.path:
 # 导入DeepReader模块 - 移到环境设置之后
 from backend.read_graph import create_deepreader_graph
 from backend.read_state import DeepReaderState
+from backend.components.memory_manager import get_memory_manager
+from backend.components.llm_scheduler import get_llm_scheduler
+from backend.components.google_llm import close_google_client
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
 # 配置
@@ -67,8 +71,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 应用关闭时释放复用的 Google GenAI 客户端连接池
+    await close_google_client()
+
+
 # 创建FastAPI应用
-app = FastAPI(title="DeepReader API", version="1.0.0")
+app = FastAPI(title="DeepReader API", version="1.0.0", lifespan=lifespan)
 
 # 添加CORS中间件
 app.add_middleware(
@@ -508,6 +519,36 @@ async def get_results(task_id: str):
     # 这里可以实现结果查询逻辑
     return {"message": "结果查询接口"}
 
+@app.get("/api/memory/stats")
+async def memory_stats():
+    """backend/memory 中各向量库的磁盘占用、向量数和最近访问时间"""
+    return await asyncio.to_thread(get_memory_manager().stats)
+
+@app.post("/api/memory/gc")
+async def memory_gc(
+    quota_mb: Optional[int] = None,
+    min_idle_hours: Optional[float] = None,
+    dry_run: bool = False,
+    compact: bool = False
+):
+    """超出配额时按最近访问时间回收向量库，compact=true 时同时压缩剩余的库"""
+    try:
+        return await asyncio.to_thread(
+            get_memory_manager().gc,
+            quota_mb=quota_mb,
+            min_idle_hours=min_idle_hours,
+            dry_run=dry_run,
+            compact=compact,
+        )
+    except Exception as e:
+        logger.error(f"回收向量库失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/llm/scheduler")
+async def llm_scheduler_stats():
+    """各层级 LLM 调用的并发、排队数量和排队等待时间"""
+    return get_llm_scheduler().stats()
+
 # 静态文件服务
 frontend_dir = Path(__file__).parent / "static"
 if frontend_dir.exists():
@@ -57,6 +57,7 @@ setup_environment()
 from backend.read_graph import create_deepreader_graph
 from backend.read_state import DeepReaderState
 from backend.components.token_counter import get_token_counter
+from backend.components.google_llm import close_google_client
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
 # --- 3. 定义常量 ---
@@ -724,9 +725,22 @@ async def main():
     else:
         print("未获取到最终状态，无法保存结果。")
 
+async def run_main():
+    try:
+        await main()
+    finally:
+        # 关闭复用的 Google GenAI 客户端的连接池
+        await close_google_client()
+
+
 if __name__ == "__main__":
+    # 子命令: python main.py memory stats|gc|compact，管理 backend/memory 中的向量库
+    if len(sys.argv) > 1 and sys.argv[1] == "memory":
+        from backend.components.memory_manager import main as memory_main
+        memory_main(sys.argv[2:])
+        sys.exit(0)
     try:
-        asyncio.run(main())
+        asyncio.run(run_main())
     except KeyboardInterrupt:
         print("\\n🛑 用户中断了程序。")
         sys.exit(0)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: conftest.py
+@time: 2025-12-10
+@desc: 离线测试的公共夹具：使用 'hashing' Embedding 后端（不依赖网络和模型文件），
+       关闭写入 backend/memory 的持久化缓存，访问记录写到临时目录
+"""
+import pytest
+
+from backend.components import store_access
+from backend.config import deep_reader_config
+
+
+@pytest.fixture(autouse=True)
+def offline_config(monkeypatch, tmp_path):
+    monkeypatch.setattr(deep_reader_config, "EMBEDDING_PROVIDER", "hashing")
+    monkeypatch.setattr(deep_reader_config, "EMBEDDING_CACHE_ENABLED", False)
+    monkeypatch.setattr(deep_reader_config, "RAG_QUERY_CACHE_ENABLED", False)
+    monkeypatch.setattr(deep_reader_config, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(store_access, "_global_access_log", store_access.StoreAccessLog(str(tmp_path / "store_access.sqlite")))
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    """向量库文件的路径前缀（不带扩展名）"""
+    return str(tmp_path / "store")
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_embedding_cache.py
+@time: 2025-12-10
+@desc: 持久化 Embedding 缓存的测试：按命名空间隔离、只向量化未命中的文本、按最近访问时间淘汰
+"""
+import pytest
+
+from backend.components import embedding_cache
+from backend.components.embedding_cache import CachedEmbeddings, EmbeddingCache
+from backend.components.embedding_provider import HashingEmbeddings
+
+
+class Clock:
+    """可控的 time 模块替身，每次读取时间递增 1 秒"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    def __init__(self):
+        super().__init__(16)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.append(list(texts))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.embedded.append([text])
+        return super().embed_query(text)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "time", Clock())
+    return EmbeddingCache(db_path=str(tmp_path / "embedding_cache.sqlite"), max_entries=10)
+
+
+def test_get_many_returns_hits_in_order_and_isolates_namespaces(cache):
+    cache.put_many("model-a", ["x", "y"], [[1.0, 2.0], [3.0, 4.0]])
+    assert cache.get_many("model-a", ["y", "z", "x"]) == [[3.0, 4.0], None, [1.0, 2.0]]
+    assert cache.get_many("model-b", ["x"]) == [None]
+
+
+def test_cached_embeddings_only_embeds_misses(cache):
+    underlying = CountingEmbeddings()
+    embeddings = CachedEmbeddings(underlying, cache, namespace="hashing:16")
+    first = embeddings.embed_documents(["a", "b", "a"])
+    second = embeddings.embed_documents(["b", "c"])
+    assert underlying.embedded == [["a", "b"], ["c"]]
+    assert second[0] == first[1]
+    assert embeddings.embed_query("c") == second[1]
+    assert len(underlying.embedded) == 2
+
+
+@pytest.mark.asyncio
+async def test_async_path_shares_the_cache(cache):
+    underlying = CountingEmbeddings()
+    embeddings = CachedEmbeddings(underlying, cache, namespace="hashing:16")
+    vectors = await embeddings.aembed_documents(["a", "b"])
+    assert await embeddings.aembed_query("b") == vectors[1]
+    assert underlying.embedded == [["a", "b"]]
+
+
+def test_eviction_drops_least_recently_used_entries(cache):
+    texts = [f"t{i}" for i in range(10)]
+    cache.put_many("m", texts, [[float(i)] for i in range(10)])
+    # 访问 t0 使其成为最近使用的条目
+    assert cache.get_many("m", ["t0"]) == [[0.0]]
+    cache.put_many("m", ["new"], [[99.0]])
+    # 超出容量后淘汰到 90%：最久未访问的 t1、t2 被删除
+    remaining = cache.get_many("m", texts + ["new"])
+    assert [text for text, vector in zip(texts + ["new"], remaining) if vector is None] == ["t1", "t2"]
+
+
+def test_cache_persists_across_instances(cache):
+    cache.put_many("m", ["x"], [[0.5]])
+    reopened = EmbeddingCache(db_path=cache.db_path, max_entries=10)
+    assert reopened.get_many("m", ["x"]) == [[0.5]]
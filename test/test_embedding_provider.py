@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_embedding_provider.py
+@time: 2025-12-10
+@desc: 可插拔 Embedding 后端的测试：打开已有的库不查询模型原生维度，本地模型延迟到第一次向量化时加载
+"""
+import pytest
+
+from backend.components import embedding_provider
+from backend.components.embedding_provider import HashingEmbeddingProvider, LocalEmbeddingProvider
+from backend.components.vector_store import DeepReaderVectorStore
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError("不应加载模型")
+
+
+def test_existing_store_opens_without_native_dimension(store_path, monkeypatch):
+    store = DeepReaderVectorStore(db_path=store_path)
+    store.add_texts(["公司营收同比增长", "毛利率提升"])
+    dimension = store.dimension
+    store.close()
+
+    monkeypatch.setattr(HashingEmbeddingProvider, "native_dimension", _fail)
+    for read_only in (False, True):
+        reopened = DeepReaderVectorStore(db_path=store_path, read_only=read_only)
+        assert reopened.dimension == dimension
+        assert reopened.lexical_search("营收", k=1)
+        reopened.close()
+
+
+def test_local_provider_loads_model_on_first_embedding(monkeypatch):
+    monkeypatch.setattr(embedding_provider, "_load_local_model", _fail)
+    provider = LocalEmbeddingProvider("some-model", backend="torch")
+    embeddings = provider.create(256)
+    assert provider.cache_namespace(256) == "local:some-model@256"
+    with pytest.raises(AssertionError):
+        embeddings.embed_query("text")
+
+
+def test_incomplete_provider_fails_at_construction():
+    class NoCreateProvider(embedding_provider.EmbeddingProvider):
+        name = "incomplete"
+
+        def native_dimension(self) -> int:
+            return 8
+
+    with pytest.raises(TypeError):
+        NoCreateProvider("model")
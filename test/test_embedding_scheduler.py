@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_embedding_scheduler.py
+@time: 2025-12-10
+@desc: 入库向量化调度的测试：按 token 切分批次、乱序完成时按顺序提交、429 时降低并发并退避重试、失败时取消其余请求
+"""
+import asyncio
+
+import pytest
+
+from backend.components import embedding_scheduler
+from backend.components.embedding_scheduler import EmbeddingBatchScheduler, plan_token_batches
+
+
+class RateLimitError(Exception):
+    """与 openai SDK 同名的 429 异常"""
+
+
+def test_plan_token_batches_respects_token_and_item_limits():
+    assert plan_token_batches([3, 3, 3, 3], max_tokens=6, max_items=10) == [(0, 2), (2, 4)]
+    assert plan_token_batches([1, 1, 1], max_tokens=100, max_items=2) == [(0, 2), (2, 3)]
+    # 单条超过上限时独占一个批次；offset 用于续传
+    assert plan_token_batches([2, 50, 2], max_tokens=10, max_items=10, offset=5) == [(5, 6), (6, 7), (7, 8)]
+    assert plan_token_batches([], max_tokens=10, max_items=10) == []
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(embedding_scheduler.asyncio, "sleep", sleep)
+    return delays
+
+
+@pytest.mark.asyncio
+async def test_batches_commit_in_order_when_finishing_out_of_order():
+    batches = [(i, i + 1) for i in range(6)]
+    committed = []
+
+    async def embed(start, end):
+        # 靠前的批次完成得更晚
+        await asyncio.sleep(0.001 * (len(batches) - start))
+        return [[float(start)]]
+
+    async def on_batch(index, batch, vectors):
+        committed.append((index, batch, vectors))
+
+    await EmbeddingBatchScheduler(max_concurrency=3).run(batches, embed, on_batch)
+    assert committed == [(i, (i, i + 1), [[float(i)]]) for i in range(6)]
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_halves_concurrency_and_retries(no_sleep):
+    attempts = {}
+
+    async def embed(start, end):
+        attempts[start] = attempts.get(start, 0) + 1
+        if start == 0 and attempts[start] <= 2:
+            raise RateLimitError("429 Too Many Requests")
+        return [[0.0]]
+
+    committed = []
+
+    async def on_batch(index, batch, vectors):
+        committed.append(index)
+
+    scheduler = EmbeddingBatchScheduler(max_concurrency=4, max_retries=3, base_delay=1.0)
+    await scheduler.run([(0, 1)], embed, on_batch)
+    assert attempts[0] == 3
+    assert committed == [0]
+    # 两次限流 4 -> 2 -> 1，随后的一次成功恢复到 2
+    assert scheduler.concurrency == 2
+    # 指数退避（带 ±50% 抖动）
+    assert 0.5 <= no_sleep[0] <= 1.5 and 1.0 <= no_sleep[1] <= 3.0
+
+
+@pytest.mark.asyncio
+async def test_concurrency_recovers_after_successes():
+    scheduler = EmbeddingBatchScheduler(max_concurrency=4)
+    scheduler._on_rate_limited()
+    scheduler._on_rate_limited()
+    assert scheduler.concurrency == 1
+    scheduler._on_success()
+    assert scheduler.concurrency == 2
+    for _ in range(2):
+        scheduler._on_success()
+    assert scheduler.concurrency == 3
+
+
+@pytest.mark.asyncio
+async def test_non_rate_limit_error_is_raised_and_cancels_remaining(no_sleep):
+    started = []
+
+    async def embed(start, end):
+        started.append(start)
+        if start == 1:
+            raise ValueError("bad request")
+        await asyncio.Event().wait()
+
+    async def on_batch(index, batch, vectors):
+        raise AssertionError("不应提交任何批次")
+
+    with pytest.raises(ValueError):
+        await EmbeddingBatchScheduler(max_concurrency=2).run([(0, 1), (1, 2), (2, 3)], embed, on_batch)
+    assert no_sleep == []
+    assert 2 not in started
+
+
+@pytest.mark.asyncio
+async def test_retries_give_up_after_max_retries(no_sleep):
+    async def embed(start, end):
+        raise RateLimitError("429")
+
+    async def on_batch(index, batch, vectors):
+        pass
+
+    with pytest.raises(RateLimitError):
+        await EmbeddingBatchScheduler(max_concurrency=1, max_retries=2).run([(0, 1)], embed, on_batch)
+    assert len(no_sleep) == 2
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_google_llm.py
+@time: 2025-12-10
+@desc: Google GenAI 客户端复用的测试：按事件循环各一个客户端、关闭时释放连接池、清理已结束事件循环的客户端
+"""
+import asyncio
+
+import pytest
+
+from backend.components import google_llm
+
+
+class FakeAsyncHttpx:
+    def __init__(self):
+        self.closed = False
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeHttpx:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeApiClient:
+    def __init__(self):
+        self._httpx_client = FakeHttpx()
+        self._async_httpx_client = FakeAsyncHttpx()
+
+
+class FakeClient:
+    """模拟没有公开 close 方法的 SDK 版本（google-genai 1.20）"""
+
+    def __init__(self):
+        self._api_client = FakeApiClient()
+
+
+class BareClient:
+    """模拟内部属性已改名的 SDK 版本：关闭时不应抛出 AttributeError"""
+
+
+@pytest.fixture
+def fake_clients(monkeypatch):
+    monkeypatch.setattr(google_llm, "_create_client", FakeClient)
+    monkeypatch.setattr(google_llm, "_clients", google_llm.weakref.WeakKeyDictionary())
+
+
+@pytest.mark.asyncio
+async def test_client_is_reused_and_closed_per_loop(fake_clients):
+    client = google_llm.get_google_client()
+    assert google_llm.get_google_client() is client
+    await google_llm.close_google_client()
+    assert client._api_client._async_httpx_client.closed and client._api_client._httpx_client.closed
+    assert google_llm.get_google_client() is not client
+
+
+def test_clients_of_closed_loops_are_discarded(fake_clients):
+    async def get():
+        return google_llm.get_google_client()
+
+    loop = asyncio.new_event_loop()
+    first = loop.run_until_complete(get())
+    loop.close()
+    second = asyncio.run(get())
+    assert second is not first
+    assert first._api_client._httpx_client.closed
+    assert loop not in google_llm._clients
+
+
+@pytest.mark.asyncio
+async def test_close_tolerates_clients_without_private_attributes(monkeypatch, fake_clients):
+    monkeypatch.setattr(google_llm, "_create_client", BareClient)
+    google_llm.get_google_client()
+    await google_llm.close_google_client()
+    assert asyncio.get_running_loop() not in google_llm._clients
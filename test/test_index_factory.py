@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_index_factory.py
+@time: 2025-12-10
+@desc: FAISS 索引工厂的测试：按向量数选择索引类型、各类型的构建 / 取回 / 删除 / 子集检索，以及入库完成后的自动重建
+"""
+import numpy as np
+import pytest
+
+from backend.components import index_factory
+from backend.components.vector_store import DeepReaderVectorStore
+from backend.config import deep_reader_config
+
+DIMENSION = 16
+
+
+def _vectors(n, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, DIMENSION)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def thresholds(monkeypatch):
+    monkeypatch.setattr(deep_reader_config, "VECTOR_INDEX_HNSW_THRESHOLD", 100)
+    monkeypatch.setattr(deep_reader_config, "VECTOR_INDEX_IVFPQ_THRESHOLD", 1000)
+
+
+def test_auto_selection_follows_thresholds(thresholds):
+    assert index_factory.resolve_index_type("auto", 99) == "flat"
+    assert index_factory.resolve_index_type("auto", 100) == "hnsw"
+    # ivfpq 训练样本不足（每个码字至少 39 个样本）时退化为 hnsw
+    assert index_factory.resolve_index_type("auto", 1000) == "hnsw"
+    assert index_factory.resolve_index_type("auto", 39 * 256) == "ivfpq"
+    assert index_factory.resolve_index_type("flat", 10 ** 6) == "flat"
+    with pytest.raises(ValueError):
+        index_factory.resolve_index_type("lsh", 10)
+
+
+@pytest.mark.parametrize("index_type, n_vectors", [("flat", 200), ("hnsw", 200), ("ivfpq", 39 * 256)])
+def test_built_index_round_trips_ids_and_finds_itself(index_type, n_vectors, monkeypatch):
+    # 单个 PQ 子量化器，训练最快
+    monkeypatch.setattr(deep_reader_config, "VECTOR_INDEX_PQ_M", 1)
+    vectors = _vectors(n_vectors)
+    ids = np.arange(1, n_vectors + 1, dtype="int64")
+    index = index_factory.build_index(index_type, DIMENSION, ids, vectors)
+    assert index_factory.index_type_of(index) == index_type
+    assert sorted(index_factory.stored_ids(index).tolist()) == ids.tolist()
+
+    _, found = index.search(vectors[:5], 1)
+    if index_type != "ivfpq":
+        assert found[:, 0].tolist() == ids[:5].tolist()
+
+    index, removed = index_factory.remove_ids(index, ids[:10])
+    assert removed == 10
+    assert index.ntotal == n_vectors - 10
+    assert not set(index_factory.stored_ids(index).tolist()) & set(ids[:10].tolist())
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_search_subset_only_returns_allowed_ids(index_type):
+    vectors = _vectors(200)
+    ids = np.arange(1, 201, dtype="int64")
+    index = index_factory.build_index(index_type, DIMENSION, ids, vectors)
+    allowed = np.array([7, 42, 150], dtype="int64")
+    _, found = index_factory.search_subset(index, vectors[:1], 5, allowed)
+    assert set(found[0][found[0] >= 0].tolist()) == set(allowed.tolist())
+    _, empty = index_factory.search_subset(index, vectors[:1], 5, np.array([], dtype="int64"))
+    assert (empty == -1).all()
+
+
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+def test_quantized_storage_is_detected(storage):
+    vectors = _vectors(300)
+    index = index_factory.build_index("flat", DIMENSION, np.arange(300, dtype="int64"), vectors, storage=storage)
+    assert index_factory.storage_of(index) == storage
+
+
+def test_store_rebuilds_to_hnsw_after_ingest(store_path, thresholds):
+    texts = [f"段落 {i}：关于第 {i % 13} 个主题的讨论 item{i}" for i in range(150)]
+    store = DeepReaderVectorStore(db_path=store_path)
+    store.add_texts(texts)
+    assert index_factory.index_type_of(store.index) == "hnsw"
+    assert store.similarity_search(texts[3], k=1)[0].page_content == texts[3]
+    store.close()
+
+    reopened = DeepReaderVectorStore(db_path=store_path, read_only=True)
+    assert index_factory.index_type_of(reopened.index) == "hnsw"
+    assert reopened.index.ntotal == len(texts)
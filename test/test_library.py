@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_library.py
+@time: 2025-12-10
+@desc: 多文档文库的测试：跨分片按距离合并、合并索引的 id 编码与过期回退、缺失分片跳过、分片维度校验
+"""
+import os
+
+import pytest
+
+from backend.components.library import DocumentLibrary, decode_id
+from backend.components.store_registry import get_store_registry
+from backend.components.vector_store import DeepReaderVectorStore
+
+DOCS = {
+    "annual": ["公司营收同比增长 20%", "毛利率提升到 35%", "海外业务收入翻倍"],
+    "research": ["行业竞争格局分析", "公司营收增长的主要驱动因素", "估值与风险提示"],
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_registry():
+    yield
+    get_store_registry().clear()
+
+
+@pytest.fixture
+def shards(tmp_path):
+    paths = {}
+    for label, texts in DOCS.items():
+        path = str(tmp_path / label)
+        store = DeepReaderVectorStore(db_path=path)
+        store.add_texts(texts, metadatas=[{"source_id": label, "chunk_index": i} for i in range(len(texts))])
+        store.close()
+        paths[label] = path
+    return paths
+
+
+@pytest.fixture
+def library(tmp_path, shards):
+    library = DocumentLibrary("reports", library_dir=str(tmp_path / "libraries"))
+    for label, path in shards.items():
+        library.add_shard(db_path=path, label=label)
+    return library
+
+
+def _hits(docs):
+    return [(doc.metadata["shard"], doc.page_content) for doc in docs]
+
+
+def test_decode_id_splits_shard_and_chunk():
+    assert decode_id((3 << 40) | 12345) == (3, 12345)
+
+
+def test_search_merges_shards_by_distance(library, shards):
+    docs = library.search("公司营收增长", k=4, search_type="vector")
+    distances = [doc.metadata["distance"] for doc in docs]
+    assert distances == sorted(distances)
+    assert {shard for shard, _ in _hits(docs)} == {"annual", "research"}
+    # 与分别检索每个分片后按距离合并的结果一致
+    expected = []
+    for label, path in shards.items():
+        with get_store_registry().lease(db_path=path, read_only=True) as store:
+            expected += [(doc.metadata["distance"], label, doc.page_content)
+                         for doc in store.similarity_search("公司营收增长", k=4)]
+    assert _hits(docs) == [(label, text) for _, label, text in sorted(expected)[:4]]
+
+
+def test_lexical_search_fuses_shard_rankings(library):
+    hits = _hits(library.search("营收", k=5, search_type="lexical"))
+    assert set(hits) == {("annual", "公司营收同比增长 20%"), ("research", "公司营收增长的主要驱动因素")}
+
+
+def test_consolidated_index_matches_sharded_search_until_a_shard_changes(library, shards):
+    sharded = _hits(library.search("毛利率", k=3, search_type="vector"))
+    assert library.consolidate(index_type="flat") == "flat"
+    with get_store_registry().lease(db_path=shards["annual"], read_only=True) as store:
+        assert library._consolidated_index([(library.shards[0], store)]) is None  # 分片不全时视为过期
+    assert _hits(library.search("毛利率", k=3, search_type="vector")) == sharded
+
+    # 分片入库后索引版本变化，合并索引过期，回退到逐分片检索
+    store = DeepReaderVectorStore(db_path=shards["research"])
+    store.add_texts(["毛利率承压"], metadatas=[{"source_id": "research", "chunk_index": 3}])
+    store.close()
+    get_store_registry().invalidate(db_path=shards["research"])
+    hits = _hits(library.search("毛利率", k=3, search_type="vector"))
+    assert ("research", "毛利率承压") in hits
+
+
+def test_library_definition_persists(library, tmp_path):
+    reloaded = DocumentLibrary("reports", library_dir=str(tmp_path / "libraries"))
+    assert [shard["label"] for shard in reloaded.shards] == ["annual", "research"]
+    assert [shard["shard_no"] for shard in reloaded.shards] == [0, 1]
+
+
+def test_missing_shard_is_skipped(library, shards):
+    for suffix in (".sqlite", ".faiss"):
+        os.remove(shards["research"] + suffix)
+    # 与 MemoryManager.delete_store 一样使池化的实例失效
+    get_store_registry().invalidate(db_path=shards["research"])
+    assert {shard for shard, _ in _hits(library.search("营收", k=5, search_type="vector"))} == {"annual"}
+
+
+def test_shards_must_share_the_embedding_space(library, tmp_path):
+    path = str(tmp_path / "other")
+    store = DeepReaderVectorStore(db_path=path, dimensions=64)
+    store.add_texts(["其他文档"])
+    store.close()
+    with pytest.raises(ValueError):
+        library.add_shard(db_path=path, label="other")
+    with pytest.raises(ValueError):
+        library.add_shard(db_path=path, label="annual")
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_llm_cache.py
+@time: 2025-12-10
+@desc: LLM 响应缓存的测试：缓存键、过期、按总大小 LRU 淘汰、按模型清理，以及命中缓存时跳过模型调用
+"""
+import pytest
+
+from backend.components import llm, llm_cache
+from backend.components.llm_cache import LLMResponseCache, llm_cache_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_cache, "time", clock)
+    return clock
+
+
+def _cache(tmp_path, **kwargs):
+    return LLMResponseCache(db_path=str(tmp_path / "llm_cache.sqlite"), **kwargs)
+
+
+def test_cache_key_depends_on_every_parameter():
+    base = ("fast_llm", "openai", "gpt", 0.5, {"top_p": 1}, "prompt")
+    key = llm_cache_key(*base)
+    assert llm_cache_key("fast_llm", "openai", "gpt", 0.5, {"top_p": 1}, "prompt") == key
+    for position, value in enumerate(("smart_llm", "google", "gpt-2", 0.7, {"top_p": 0.9}, "prompt 2")):
+        changed = list(base)
+        changed[position] = value
+        assert llm_cache_key(*changed) != key
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_hours=1)
+    cache.put("k", "fast_llm", "gpt", "answer")
+    assert cache.get("k") == "answer"
+    clock.now += 3600
+    assert cache.get("k") is None
+    # 过期条目读取时已删除
+    assert cache._bytes == 0
+
+
+def test_size_limit_evicts_least_recently_used(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_hours=None, max_mb=100 / (1024 * 1024))
+    for key in ("a", "b", "c"):
+        cache.put(key, "fast_llm", "gpt", "x" * 30)
+    cache.get("a")
+    cache.put("d", "fast_llm", "gpt", "x" * 30)
+    # 总大小 120 > 100：淘汰到不超过 90，只删除最久未访问的 b
+    assert [cache.get(key) is not None for key in ("a", "b", "c", "d")] == [True, False, True, True]
+    # 超过容量的单条响应不缓存
+    cache.put("huge", "fast_llm", "gpt", "x" * 200)
+    assert cache.get("huge") is None
+
+
+def test_clear_by_model(tmp_path, clock):
+    cache = _cache(tmp_path)
+    cache.put("a", "fast_llm", "gpt", "1")
+    cache.put("b", "smart_llm", "gemini", "2")
+    assert cache.clear(model="gpt") == 1
+    assert cache.get("a") is None and cache.get("b") == "2"
+
+
+@pytest.mark.asyncio
+async def test_call_llm_returns_cached_response_without_calling_the_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "_global_llm_cache", _cache(tmp_path))
+    calls = []
+
+    async def request():
+        calls.append(1)
+        return "model answer"
+
+    first = await llm._call_llm("fast_llm", "Fast LLM", "openai", "gpt", "prompt", request, use_cache=True)
+    second = await llm._call_llm("fast_llm", "Fast LLM", "openai", "gpt", "prompt", request, use_cache=True)
+    assert first == second == "model answer"
+    assert len(calls) == 1
+    # use_cache=False 绕过缓存
+    await llm._call_llm("fast_llm", "Fast LLM", "openai", "gpt", "prompt", request, use_cache=False)
+    assert len(calls) == 2
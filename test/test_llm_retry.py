@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_llm_retry.py
+@time: 2025-12-10
+@desc: LLM 调用重试的测试：底层异常的分类、可重试错误的退避重试次数、不可重试错误直接抛出，以及对冲请求
+"""
+import asyncio
+import socket
+
+import pytest
+
+from backend.components import llm
+from backend.components.llm_errors import (
+    LLMRateLimitError,
+    LLMRequestError,
+    LLMServerError,
+    LLMTimeoutError,
+    classify_llm_error,
+)
+from backend.config import deep_reader_config
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class APIStatusError(Exception):
+    """模拟 openai SDK 的 HTTP 状态异常：状态码和响应头在 response 上"""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = Response(status_code, headers)
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class ReadTimeout(Exception):
+    pass
+
+
+@pytest.mark.parametrize("error, expected", [
+    (APIStatusError(429, {"retry-after": "7"}), LLMRateLimitError),
+    (RateLimitError("quota"), LLMRateLimitError),
+    (APIStatusError(503), LLMServerError),
+    (APIStatusError(409), LLMServerError),
+    (ConnectionResetError("reset"), LLMServerError),
+    (socket.gaierror("dns"), LLMServerError),
+    (asyncio.TimeoutError(), LLMTimeoutError),
+    (ReadTimeout("slow"), LLMTimeoutError),
+    (APIStatusError(400), LLMRequestError),
+    (APIStatusError(401), LLMRequestError),
+    (FileNotFoundError("missing.json"), LLMRequestError),
+    (PermissionError("denied"), LLMRequestError),
+    (ValueError("bad argument"), LLMRequestError),
+])
+def test_classify_llm_error(error, expected):
+    classified = classify_llm_error(error, "fast_llm", "gpt")
+    assert type(classified) is expected
+    assert classified.retryable == (expected is not LLMRequestError)
+
+
+def test_retry_after_header_is_kept():
+    assert classify_llm_error(APIStatusError(429, {"retry-after": "7"})).retry_after == 7.0
+
+
+class FakeAsyncio:
+    """只替换 sleep，记录退避时长"""
+
+    def __init__(self):
+        self.sleeps = []
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    fake = FakeAsyncio()
+    monkeypatch.setattr(llm, "asyncio", fake)
+    monkeypatch.setattr(deep_reader_config, "LLM_MAX_RETRIES", 3)
+    monkeypatch.setattr(deep_reader_config, "LLM_RETRY_BASE_DELAY", 1.0)
+    monkeypatch.setattr(deep_reader_config, "LLM_RETRY_MAX_DELAY", 60.0)
+    return fake.sleeps
+
+
+def _failing(*errors, result="ok"):
+    """依次抛出 errors 中的异常，之后返回 result，并记录调用次数"""
+    errors = list(errors)
+    calls = []
+
+    async def request():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    return request, calls
+
+
+async def _call(request):
+    return await llm._call_with_retry("fast_llm", "gpt", "prompt", request, hedge=False)
+
+
+@pytest.mark.asyncio
+async def test_retryable_errors_are_retried_with_backoff(sleeps):
+    request, calls = _failing(APIStatusError(503), ConnectionResetError("reset"))
+    assert await _call(request) == "ok"
+    assert len(calls) == 3
+    # 全抖动：第 n 次重试等待 [0, base * 2^n]
+    assert 0 <= sleeps[0] <= 1.0 and 0 <= sleeps[1] <= 2.0
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries(sleeps):
+    request, calls = _failing(*[APIStatusError(500)] * 10)
+    with pytest.raises(LLMServerError):
+        await _call(request)
+    assert len(calls) == 4
+    assert len(sleeps) == 3
+
+
+@pytest.mark.asyncio
+async def test_request_errors_are_not_retried(sleeps):
+    request, calls = _failing(APIStatusError(400))
+    with pytest.raises(LLMRequestError):
+        await _call(request)
+    assert len(calls) == 1 and sleeps == []
+
+
+@pytest.mark.asyncio
+async def test_retry_after_sets_a_minimum_backoff(sleeps):
+    request, _ = _failing(APIStatusError(429, {"retry-after": "30"}))
+    assert await _call(request) == "ok"
+    assert sleeps == [30.0]
+
+
+@pytest.mark.asyncio
+async def test_empty_responses_are_retried(sleeps):
+    responses = ["", "  ", "answer"]
+
+    async def request():
+        return responses.pop(0)
+
+    assert await _call(request) == "answer"
+    assert len(sleeps) == 2
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_returns_the_first_success():
+    started = []
+
+    async def request():
+        started.append(1)
+        if len(started) == 1:
+            await asyncio.sleep(10)
+            return "slow"
+        return "fast"
+
+    limiter = llm.llm_scheduler.limiter("fast_llm")
+    wins = limiter.hedge_wins
+    assert await llm._hedged_attempt("fast_llm", "gpt", "prompt", request, delay=0.01) == "fast"
+    assert len(started) == 2
+    assert limiter.hedge_wins == wins + 1
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_llm_scheduler.py
+@time: 2025-12-10
+@desc: LLM 调用调度的测试：令牌桶的补充与透支、层级并发上限、按到达顺序放行、按每分钟请求数 / token 数等待
+"""
+import asyncio
+
+import pytest
+
+from backend.components import llm_scheduler
+from backend.components.llm_scheduler import TierLimiter, TokenBucket
+
+
+class FakeClock:
+    """替代 time 和 asyncio.sleep：sleep 只推进虚拟时间，记录每次等待的秒数"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+        await asyncio.sleep(0)
+
+
+class FakeAsyncio:
+    def __init__(self, clock):
+        self.sleep = clock.sleep
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_scheduler, "time", clock)
+    monkeypatch.setattr(llm_scheduler, "asyncio", FakeAsyncio(clock))
+    return clock
+
+
+def test_token_bucket_refills_and_allows_overdraft(clock):
+    bucket = TokenBucket(rate_per_minute=60, burst_seconds=10)
+    assert bucket.capacity == 10
+    assert bucket.wait_time(10, clock.now) == 0
+    bucket.take(10, clock.now)
+    assert bucket.wait_time(1, clock.now) == pytest.approx(1.0)
+    # 单次消耗超过容量时只需等到桶满，余额变为负数
+    assert bucket.wait_time(25, clock.now) == pytest.approx(10.0)
+    bucket.take(25, clock.now + 10)
+    assert bucket.wait_time(1, clock.now + 10) == pytest.approx(16.0)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_and_fifo_order():
+    limiter = TierLimiter("fast_llm", max_concurrency=2)
+    active = []
+    peak = []
+    started = []
+
+    async def call(i):
+        async with limiter.acquire():
+            started.append(i)
+            active.append(i)
+            peak.append(len(active))
+            await asyncio.sleep(0.001)
+            active.remove(i)
+
+    await asyncio.gather(*(call(i) for i in range(6)))
+    assert max(peak) == 2
+    assert started == list(range(6))
+    stats = limiter.stats()
+    assert stats["calls"] == 6 and stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_requests_per_minute_budget_spaces_out_calls(clock):
+    limiter = TierLimiter("smart_llm", rpm=60, burst_seconds=2)
+    for _ in range(4):
+        async with limiter.acquire():
+            pass
+    # 桶容量 2：前两次立即放行，之后每秒补充一次
+    assert clock.sleeps == [pytest.approx(1.0), pytest.approx(1.0)]
+
+
+@pytest.mark.asyncio
+async def test_token_budget_counts_prompt_and_output_tokens(clock):
+    limiter = TierLimiter("writer_llm", tpm=600, burst_seconds=10)
+    async with limiter.acquire(prompt_tokens=60) as lease:
+        lease.add_tokens(40)
+    # 容量 100 已用完，每秒补充 10 个 token
+    async with limiter.acquire(prompt_tokens=50):
+        pass
+    assert clock.sleeps == [pytest.approx(5.0)]
+
+
+@pytest.mark.asyncio
+async def test_failed_call_releases_its_slot():
+    limiter = TierLimiter("fast_llm", max_concurrency=1)
+    with pytest.raises(RuntimeError):
+        async with limiter.acquire():
+            raise RuntimeError("request failed")
+    async with limiter.acquire():
+        pass
+    assert limiter.latency_percentile(0.5) is not None
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_memory_manager.py
+@time: 2025-12-10
+@desc: memory 目录管理的测试：按最近访问时间回收到配额以内、跳过正在使用 / 被文库引用 / 入库未完成 / 最近访问的库，
+       以及压缩时移除没有对应块的残留向量
+"""
+import os
+import sqlite3
+import time
+
+import pytest
+
+from backend.components import document_cache, index_factory
+from backend.components.document_cache import DocumentManifest
+from backend.components.library import DocumentLibrary
+from backend.components.memory_manager import MemoryManager
+from backend.components.store_access import get_store_access_log, store_key
+from backend.components.store_registry import get_store_registry
+from backend.components.vector_store import DeepReaderVectorStore, read_store_meta
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch, tmp_path):
+    monkeypatch.setattr(document_cache, "_global_manifest", DocumentManifest(str(tmp_path / "manifest.json")))
+    yield
+    get_store_registry().clear()
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return MemoryManager(memory_dir=str(tmp_path / "memory"), library_dir=str(tmp_path / "libraries"))
+
+
+def _make_store(manager, name, texts=("营收增长", "毛利率提升", "现金流改善")):
+    base = os.path.join(manager.memory_dir, name)
+    store = DeepReaderVectorStore(db_path=base)
+    store.add_texts(list(texts))
+    store.close()
+    return base
+
+
+def _set_last_access(base, timestamp):
+    log = get_store_access_log()
+    log._conn.execute("INSERT OR REPLACE INTO store_access (store, last_access) VALUES (?, ?)", (store_key(base), timestamp))
+    log._conn.commit()
+
+
+def _exists(base):
+    return os.path.exists(f"{base}.sqlite") or os.path.exists(f"{base}.faiss")
+
+
+def test_gc_evicts_least_recently_used_until_under_quota(manager):
+    bases = {name: _make_store(manager, name) for name in ("a", "b", "c")}
+    for timestamp, name in enumerate(("b", "a", "c"), start=1):
+        _set_last_access(bases[name], timestamp)
+    stores = {s["name"]: s for s in manager.stats()["stores"]}
+    total = sum(s["total_bytes"] for s in stores.values())
+    # 删除最久未访问的 b 后即不超过配额
+    quota_mb = (total - stores["b"]["total_bytes"]) / (1024 * 1024)
+
+    plan = manager.gc(quota_mb=quota_mb, min_idle_hours=0, dry_run=True)
+    assert [e["name"] for e in plan["evicted"]] == ["b"]
+    assert _exists(bases["b"])
+
+    report = manager.gc(quota_mb=quota_mb, min_idle_hours=0)
+    assert [e["name"] for e in report["evicted"]] == ["b"]
+    assert report["bytes_after"] <= quota_mb * 1024 * 1024
+    assert [_exists(bases[name]) for name in ("a", "b", "c")] == [True, False, True]
+    assert store_key(bases["b"]) not in get_store_access_log().last_access()
+
+
+def test_gc_skips_protected_stores(manager):
+    bases = {name: _make_store(manager, name) for name in ("leased", "shard", "pending", "recent", "victim")}
+    DocumentLibrary("reports", library_dir=manager.library_dir).add_shard(db_path=bases["shard"], label="shard")
+    conn = sqlite3.connect(f"{bases['pending']}.sqlite")
+    conn.execute("INSERT INTO ingest_progress (ingest_id, next_offset, total, completed) VALUES ('job', 1, 3, 0)")
+    conn.commit()
+    conn.close()
+
+    with get_store_registry().lease(db_path=bases["leased"], read_only=True):
+        for name, base in bases.items():
+            _set_last_access(base, time.time() if name == "recent" else 1)
+        report = manager.gc(quota_mb=0, min_idle_hours=1)
+
+    assert [e["name"] for e in report["evicted"]] == ["victim"]
+    assert report["skipped"] == {
+        "leased": "in_use",
+        "shard": "library:reports",
+        "pending": "pending_ingest",
+        "recent": "recent",
+    }
+    assert [name for name, base in bases.items() if _exists(base)] == ["leased", "shard", "pending", "recent"]
+
+
+def test_compact_store_removes_orphan_vectors(manager):
+    base = _make_store(manager, "doc")
+    conn = sqlite3.connect(f"{base}.sqlite")
+    version = read_store_meta(conn).get("index_version")
+    conn.execute("DELETE FROM chunks WHERE content = '毛利率提升'")
+    conn.commit()
+    conn.close()
+
+    stats = manager.store_stats(base)
+    assert stats["orphan_vectors"] == 1 and stats["needs_compaction"]
+
+    report = manager.compact_store(base)
+    assert report["removed_vectors"] == 1
+    index = index_factory.read_index_mmap(f"{base}.faiss")
+    assert index.ntotal == 2
+    del index
+    conn = sqlite3.connect(f"{base}.sqlite")
+    assert read_store_meta(conn).get("index_version") != version
+    conn.close()
+    assert not manager.store_stats(base)["needs_compaction"]
+
+    store = DeepReaderVectorStore(db_path=base)
+    assert sorted(doc.page_content for doc in store.similarity_search("营收", k=5)) == ["现金流改善", "营收增长"]
+    store.close()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_parent_child.py
+@time: 2025-12-10
+@desc: 父子分块的测试：子块不跨越父窗口、偏移与父窗口一致，检索时命中的子块替换为去重后的父窗口
+"""
+import pytest
+
+from backend.components.vector_store import DeepReaderVectorStore
+from backend.config import deep_reader_config
+from backend.graph.actions.rag_actions import chunk_document_parent_child, split_document
+
+SECTIONS = {
+    "营收": "公司营收同比增长，主要来自海外业务。" * 6,
+    "利润": "毛利率提升到百分之三十五，费用率下降。" * 6,
+    "现金流": "经营现金流改善，资本开支保持稳定。" * 6,
+}
+MARKDOWN = "\n\n".join(f"## {title}\n\n{body}" for title, body in SECTIONS.items())
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(deep_reader_config, "RAG_PARENT_CHUNK_SIZE", 150)
+    monkeypatch.setattr(deep_reader_config, "RAG_CHILD_CHUNK_SIZE", 40)
+
+
+def test_children_stay_inside_their_parent(small_chunks):
+    children, parents = chunk_document_parent_child(MARKDOWN, "report")
+    assert len(children) > len(parents)
+    assert [p["metadata"]["parent_index"] for p in parents] == list(range(len(parents)))
+    assert [p["metadata"]["section"] for p in parents] == list(SECTIONS)
+    assert [c["metadata"]["chunk_index"] for c in children] == list(range(len(children)))
+    for parent in parents:
+        start = parent["metadata"]["start_index"]
+        assert MARKDOWN[start:start + len(parent["content"])] == parent["content"]
+    for child in children:
+        parent = parents[child["metadata"]["parent_index"]]
+        assert child["content"] in parent["content"]
+        start = child["metadata"]["start_index"]
+        assert MARKDOWN[start:start + len(child["content"])] == child["content"]
+        assert child["metadata"]["section"] == parent["metadata"]["section"]
+
+
+def test_split_document_defaults_to_flat_chunks():
+    chunks, parents = split_document(MARKDOWN, "report")
+    assert parents == [] and all("parent_index" not in c["metadata"] for c in chunks)
+
+
+def test_hits_are_replaced_by_deduplicated_parents(small_chunks, store_path):
+    children, parents = chunk_document_parent_child(MARKDOWN, "report")
+    store = DeepReaderVectorStore(db_path=store_path)
+    store.add_parents(parents)
+    store.add_texts([c["content"] for c in children], metadatas=[c["metadata"] for c in children])
+
+    hits = store.similarity_search("毛利率提升 费用率下降", k=len(children))
+    expanded = store.expand_parents_batch([hits])[0]
+    parent_indices = [doc.metadata["parent_index"] for doc in expanded]
+    # 每个父窗口只出现一次，按其最靠前的子块排序
+    assert sorted(parent_indices) == list(range(len(parents)))
+    first_seen = list(dict.fromkeys(doc.metadata["parent_index"] for doc in hits))
+    assert parent_indices == first_seen
+    for doc in expanded:
+        assert doc.metadata["parent"] is True
+        assert doc.page_content == parents[doc.metadata["parent_index"]]["content"]
+        child_hits = [hit for hit in hits if hit.metadata["parent_index"] == doc.metadata["parent_index"]]
+        assert sorted(doc.metadata["chunk_ids"]) == sorted(hit.metadata["chunk_id"] for hit in child_hits)
+        assert doc.metadata["distance"] == min(hit.metadata["distance"] for hit in child_hits)
+    store.close()
+
+
+def test_flat_store_leaves_hits_unchanged(store_path):
+    store = DeepReaderVectorStore(db_path=store_path)
+    store.add_texts(["营收增长", "毛利率提升"])
+    hits = store.similarity_search("营收", k=2)
+    assert store.expand_parents_batch([hits]) == [hits]
+    store.close()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_query_cache.py
+@time: 2025-12-10
+@desc: 检索结果缓存的测试：查询规范化、索引版本变化后清除旧条目、LRU 淘汰，以及向量库重复查询跳过 Embedding 请求
+"""
+import pytest
+
+from backend.components import query_cache
+from backend.components.query_cache import QueryCache
+from backend.components.vector_store import DeepReaderVectorStore
+from backend.config import deep_reader_config
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_cache, "time", Clock())
+    return QueryCache(db_path=str(tmp_path / "query_cache.sqlite"), max_entries=10)
+
+
+def test_hits_round_trip_and_whitespace_is_normalized(cache):
+    cache.put_many("store", "v1", "vector|k=3", ["营收  增长 "], [[(3, 0.25), (7, None)]])
+    assert cache.get_many("store", "v1", "vector|k=3", ["营收 增长", "其他"]) == [[(3, 0.25), (7, None)], None]
+    assert cache.get_many("store", "v1", "vector|k=5", ["营收 增长"]) == [None]
+
+
+def test_new_version_purges_old_entries_of_the_same_store(cache):
+    cache.put_many("a", "v1", "p", ["q"], [[(1, None)]])
+    cache.put_many("b", "v1", "p", ["q"], [[(2, None)]])
+    cache.put_many("a", "v2", "p", ["q"], [[(3, None)]])
+    assert cache.get_many("a", "v1", "p", ["q"]) == [None]
+    assert cache.get_many("a", "v2", "p", ["q"]) == [[(3, None)]]
+    assert cache.get_many("b", "v1", "p", ["q"]) == [[(2, None)]]
+    assert cache.purge_store("a") == 1
+    assert cache.get_many("a", "v2", "p", ["q"]) == [None]
+
+
+def test_eviction_drops_least_recently_used_entries(cache):
+    queries = [f"q{i}" for i in range(10)]
+    cache.put_many("s", "v", "p", queries, [[(i, None)] for i in range(10)])
+    cache.get_many("s", "v", "p", ["q0"])
+    cache.put_many("s", "v", "p", ["new"], [[(99, None)]])
+    remaining = cache.get_many("s", "v", "p", queries)
+    assert [q for q, hits in zip(queries, remaining) if hits is None] == ["q1", "q2"]
+
+
+class CountingEmbeddings:
+    def __init__(self, model):
+        self.model = model
+        self.queries = 0
+
+    def embed_documents(self, texts):
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text):
+        self.queries += 1
+        return self.model.embed_query(text)
+
+
+def test_store_reuses_cached_results_until_the_index_changes(store_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(deep_reader_config, "RAG_QUERY_CACHE_ENABLED", True)
+    monkeypatch.setattr(query_cache, "_global_query_cache", QueryCache(db_path=str(tmp_path / "qc.sqlite")))
+    store = DeepReaderVectorStore(db_path=store_path)
+    store.add_texts(["公司营收同比增长", "毛利率提升", "现金流改善"])
+    store.embedding_model = CountingEmbeddings(store.embedding_model)
+
+    first = store.similarity_search("营收增长", k=2)
+    second = store.similarity_search("营收增长", k=2)
+    assert store.embedding_model.queries == 1
+    assert [doc.page_content for doc in second] == [doc.page_content for doc in first]
+
+    # 入库生成新的索引版本，之前的缓存结果失效
+    store.add_texts(["营收增长来自新业务"])
+    store.similarity_search("营收增长", k=2)
+    assert store.embedding_model.queries == 2
+    store.close()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_retrieval_context.py
+@time: 2025-12-10
+@desc: pack_context 按 token 预算装配检索上下文的测试
+"""
+from langchain_core.documents import Document
+
+from backend.components.retrieval_context import CONTEXT_SEPARATOR, join_context, pack_context
+from backend.components.token_counter import get_token_counter
+
+
+def _doc(chunk_index, text, distance=None):
+    metadata = {"source_id": "doc", "chunk_index": chunk_index, "chunk_id": chunk_index + 1}
+    if distance is not None:
+        metadata["distance"] = distance
+    return Document(page_content=text, metadata=metadata)
+
+
+def _passage(tag, words):
+    return " ".join(f"{tag}{i}" for i in range(words))
+
+
+def _tokens(docs):
+    return get_token_counter().count_tokens(join_context(docs))
+
+
+def test_pack_context_stays_within_budget_and_keeps_rank_order():
+    hits = [_doc(i * 10, _passage(name, 40)) for i, name in enumerate(("alpha", "beta", "gamma", "delta"))]
+    budget = get_token_counter().count_tokens(hits[0].page_content) * 2 + 10
+    packed = pack_context(hits, budget)
+    assert [doc.page_content for doc in packed] == [hits[0].page_content, hits[1].page_content]
+    assert _tokens(packed) <= budget
+
+
+def test_pack_context_skips_passages_that_do_not_fit():
+    long_hit = _doc(10, _passage("long", 200))
+    short_hit = _doc(30, _passage("short", 10))
+    first = _doc(0, _passage("first", 20))
+    budget = get_token_counter().count_tokens(first.page_content + CONTEXT_SEPARATOR + short_hit.page_content) + 5
+    packed = pack_context([first, long_hit, short_hit], budget)
+    assert [doc.page_content for doc in packed] == [first.page_content, short_hit.page_content]
+
+
+def test_pack_context_truncates_oversized_top_hit():
+    packed = pack_context([_doc(0, _passage("huge", 500))], 50)
+    assert len(packed) == 1
+    assert packed[0].metadata["truncated"] is True
+    assert get_token_counter().count_tokens(packed[0].page_content) <= 50
+
+
+def test_pack_context_adds_neighbors_only_within_budget():
+    hit = _doc(5, _passage("hit", 20))
+    before = _doc(4, _passage("before", 20))
+    after = _doc(6, _passage("after", 20))
+    counter = get_token_counter()
+    roomy = pack_context([hit], 10_000, neighbors=[before, after])
+    # 相邻块与命中块合并为一个连续片段
+    assert len(roomy) == 1
+    assert roomy[0].metadata["chunk_index"] == 4 and roomy[0].metadata["chunk_index_end"] == 6
+
+    tight = pack_context([hit], counter.count_tokens(hit.page_content) + 2, neighbors=[before, after])
+    assert [doc.page_content for doc in tight] == [hit.page_content]
+
+
+def test_pack_context_drops_near_duplicates():
+    text = _passage("same", 30)
+    packed = pack_context([_doc(0, text, 0.1), _doc(20, text, 0.2)], 10_000)
+    assert len(packed) == 1
+    assert packed[0].metadata["distance"] == 0.1
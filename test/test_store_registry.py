@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_store_registry.py
+@time: 2025-12-10
+@desc: VectorStoreRegistry 的测试：按 db 复用实例、引用计数、LRU 淘汰只关闭未被引用的实例、失效后延迟关闭
+"""
+import pytest
+
+from backend.components.store_registry import VectorStoreRegistry
+from backend.components.vector_store import DeepReaderVectorStore
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    """在临时目录中创建带一个块的向量库，返回其路径前缀"""
+    def make(name):
+        path = str(tmp_path / name)
+        store = DeepReaderVectorStore(db_path=path)
+        store.add_texts([f"{name} 的内容"])
+        store.close()
+        return path
+    return make
+
+
+def _closed(store):
+    return store._conn is None
+
+
+def test_acquire_reuses_instance_and_counts_references(make_store):
+    path = make_store("a")
+    registry = VectorStoreRegistry(max_size=4)
+    first = registry.acquire(db_path=path)
+    second = registry.acquire(db_path=path)
+    assert first is second
+    assert registry.stats() == {f"path:{path}": 2}
+    assert registry.leased_paths() == {first.db_path}
+
+    registry.release(first)
+    registry.release(second)
+    assert registry.stats() == {f"path:{path}": 0}
+    assert registry.leased_paths() == set()
+    assert not _closed(first)
+
+
+def test_read_only_instances_are_pooled_separately(make_store):
+    path = make_store("a")
+    registry = VectorStoreRegistry(max_size=4)
+    with registry.lease(db_path=path) as writable, registry.lease(db_path=path, read_only=True) as read_only:
+        assert writable is not read_only
+        assert read_only.read_only
+    assert set(registry.stats()) == {f"path:{path}", f"path:{path}:ro"}
+
+
+def test_lru_eviction_skips_leased_instances(make_store):
+    paths = [make_store(name) for name in ("a", "b", "c")]
+    registry = VectorStoreRegistry(max_size=2)
+    leased = registry.acquire(db_path=paths[0])
+    with registry.lease(db_path=paths[1]) as second:
+        pass
+    with registry.lease(db_path=paths[2]):
+        pass
+    # 容量为 2：最久未使用且未被引用的 b 被关闭，仍被引用的 a 保留
+    assert _closed(second)
+    assert set(registry.stats()) == {f"path:{paths[0]}", f"path:{paths[2]}"}
+    assert not _closed(leased)
+    registry.release(leased)
+
+
+def test_invalidate_closes_after_last_release(make_store):
+    path = make_store("a")
+    registry = VectorStoreRegistry(max_size=4)
+    store = registry.acquire(db_path=path)
+    registry.invalidate(db_path=path)
+    assert registry.stats() == {}
+    assert not _closed(store)
+
+    fresh = registry.acquire(db_path=path)
+    assert fresh is not store
+    registry.release(store)
+    assert _closed(store)
+    registry.release(fresh)
+    assert not _closed(fresh)
+
+
+@pytest.mark.asyncio
+async def test_alease_releases_on_exit(make_store):
+    path = make_store("a")
+    registry = VectorStoreRegistry(max_size=4)
+    async with registry.alease(db_path=path, read_only=True) as store:
+        assert registry.stats() == {f"path:{path}:ro": 1}
+        assert store.index.ntotal == 1
+    assert registry.stats() == {f"path:{path}:ro": 0}
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_structured_output.py
+@time: 2025-12-10
+@desc: 结构化输出的测试：本地解析与形状纠正，以及 _repair_items 只把不合格的数组元素发回模型修正
+"""
+import json
+
+import pytest
+
+from backend.components import llm
+from backend.components.llm_errors import LLMRequestError, LLMStructuredOutputError
+from backend.components.structured_output import coerce_shape, extract_json, rejects_structured_output
+from backend.config import deep_reader_config
+from backend.schemas import ChapterAnalysis, ReadingAgentOutput, ReviewerAnswer
+
+
+def _chapter(title, summary="summary"):
+    return {"title": title, "chapter_summary": summary, "questions": ["q"]}
+
+
+class RepairStub:
+    """替代 llm._request_repair：按顺序返回预设的修正结果，并记录每次发回修正的内容"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    async def __call__(self, tier, label, llm_provider, llm_model, schema, content, errors, use_cache):
+        self.requests.append(content)
+        return self.responses.pop(0)
+
+
+async def _repair(data):
+    return await llm._repair_items(
+        "fast_llm", "Fast LLM", "openai", "test-model", ReadingAgentOutput, ChapterAnalysis, data, False
+    )
+
+
+def test_extract_json_strips_code_fence_and_repairs():
+    assert extract_json('```json\n[{"title": "a",}]\n```') == [{"title": "a"}]
+    assert extract_json("not json at all") is None
+
+
+def test_coerce_shape_unwraps_and_wraps_lists():
+    assert coerce_shape({"chapters": [_chapter("a")]}, ReadingAgentOutput) == [_chapter("a")]
+    assert coerce_shape(_chapter("a"), ReadingAgentOutput) == [_chapter("a")]
+    assert coerce_shape([{"question": "q"}], ReviewerAnswer) == {"question": "q"}
+
+
+def test_rejects_structured_output_matches_only_parameter_errors():
+    assert rejects_structured_output(LLMRequestError("Invalid parameter: 'response_format' is not supported"))
+    assert rejects_structured_output(LLMRequestError("Unknown name \"responseSchema\" at 'generation_config'"))
+    assert not rejects_structured_output(LLMRequestError("The prompt was blocked by safety filters"))
+    assert not rejects_structured_output(LLMRequestError("maximum context length is 128000 tokens"))
+
+
+@pytest.mark.asyncio
+async def test_repair_items_resends_only_invalid_items(monkeypatch):
+    monkeypatch.setattr(deep_reader_config, "LLM_STRUCTURED_REPAIR_ATTEMPTS", 2)
+    stub = RepairStub(json.dumps([_chapter("b-fixed")]))
+    monkeypatch.setattr(llm, "_request_repair", stub)
+
+    result = await _repair([_chapter("a"), {"title": "b"}, _chapter("c")])
+
+    assert stub.requests == [[{"title": "b"}]]
+    assert [chapter.title for chapter in result.root] == ["a", "b-fixed", "c"]
+
+
+@pytest.mark.asyncio
+async def test_repair_items_drops_items_that_stay_invalid(monkeypatch):
+    monkeypatch.setattr(deep_reader_config, "LLM_STRUCTURED_REPAIR_ATTEMPTS", 2)
+    # 第一次修正结果的数量对不上，第二次仍不合格
+    stub = RepairStub("[]", json.dumps([{"title": "still broken"}]))
+    monkeypatch.setattr(llm, "_request_repair", stub)
+
+    result = await _repair([_chapter("a"), {"title": "b"}])
+
+    assert len(stub.requests) == 2
+    assert [chapter.title for chapter in result.root] == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_repair_items_raises_when_nothing_is_valid(monkeypatch):
+    monkeypatch.setattr(deep_reader_config, "LLM_STRUCTURED_REPAIR_ATTEMPTS", 1)
+    monkeypatch.setattr(llm, "_request_repair", RepairStub(json.dumps([{"title": "x"}])))
+
+    with pytest.raises(LLMStructuredOutputError):
+        await _repair([{"title": "x"}])
+
+
+@pytest.mark.asyncio
+async def test_repair_items_keeps_extra_keys(monkeypatch):
+    monkeypatch.setattr(llm, "_request_repair", RepairStub())
+
+    result = await _repair([{**_chapter("a"), "page": 3}])
+
+    assert result.model_dump() == [{**_chapter("a"), "page": 3}]
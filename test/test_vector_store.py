@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_vector_store.py
+@time: 2025-12-10
+@desc: DeepReaderVectorStore 的离线测试：可续传入库（进程内失败 / 落盘前中断）、全文检索与混合检索
+"""
+import pytest
+
+from backend.components.vector_store import DeepReaderVectorStore, reciprocal_rank_fusion
+from backend.config import deep_reader_config
+
+TEXTS = [f"第 {i} 段：公司 {i % 7} 号业务线的收入与利润分析，编号 item{i:03d}" for i in range(95)]
+
+
+class FlakyEmbeddings:
+    """包装 Embedding 模型：第 fail_at 次 embed_documents 调用时抛出异常，并统计调用次数"""
+
+    def __init__(self, model, fail_at=None):
+        self.model = model
+        self.fail_at = fail_at
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise RuntimeError("embedding request failed")
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.model.embed_query(text)
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    """每批 10 个块、每 3 批落盘一次，95 个块共 10 批"""
+    monkeypatch.setattr(deep_reader_config, "EMBEDDING_BATCH_MAX_ITEMS", 10)
+    monkeypatch.setattr(deep_reader_config, "VECTOR_INDEX_FLUSH_BATCHES", 3)
+
+
+def _row_count(store):
+    return store._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def test_resume_after_failure_skips_committed_batches(store_path, small_batches):
+    store = DeepReaderVectorStore(db_path=store_path)
+    store.embedding_model = FlakyEmbeddings(store.embedding_model, fail_at=5)
+    with pytest.raises(RuntimeError):
+        store.add_texts(TEXTS, resumable=True)
+    assert _row_count(store) == 40
+    assert DeepReaderVectorStore.has_pending_ingest(store.db_path)
+    store.close()
+
+    resumed = DeepReaderVectorStore(db_path=store_path)
+    assert resumed.index.ntotal == 40
+    resumed.embedding_model = FlakyEmbeddings(resumed.embedding_model)
+    added = resumed.add_texts(TEXTS, resumable=True)
+    assert len(added) == 55
+    assert resumed.embedding_model.calls == 6
+    assert _row_count(resumed) == resumed.index.ntotal == len(TEXTS)
+    assert not DeepReaderVectorStore.has_pending_ingest(resumed.db_path)
+    # 再次以相同输入入库时直接跳过
+    assert resumed.add_texts(TEXTS, resumable=True) == []
+
+
+def test_unflushed_batches_roll_back_on_reopen(store_path, small_batches):
+    store = DeepReaderVectorStore(db_path=store_path)
+    store.embedding_model = FlakyEmbeddings(store.embedding_model, fail_at=8)
+    # 模拟进程在失败后直接退出：最后一次落盘之后的批次没有写入 FAISS 文件
+    store._flush_pending = lambda: None
+    with pytest.raises(RuntimeError):
+        store.add_texts(TEXTS, resumable=True)
+    assert _row_count(store) == 70
+    store._conn.close()
+
+    reopened = DeepReaderVectorStore(db_path=store_path)
+    assert _row_count(reopened) == reopened.index.ntotal == 60
+    reopened.embedding_model = FlakyEmbeddings(reopened.embedding_model)
+    reopened.add_texts(TEXTS, resumable=True)
+    assert reopened.embedding_model.calls == 4
+    contents = [row[0] for row in reopened._conn.execute("SELECT content FROM chunks ORDER BY id")]
+    assert contents == TEXTS
+    assert reopened.index.ntotal == len(TEXTS)
+    reopened.close()
+
+
+@pytest.fixture
+def filled_store(store_path):
+    store = DeepReaderVectorStore(db_path=store_path)
+    texts = [
+        "GE reported strong results in its aviation segment",
+        "a general discussion of macro trends without tickers",
+        "5G rollout reached 70% coverage by year end",
+        "公司营收同比增长显著，毛利率提升",
+        "revenue of 1970 units was recorded",
+        "AAPL 600519 cross holdings overview",
+    ]
+    store.add_texts(texts, metadatas=[{"source_id": "doc", "chunk_index": i} for i in range(len(texts))])
+    yield store
+    store.close()
+
+
+def _contents(docs):
+    return [doc.page_content for doc in docs]
+
+
+def test_lexical_search_matches_exact_terms(filled_store):
+    assert _contents(filled_store.lexical_search("600519", k=3)) == ["AAPL 600519 cross holdings overview"]
+    assert _contents(filled_store.lexical_search("营收同比增长", k=3)) == ["公司营收同比增长显著，毛利率提升"]
+    assert filled_store.lexical_search("nonexistentterm", k=3) == []
+
+
+def test_lexical_search_matches_short_tokens(filled_store):
+    # 两字符的代码和数字不能由 trigram 全文索引匹配，改用区分大小写的子串匹配
+    assert _contents(filled_store.lexical_search("GE", k=3)) == ["GE reported strong results in its aviation segment"]
+    hits = _contents(filled_store.lexical_search("5G 70", k=3))
+    assert hits[0] == "5G rollout reached 70% coverage by year end"
+    assert "revenue of 1970 units was recorded" in hits
+
+
+def test_lexical_search_respects_filter(filled_store):
+    assert filled_store.lexical_search("GE", k=3, filter={"chunk_index": {"$gte": 1}}) == []
+
+
+def test_hybrid_search_fuses_vector_and_lexical(filled_store):
+    docs = filled_store.similarity_search("AAPL 600519", k=3, search_type="hybrid")
+    assert docs[0].page_content == "AAPL 600519 cross holdings overview"
+    assert len({doc.metadata["chunk_id"] for doc in docs}) == len(docs)
+    # 向量检索命中的块附带距离
+    assert all("distance" in doc.metadata for doc in filled_store.similarity_search("AAPL", k=3))
+
+
+def test_reciprocal_rank_fusion_prefers_items_ranked_in_both_lists():
+    assert reciprocal_rank_fusion([[1, 2, 3], [3, 4, 1]], k=2, rrf_k=60) == [1, 3]
+    assert reciprocal_rank_fusion([[5], []], k=3, rrf_k=60) == [5]
+
+
+def test_open_does_not_hold_a_write_transaction(store_path):
+    store = DeepReaderVectorStore(db_path=store_path)
+    store.add_texts(TEXTS[:3])
+    store.close()
+    first = DeepReaderVectorStore(db_path=store_path)
+    # 第二个可写实例打开时会写入 ingest_progress，第一个实例不能持有未提交的事务
+    second = DeepReaderVectorStore(db_path=store_path)
+    assert not first._conn.in_transaction and not second._conn.in_transaction
+    first.close()
+    second.close()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+@author: FinAI-Chat
+@file: test_writing_actions.py
+@time: 2025-12-10
+@desc: 写作研讨会各 Action 在 LLM 调用用尽重试后的降级行为：记录错误并返回兜底内容，不中断报告生成
+"""
+import pytest
+
+from backend.components.llm_errors import LLMServerError
+from backend.graph.actions import writing_actions
+
+
+async def _failing_llm(prompt, *args, **kwargs):
+    raise LLMServerError("503 Service Unavailable", "smart_llm", "test-model", 503)
+
+
+@pytest.fixture
+def failing_smart_llm(monkeypatch):
+    monkeypatch.setattr(writing_actions, "call_smart_llm", _failing_llm)
+
+
+@pytest.mark.asyncio
+async def test_analyze_narrative_flow_returns_error_text(failing_smart_llm):
+    outline = await writing_actions.analyze_narrative_flow_action({"第一章": "摘要"})
+    assert outline.startswith("Error getting a valid narrative outline")
+
+
+@pytest.mark.asyncio
+async def test_critique_returns_empty_feedback(failing_smart_llm):
+    feedback = await writing_actions.critique_and_refine_action(
+        current_keys={"key_idea": "idea"},
+        raw_reviewer_outputs=[],
+        background_summary="",
+        user_core_question="question",
+    )
+    assert feedback == ""